@@ -0,0 +1,256 @@
+# Amazon検索結果の永続キャッシュ
+#
+# 型番 → {価格, URL, 取得日時, 見つからなかったか} を SQLite に保存し、
+# 同じ型番の再検索でブラウザを起動しないようにする。
+# あわせて型番 → ASIN (検索結果から選んだ商品) の索引を持ち、期限切れの再取得では
+# 検索をやり直さず商品ページ (/dp/<ASIN>) から価格を取り直せるようにする。
+import concurrent.futures
+import logging
+import sqlite3
+import threading
+import time
+
+import config
+import normalize
+
+# キャッシュの参照結果
+HIT = 'hit'          # 有効期限内のデータを返した
+STALE = 'stale'      # 期限切れのデータを返し、裏で再取得した
+MISS = 'miss'        # Amazonを検索した
+HISTORY = 'history'  # 差分検索で価格履歴の前回観測値を使った (キャッシュ・販売先とも参照せず)
+
+
+def normalize_key(model_number: str) -> str:
+    """型番をキャッシュキーに正規化する (normalize.product_key と同じキーになる)"""
+    return normalize.normalize_key(model_number)
+
+
+class LookupStats:
+    """1回の検索における、販売先1つ分のキャッシュのヒット・ミス件数 (スレッドセーフ)"""
+
+    def __init__(self, label: str = 'Amazon'):
+        self.label = label
+        self._lock = threading.Lock()
+        self.counts = {HIT: 0, STALE: 0, MISS: 0, HISTORY: 0}
+
+    def record(self, outcome: str):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def summary(self) -> str:
+        total = sum(self.counts.values())
+        hits = self.counts[HIT] + self.counts[STALE]
+        rate = (hits / total * 100) if total else 0.0
+        return (f"{self.label}キャッシュ: ヒット{self.counts[HIT]}件, 期限切れ{self.counts[STALE]}件, "
+                f"ミス{self.counts[MISS]}件, 前回値を流用{self.counts[HISTORY]}件 (ヒット率 {rate:.1f}%)")
+
+
+class AmazonCache:
+    """
+    SQLiteによるAmazon検索結果キャッシュ。
+    - カテゴリごとの有効期限 (見つからなかった結果は別の短い期限)
+    - 件数上限を超えたら最終参照日時の古いものから削除 (LRU)
+    - stale-while-revalidate: 期限切れでも猶予期間内なら古い値を返し、裏で再取得する
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS amazon_cache (
+                key TEXT PRIMARY KEY,
+                category TEXT,
+                price INTEGER,
+                url TEXT,
+                miss INTEGER NOT NULL DEFAULT 0,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_amazon_cache_accessed ON amazon_cache (accessed_at)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS amazon_asin_index (
+                key TEXT PRIMARY KEY,
+                asin TEXT NOT NULL,
+                title TEXT,
+                score REAL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+        self._puts_since_evict = 0
+        self._refreshing = set()
+        self._refresh_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=config.AMAZON_CACHE_REFRESH_WORKERS, thread_name_prefix='amazon-cache-refresh'
+        )
+
+    @staticmethod
+    def _ttl(category: str, miss: bool) -> float:
+        if miss:
+            return config.AMAZON_CACHE_NEGATIVE_TTL
+        return config.AMAZON_CACHE_TTL_BY_CATEGORY.get(category, config.AMAZON_CACHE_TTL_DEFAULT)
+
+    def get(self, key: str, category: str = None):
+        """
+        キャッシュを参照し、(エントリ, 経過状態) を返す。
+        経過状態は 'fresh' / 'stale' (猶予期間内) / None (なし・完全に期限切れ)。
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT price, url, miss, fetched_at FROM amazon_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None, None
+            self._conn.execute("UPDATE amazon_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+
+        price, url, miss, fetched_at = row
+        entry = {'price': price, 'url': url, 'miss': bool(miss), 'fetched_at': fetched_at}
+        age = now - fetched_at
+        ttl = self._ttl(category, entry['miss'])
+        if age <= ttl:
+            return entry, 'fresh'
+        if config.AMAZON_CACHE_STALE_WHILE_REVALIDATE and age <= ttl + config.AMAZON_CACHE_STALE_GRACE:
+            return entry, 'stale'
+        return entry, None
+
+    def put(self, key: str, category: str, result):
+        """
+        検索結果を保存する。result が None の場合は「見つからなかった」として保存する
+        (取得に失敗した場合は呼ばないこと)。
+        """
+        now = time.time()
+        price = result.get('price') if result else None
+        url = result.get('url') if result else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO amazon_cache (key, category, price, url, miss, fetched_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, category, price, url, 0 if result else 1, now, now)
+            )
+            self._conn.commit()
+            self._puts_since_evict += 1
+            if self._puts_since_evict >= config.AMAZON_CACHE_EVICT_INTERVAL:
+                self._puts_since_evict = 0
+                self._evict_locked()
+
+    def _evict_locked(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM amazon_cache").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM amazon_cache WHERE key IN "
+                "(SELECT key FROM amazon_cache ORDER BY accessed_at ASC LIMIT ?)", (overflow,)
+            )
+            self._conn.commit()
+            logging.getLogger(__name__).info(f"Amazonキャッシュから古い {overflow} 件を削除しました。")
+
+    def get_asin(self, key: str):
+        """型番に対して前回選んだ商品のASINを返す (無ければ None)"""
+        with self._lock:
+            row = self._conn.execute("SELECT asin FROM amazon_asin_index WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put_asin(self, key: str, asin: str, title: str = None, score: float = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO amazon_asin_index (key, asin, title, score, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (key, asin, title, score, time.time())
+            )
+            self._conn.commit()
+
+    def forget_asin(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM amazon_asin_index WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _fetch(self, key: str, model_number: str, fetch):
+        """
+        fetch(model_number, asin=...) で取得し、選ばれた商品のASINを索引に記録する。
+        ASINが分かっていれば fetch は検索せずに商品ページから価格を取り直す。
+        """
+        asin = self.get_asin(key) if config.AMAZON_ASIN_REFRESH else None
+        result = fetch(model_number, asin=asin)
+        if result and result.get('asin'):
+            # 検索して選び直した場合 (一致度がある) だけ索引を更新する
+            if result.get('score') is not None:
+                self.put_asin(key, result['asin'], result.get('title'), result['score'])
+        elif asin:
+            # 前回の商品が見つからなくなった
+            self.forget_asin(key)
+        return result
+
+    def _refresh(self, key: str, category: str, model_number: str, fetch):
+        try:
+            self.put(key, category, self._fetch(key, model_number, fetch))
+        except Exception as e:
+            # 取得に失敗した場合は保存済みのエントリをそのまま残す (次の参照で再び取り直す)
+            logging.getLogger(__name__).warning(f"Amazonキャッシュの再取得に失敗: {model_number}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _schedule_refresh(self, key: str, category: str, model_number: str, fetch):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._refresh_executor.submit(self._refresh, key, category, model_number, fetch)
+
+    def lookup_cached(self, model_number: str, category: str, fetch):
+        """
+        キャッシュだけを引く。使えるエントリがあれば (結果 または None, HIT/STALE) を、
+        無ければ None を返す。期限切れ (猶予期間内) の場合は fetch で裏から再取得する。
+        """
+        key = normalize_key(model_number)
+        entry, state = self.get(key, category)
+        if state is None:
+            return None
+        result = None if entry['miss'] else {'price': entry['price'], 'url': entry['url']}
+        if state == 'fresh':
+            return result, HIT
+        self._schedule_refresh(key, category, model_number, fetch)
+        return result, STALE
+
+    def fetch_and_store(self, model_number: str, category: str, fetch):
+        """
+        fetch(model_number, asin=...) で取得した結果を保存して返す。
+        fetch が None を返した場合だけ「見つからなかった」として保存し、例外 (取得の失敗) はそのまま送出する。
+        """
+        key = normalize_key(model_number)
+        result = self._fetch(key, model_number, fetch)
+        self.put(key, category, result)
+        return result
+
+    def lookup(self, model_number: str, category: str, fetch):
+        """
+        型番でキャッシュを引き、なければ fetch(model_number, asin=...) で取得して保存する。
+        戻り値は (fetch と同じ形式の結果 または None, HIT/STALE/MISS)。
+        """
+        cached = self.lookup_cached(model_number, category, fetch)
+        if cached is not None:
+            return cached
+        return self.fetch_and_store(model_number, category, fetch), MISS
+
+    def close(self):
+        self._refresh_executor.shutdown(wait=False)
+        with self._lock:
+            self._conn.close()
+
+
+# --- プロセス全体で共有するキャッシュ ---
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> AmazonCache:
+    """共有キャッシュを返す (初回呼び出し時にデータベースを開く)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AmazonCache(config.AMAZON_CACHE_FILE, config.AMAZON_CACHE_MAX_ENTRIES)
+        return _cache
@@ -0,0 +1,92 @@
+# 製品名正規化のマイクロベンチマーク
+#
+# 使い方: python -m benchmarks.bench_normalize
+#
+# 保存済みの価格.comページ (last_page.html) と、各カテゴリの典型的な製品名から
+# 1万件の名前を作り、従来のインライン処理と normalize モジュールの処理時間を比べる。
+# キャッシュなしの計測は異なる名前を1回ずつ処理する (繰り返し現れる名前はキャッシュに当たるため)。
+import os
+import re
+import timeit
+
+import normalize
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 価格.comのスペック検索結果で実際に見られる表記
+SAMPLE_NAMES = [
+    ("Core i7 14700K BOX", "CPU"),
+    ("Core i5 12400F バルク", "CPU"),
+    ("Ryzen 7 5700X BOX", "CPU"),
+    ("B760M-HDV/M.2 D4 (DDR4)", "マザーボード"),
+    ("PRO B650M-A WIFI", "マザーボード"),
+    ("ROG STRIX B650E-F GAMING WIFI", "マザーボード"),
+    ("RD-RX7600-E8GB/DF [PCIExp 8GB]", "グラフィックボード"),
+    ("GG-RTX4060-E8GB/SF [PCIExp 8GB]", "グラフィックボード"),
+    ("CT2K16G4DFRA32A [DDR4 PC4-25600 16GB 2枚組]", "メモリ"),
+    ("WD40EZAZ-RT [4TB SATA600 5400]", "ハードディスク・HDD(3.5インチ)"),
+    ("SSD-PGM1.0U3-B/N", "SSD"),
+    ("【国内正規品】MX Master 3S", "マウス"),
+    ("Ｇ　ＰＲＯ　Ｘ　ＳＵＰＥＲＬＩＧＨＴ　２", "マウス"),
+    ("[ELECOM] M-XGM10DBBK", "マウス"),
+]
+
+
+def load_fixture_names(category_name="マザーボード"):
+    """保存済みの結果ページから製品名を取り出す (BeautifulSoupを使わず正規表現で抜き出す)"""
+    path = os.path.join(REPO_ROOT, "last_page.html")
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            html = f.read()
+    except OSError:
+        return []
+    names = re.findall(r'<td class="textL">.*?<a href="/item/[^"]+/">([^<]+)</a>', html, re.S)
+    return [(name.strip(), category_name) for name in names]
+
+
+def legacy_product_key(name, category_name):
+    """正規化モジュール導入前の search._deduplicate_products と同じ処理"""
+    base_name = re.sub(r'[\[【].*?[\]】]', '', name).strip()
+    if category_name == 'マザーボード':
+        return re.sub(r'[()]', '', base_name).strip()
+    parts = base_name.split()
+    return parts[0] if parts else ''
+
+
+def _clear_caches():
+    normalize.search_keyword.cache_clear()
+    normalize.product_key.cache_clear()
+
+
+def main(total=10000, repeat=5):
+    names = load_fixture_names() + SAMPLE_NAMES
+    workload = (names * (total // len(names) + 1))[:total]
+    # キャッシュなしの計測は、異なる名前を1回ずつ (どれも初めて見る名前として) 処理する
+    unique = list(dict.fromkeys(workload))
+    print(f"製品名 {len(workload)} 件 (異なる名前 {len(unique)} 件)")
+
+    def run_legacy():
+        for name, category in workload:
+            legacy_product_key(name, category)
+
+    def run_cold():
+        for name, category in unique:
+            normalize.product_key(name, category)
+
+    def run_warm():
+        for name, category in workload:
+            normalize.product_key(name, category)
+
+    results = []
+    results.append(("従来 (インライン正規表現)", min(timeit.repeat(run_legacy, number=1, repeat=repeat)), len(workload)))
+    # 計測のたびにキャッシュを空にする (setup は計測時間に含まれない)。件数が少ないため回数を増やす
+    cold = min(timeit.repeat(run_cold, setup=_clear_caches, number=1, repeat=repeat * 20))
+    results.append(("normalize (キャッシュなし)", cold, len(unique)))
+    run_warm()  # メモ化を温めておく
+    results.append(("normalize (キャッシュあり)", min(timeit.repeat(run_warm, number=1, repeat=repeat)), len(workload)))
+    for label, best, count in results:
+        print(f"{label:28s} {best * 1000:8.2f} ms / {count:5d}件  ({best / count * 1e6:6.2f} µs/件)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+# 保存済みHTMLを使ったパーサーのベンチマークと回帰チェック (ネットワーク不要)
+#
+# 使い方:
+#   python -m benchmarks.bench_parsers                  計測結果を表示する
+#   python -m benchmarks.bench_parsers --save-baseline  計測結果を基準値として保存する
+#   python -m benchmarks.bench_parsers --check          基準値より遅くなっていたら終了コード1で終わる
+#
+# 価格.comの保存ページ (リポジトリ直下の *.html) と Amazon の検索結果ページ (benchmarks/fixtures) を
+# scrapers.kakaku / scrapers.amazon のパース処理と search._deduplicate_products に通し、
+# 1ページあたりのパース時間、1秒あたりの処理行数、製品1,000件あたりのメモリ使用量を出す。
+# パース処理は抽出方法 (config.HTML_EXTRACTOR の 'bs4' と 'lxml') ごとに計測し、両者の結果が一致することも確かめる。
+# 抽出件数などの結果が期待値と違う場合は、速度に関係なく失敗として扱う。
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import timeit
+import tracemalloc
+
+from lxml import html as lxml_html
+
+import config
+from benchmarks import bench_normalize
+from scrapers import amazon, kakaku
+import search
+
+REPO_ROOT = bench_normalize.REPO_ROOT
+FIXTURE_DIR = os.path.join(REPO_ROOT, "benchmarks", "fixtures")
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, "benchmarks", "baseline.json")
+
+# (ファイル, 期待する製品数 (結果テーブルが無いページは None), 次ページの有無, 総ページ数)
+# last_page.html などは Shift_JIS の meta を持ったまま UTF-8 で保存されているため、文字列として読む
+KAKAKU_FIXTURES = [
+    ("last_page.html", 26, True, 267),
+    ("error_page_final.html", 26, True, 267),
+    # 結果テーブルが無いページ (エラー画面・他サイト) は None になること
+    ("kakaku_page_dump.html", None, False, None),
+    ("tsukumo_final_check.html", None, False, None),
+]
+
+# (ファイル, 検索する型番, 検索結果があるか, 選ばれるべき商品のASIN, 価格)
+# amazon_search.html の先頭はスポンサー枠の付属品で、型番に一致する商品は7件目にある
+AMAZON_FIXTURES = [
+    ("amazon_search.html", "B760M-HDV/M.2 D4", True, "B0CKL7P2D9", 12480),
+    ("amazon_search.html", "X670E TAICHI", True, None, None),
+    ("amazon_no_result.html", "ZZZZ-NOTFOUND", False, None, None),
+    ("amazon_captcha.html", "B760M-HDV/M.2 D4", False, None, None),
+]
+# (ファイル, ASIN, 価格)
+AMAZON_PRODUCT_FIXTURES = [
+    ("amazon_product.html", "B0CKL7P2D9", 12280),
+]
+
+# 比較する抽出方法 (config.HTML_EXTRACTOR)
+EXTRACTORS = ("bs4", "lxml")
+# 種類ごとのパース処理 (html, 引数) → 結果
+PARSERS = {
+    "kakaku": lambda html, arg: kakaku._parse_result_page(html),
+    "amazon": lambda html, arg: amazon._parse_search_results(html, arg),
+    "amazon_dp": lambda html, arg: amazon._parse_product_page(html, arg),
+}
+# 期待値と比べる形
+SUMMARIZE = {
+    # (製品数, 次ページの有無, 総ページ数)
+    "kakaku": lambda output: (None if output[0] is None else len(output[0]), output[1], output[2]),
+    # (検索結果があるか, 選んだ商品のASIN, 価格)
+    "amazon": lambda output: (output[0],) + ((output[1]["asin"], output[1]["price"]) if output[1] else (None, None)),
+    # 価格
+    "amazon_dp": lambda output: output["price"] if output else None,
+}
+PRODUCT_COUNT = {
+    "kakaku": lambda output: len(output[0]) if output[0] else 0,
+    "amazon": lambda output: 0,
+    "amazon_dp": lambda output: 0,
+}
+
+PROC_STATUS = "/proc/self/status"
+
+DEDUP_CATEGORY = "マザーボード"
+DEDUP_PRODUCTS = 10000
+
+
+def read_fixture(path: str) -> str:
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def measure_time(fn, repeat: int) -> float:
+    """fn を repeat 回実行した中で最も速かった秒数"""
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+def measure_peak_memory(fn) -> int:
+    """fn 実行中に確保されたメモリのピーク (バイト)"""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure_peak_rss(kind: str, extractor: str, path: str, arg: str = ""):
+    """
+    別プロセスで1ページをパースし、パース中に増えた最大RSS (KB) を返す。
+    tracemalloc には lxml (C) が確保したメモリが現れないため、抽出方法の比較にはこちらを使う。
+    /proc の無い環境 (Windows など) では None。
+    """
+    if not os.path.exists(PROC_STATUS):
+        return None
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_parsers", "--rss-probe", kind, extractor, path, arg],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    try:
+        return float(completed.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _peak_rss_kb() -> int:
+    # getrusage の ru_maxrss は exec 前の親プロセスの値を引き継ぐため、VmHWM を読む
+    with open(PROC_STATUS) as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return 0
+
+
+def rss_probe(kind: str, extractor: str, path: str, arg: str = ""):
+    config.HTML_EXTRACTOR = extractor
+    html = read_fixture(path)
+    parse = lambda html: PARSERS[kind](html, arg)
+    # 遅延初期化 (lxml のパーサー生成など) の分を除く
+    parse("<html><body></body></html>")
+    lxml_html.document_fromstring("<p>warm up</p>")
+    before = _peak_rss_kb()
+    parse(html)
+    print(_peak_rss_kb() - before)
+
+
+def bench_page(kind: str, filename: str, path: str, repeat: int, expected, failures: list, metrics: dict,
+               arg: str = "", label: str = None):
+    """1ページを抽出方法ごとにパースし、結果の一致と速度・メモリを確認する"""
+    html = read_fixture(path)
+    label = label or filename
+    parse = lambda html: PARSERS[kind](html, arg)
+    outputs = {}
+    for extractor in EXTRACTORS:
+        config.HTML_EXTRACTOR = extractor
+        outputs[extractor] = parse(html)
+        if SUMMARIZE[kind](outputs[extractor]) != expected:
+            failures.append(f"{kind} {label} ({extractor}): {SUMMARIZE[kind](outputs[extractor])} (期待値 {expected})")
+
+        seconds = measure_time(lambda: parse(html), repeat)
+        peak = measure_peak_memory(lambda: parse(html))
+        rss = measure_peak_rss(kind, extractor, path, arg)
+        prefix = f"{kind}:{extractor}:{label}"
+        metrics[f"{prefix}:ms_per_page"] = seconds * 1000
+        line = f"  {label:40s} {extractor:4s} {seconds * 1000:8.2f} ms/ページ  Python {peak / 1024:7.0f} KB"
+        line += f"  RSS {rss:7.0f} KB" if rss is not None else ""
+        count = PRODUCT_COUNT[kind](outputs[extractor])
+        if count:
+            metrics[f"{prefix}:rows_per_sec"] = count / seconds
+            memory = rss if rss is not None else peak / 1024
+            metrics[f"{prefix}:kb_per_1000_products"] = memory / count * 1000
+            line += f"  {count / seconds:8.0f} 行/秒  {memory / count * 1000:8.0f} KB/1,000件"
+        print(line)
+
+    # 高速抽出は従来の BeautifulSoup の処理と同じ結果を返さなければならない
+    if outputs["lxml"] != outputs["bs4"]:
+        failures.append(f"{kind} {label}: lxml と bs4 の抽出結果が一致しません")
+    bs4_ms = metrics[f"{kind}:bs4:{label}:ms_per_page"]
+    lxml_ms = metrics[f"{kind}:lxml:{label}:ms_per_page"]
+    print(f"  {'':40s} → lxml は bs4 の {bs4_ms / lxml_ms:.1f} 倍速")
+
+
+def bench_kakaku(repeat: int, failures: list) -> dict:
+    metrics = {}
+    for filename, expected_count, expected_next, expected_pages in KAKAKU_FIXTURES:
+        path = os.path.join(REPO_ROOT, filename)
+        if not os.path.exists(path):
+            print(f"  {filename}: ファイルがありません (スキップ)")
+            continue
+        bench_page("kakaku", filename, path, repeat, (expected_count, expected_next, expected_pages), failures, metrics)
+    return metrics
+
+
+def bench_amazon(repeat: int, failures: list) -> dict:
+    metrics = {}
+    for filename, query, expected_found, expected_asin, expected_price in AMAZON_FIXTURES:
+        path = os.path.join(FIXTURE_DIR, filename)
+        bench_page("amazon", filename, path, repeat, (expected_found, expected_asin, expected_price), failures, metrics,
+                   arg=query, label=f"{filename} [{query}]")
+    for filename, asin, expected_price in AMAZON_PRODUCT_FIXTURES:
+        path = os.path.join(FIXTURE_DIR, filename)
+        bench_page("amazon_dp", filename, path, repeat, expected_price, failures, metrics, arg=asin)
+    return metrics
+
+
+def build_dedup_workload(total: int) -> list:
+    """保存ページの製品を価格を変えて複製し、重複を多く含む製品リストを作る"""
+    products, _, _ = kakaku._parse_result_page(read_fixture(os.path.join(REPO_ROOT, "last_page.html")))
+    if not products:
+        return []
+    return [
+        {**products[i % len(products)], "price": products[i % len(products)]["price"] + (i * 37) % 1000}
+        for i in range(total)
+    ]
+
+
+def bench_dedup(repeat: int, failures: list) -> dict:
+    workload = build_dedup_workload(DEDUP_PRODUCTS)
+    if not workload:
+        print("  last_page.html が読めないためスキップ")
+        return {}
+    # 製品ごとのログ出力は計測から外す
+    logging.getLogger(search.__name__).setLevel(logging.WARNING)
+    unique = search._deduplicate_products(workload, DEDUP_CATEGORY)
+    expected = len({bench_normalize.legacy_product_key(p["name"], DEDUP_CATEGORY) for p in workload})
+    if len(unique) > expected:
+        failures.append(f"dedup: 重複排除後 {len(unique)}件 (従来のキーでは {expected}件)")
+
+    seconds = measure_time(lambda: search._deduplicate_products(workload, DEDUP_CATEGORY), repeat)
+    peak = measure_peak_memory(lambda: search._deduplicate_products(workload, DEDUP_CATEGORY))
+    metrics = {
+        "dedup:rows_per_sec": len(workload) / seconds,
+        "dedup:kb_per_1000_products": peak / len(workload) * 1000 / 1024,
+    }
+    print(f"  {len(workload)}件 → {len(unique)}件  {seconds * 1000:8.2f} ms  "
+          f"{len(workload) / seconds:10.0f} 行/秒  {metrics['dedup:kb_per_1000_products']:6.1f} KB/1,000件")
+    return metrics
+
+
+def is_regression(name: str, value: float, baseline: float, tolerance: float) -> bool:
+    """rows_per_sec は大きいほど、それ以外 (時間・メモリ) は小さいほど良い"""
+    if name.endswith("rows_per_sec"):
+        return value < baseline / tolerance
+    return value > baseline * tolerance
+
+
+def compare_with_baseline(metrics: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, base_value in baseline.items():
+        value = metrics.get(name)
+        if value is None or not base_value:
+            continue
+        if is_regression(name, value, base_value, tolerance):
+            regressions.append(f"{name}: {value:.2f} (基準値 {base_value:.2f})")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="保存済みHTMLを使ったパーサーのベンチマーク")
+    parser.add_argument("--repeat", type=int, default=10, help="計測の繰り返し回数 (最速値を採用)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基準値ファイル")
+    parser.add_argument("--save-baseline", action="store_true", help="計測結果を基準値として保存する")
+    parser.add_argument("--check", action="store_true", help="基準値と比較し、悪化していれば失敗にする")
+    parser.add_argument("--tolerance", type=float, default=1.3, help="許容する悪化の倍率")
+    parser.add_argument("--rss-probe", nargs=4, metavar=("KIND", "EXTRACTOR", "PATH", "ARG"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.rss_probe:
+        rss_probe(*args.rss_probe)
+        return 0
+
+    failures = []
+    metrics = {}
+    print("価格.com 結果ページ:")
+    metrics.update(bench_kakaku(args.repeat, failures))
+    print("Amazon 検索結果ページ:")
+    metrics.update(bench_amazon(args.repeat, failures))
+    print("重複排除:")
+    metrics.update(bench_dedup(args.repeat, failures))
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(metrics, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"基準値を保存しました: {args.baseline}")
+
+    if args.check:
+        try:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        except OSError:
+            print(f"基準値ファイルがありません: {args.baseline} (--save-baseline で作成してください)")
+            return 1
+        failures.extend(compare_with_baseline(metrics, baseline, args.tolerance))
+
+    for failure in failures:
+        print(f"NG: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+# 検索全体 (run_search) の所要時間を代替サーバー相手に計測する
+#
+# 使い方:
+#   python -m benchmarks.bench_search                 Amazonはブラウザ (ドライバープール) で取得する
+#   python -m benchmarks.bench_search --amazon-http   Amazonもブラウザを使わずHTTPで取得する (Chrome不要)
+#   python -m benchmarks.bench_search --unthrottled   スケジューラと価格.comの速度制限を外して処理時間だけを見る
+#   python -m benchmarks.bench_search --top-k 10 --budget 30   最後に予算付きの検索 (上位K件) も計測する
+#   python -m benchmarks.bench_search --save-baseline / --check   基準値の保存・比較 (bench_parsers と同じ)
+#
+# benchmarks.fake_sites のサーバーを起動し、カテゴリのURLと AMAZON_BASE_URL をそちらに向けて
+# 同じ検索を「キャッシュなし」「キャッシュあり」「差分モード」「キャッシュ期限切れ」の順に実行する。
+# キャッシュ・価格履歴は一時ディレクトリに作るため、普段使っているデータには触れない。
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import requests
+
+import config
+from benchmarks import bench_parsers
+from benchmarks.fake_sites import FakeSites
+
+DEFAULT_BASELINE = os.path.join(bench_parsers.REPO_ROOT, "benchmarks", "baseline_search.json")
+CATEGORY_NAME = "マザーボード"
+
+
+def _scrape_amazon_via_http(product_name: str, asin: str = None):
+    """scrapers.amazon.scrape_product の代わりに、代替サーバーのページをHTTPで取得してパースする"""
+    from scrapers import amazon
+    if asin:
+        response = requests.get(amazon.product_url(asin), timeout=30)
+        if response.ok:
+            result = amazon._parse_product_page(response.text, asin)
+            if result:
+                return result
+    response = requests.get(amazon.search_url(product_name), timeout=30)
+    response.raise_for_status()
+    _, result = amazon._parse_search_results(response.text, product_name)
+    return result
+
+
+def configure(sites: FakeSites, workdir: str, unthrottled: bool):
+    """config を代替サーバーと一時ディレクトリに向ける (キャッシュ・スケジューラ生成前に呼ぶこと)"""
+    config.CATEGORY_URL_MAP = {CATEGORY_NAME: sites.spec_search_url()}
+    config.AMAZON_BASE_URL = sites.base_url
+    config.KAKAKU_FETCH_MODE = 'http'
+    config.AMAZON_CACHE_FILE = os.path.join(workdir, "amazon_cache.sqlite3")
+    config.PRICE_HISTORY_FILE = os.path.join(workdir, "price_history.sqlite3")
+    if unthrottled:
+        config.KAKAKU_REQUEST_INTERVAL = 0
+        config.SCHEDULER_SITES = {
+            name: {**settings, 'rate': 1000.0, 'burst': 1000}
+            for name, settings in config.SCHEDULER_SITES.items()
+        }
+
+
+def run_once(label: str, sites: FakeSites, makers: list, limit: int, incremental: bool = False, **options) -> dict:
+    import search
+
+    before = dict(sites.requests)
+    started = time.perf_counter()
+    results = search.run_search(CATEGORY_NAME, None, limit, 0, makers, None, incremental=incremental, **options)
+    elapsed = time.perf_counter() - started
+    requests_made = {site: count - before[site] for site, count in sites.requests.items()}
+    print(f"  {label:12s} {elapsed:8.2f} 秒  利益商品 {len(results):4d}件  価格.com {requests_made['kakaku']:3d}回  "
+          f"Amazon検索 {requests_made['amazon']:4d}回  商品ページ {requests_made['amazon_dp']:4d}回")
+    return {f"search:{label}:seconds": elapsed}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="代替サーバーを使った検索全体のベンチマーク")
+    parser.add_argument("--makers", type=int, default=3, help="検索するメーカー数")
+    parser.add_argument("--limit", type=int, default=60, help="1メーカーあたりの取得件数")
+    parser.add_argument("--pages", type=int, default=5, help="代替サーバーの結果ページ数")
+    parser.add_argument("--latency", type=float, default=0.05, help="代替サーバーの応答遅延 (秒)")
+    parser.add_argument("--amazon-http", action="store_true", help="Amazonをブラウザを使わずに取得する")
+    parser.add_argument("--unthrottled", action="store_true", help="速度制限を外す")
+    parser.add_argument("--top-k", type=int, help="予算付きの検索の目標件数 (--budget と一緒に指定する)")
+    parser.add_argument("--budget", type=int, help="予算付きの検索の照合回数の上限")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基準値ファイル")
+    parser.add_argument("--save-baseline", action="store_true", help="計測結果を基準値として保存する")
+    parser.add_argument("--check", action="store_true", help="基準値と比較し、悪化していれば失敗にする")
+    parser.add_argument("--tolerance", type=float, default=1.3, help="許容する悪化の倍率")
+    parser.add_argument("-v", "--verbose", action="store_true", help="検索処理のログを表示する")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(threadName)s - %(message)s')
+
+    with tempfile.TemporaryDirectory(prefix="bench_search_") as workdir, \
+            FakeSites(pages=args.pages, latency=args.latency) as sites:
+        configure(sites, workdir, args.unthrottled)
+        from scrapers import amazon, driver_pool, kakaku
+        if args.amazon_http:
+            amazon.scrape_product = _scrape_amazon_via_http
+
+        makers = kakaku.get_makers(CATEGORY_NAME)[:args.makers]
+        print(f"代替サーバー {sites.base_url}  メーカー {makers}  上限 {args.limit}件")
+
+        metrics = {}
+        metrics.update(run_once("cold", sites, makers, args.limit))
+        metrics.update(run_once("warm", sites, makers, args.limit))
+        metrics.update(run_once("incremental", sites, makers, args.limit, incremental=True))
+        # キャッシュの期限が切れた状態: 索引のASINで商品ページから価格を取り直す
+        config.AMAZON_CACHE_TTL_DEFAULT = 0
+        config.AMAZON_CACHE_TTL_BY_CATEGORY = {}
+        config.AMAZON_CACHE_STALE_WHILE_REVALIDATE = False
+        metrics.update(run_once("expired", sites, makers, args.limit))
+        if args.top_k and args.budget:
+            # キャッシュの期限切れのまま、価格履歴から見込みを立てて上位K件だけを照合する
+            metrics.update(run_once("budgeted", sites, makers, args.limit, top_k=args.top_k, lookup_budget=args.budget))
+
+        import metrics as app_metrics
+        for (site, engine), (pages, total) in sorted(app_metrics.PAGE_BYTES.totals().items()):
+            print(f"  転送量 {site}/{engine}: {pages}ページ, 平均 {total / pages / 1024:.1f}KB/ページ")
+
+        import amazon_cache
+        import scheduler
+        amazon_cache.get_cache().close()
+        scheduler.get_scheduler().shutdown()
+        driver_pool.shutdown_pool()
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(metrics, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"基準値を保存しました: {args.baseline}")
+
+    failures = []
+    if args.check:
+        try:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        except OSError:
+            print(f"基準値ファイルがありません: {args.baseline} (--save-baseline で作成してください)")
+            return 1
+        failures = bench_parsers.compare_with_baseline(metrics, baseline, args.tolerance)
+
+    for failure in failures:
+        print(f"NG: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+# 価格.com・Amazon の代わりになるローカルHTTPサーバー (ベンチマーク用)
+#
+# 使い方: python -m benchmarks.fake_sites [--port 8765] [--pages 10] [--latency 0.05]
+#
+# 保存済みページを元に応答を作るため、ネットワークにつながずに検索全体を何度でも同じ条件で実行できる。
+#   /specsearch/<カテゴリ番号>/            メーカー選択リストを含むスペック検索ページ
+#   /specsearch/<カテゴリ番号>/?_s=2&...   結果ページ (Page ごとに製品名を変え、pages ページ目で「次へ」を消す)
+#   /s?k=<キーワード>                       Amazonの検索結果ページ (先頭はスポンサー枠の付属品、
+#                                           3件目がキーワードと同じ型番の商品。価格とASINはキーワードから決まる)
+#   /dp/<ASIN>                              Amazonの商品ページ (検索結果で返したASINのみ)
+import argparse
+import hashlib
+import os
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks import bench_normalize
+
+REPO_ROOT = bench_normalize.REPO_ROOT
+KAKAKU_TEMPLATE = os.path.join(REPO_ROOT, "last_page.html")
+AMAZON_SEARCH_TEMPLATE = os.path.join(REPO_ROOT, "benchmarks", "fixtures", "amazon_search.html")
+AMAZON_PRODUCT_TEMPLATE = os.path.join(REPO_ROOT, "benchmarks", "fixtures", "amazon_product.html")
+
+_PRODUCT_NAME_PATTERN = re.compile(r'(<td class="textL">.*?<a href="/item/[^"]+/">)([^<]+)(</a>)', re.S)
+_TOTAL_COUNT_PATTERN = re.compile(r'<span class="number">[\d,]+</span>件中')
+_SHOWN_RANGE_PATTERN = re.compile(r'<span class="number">\d+-\d+</span>件の製品')
+_NEXT_IMAGE_PATTERN = re.compile(r'<img[^>]*alt="次へ"[^>]*>')
+_AMAZON_CARD_PATTERN = re.compile(
+    r'<div data-asin="[^"]*" data-index="\d+" data-component-type="s-search-result".*?\n</div>', re.S
+)
+_AMAZON_PRICE_PATTERN = re.compile(r'(<span class="a-price-whole">|<span class="a-offscreen">￥)[\d,]+(</span>)')
+_AMAZON_ASIN_PATTERN = re.compile(r'B0[0-9A-Z]{8}')
+_AMAZON_TITLE_PATTERN = re.compile(
+    r'(<span class="a-size-base-plus a-color-base a-text-normal">|<span id="productTitle"[^>]*>)[^<]+(</span>)'
+)
+
+ROWS_PER_PAGE = 30
+
+
+def _select_option(html: str, select_name: str, value: str) -> str:
+    """検索フォームの select の、value の option を選択状態にする"""
+    start = html.index(f'<select name="{select_name}"')
+    end = html.index('</select>', start)
+    options = html[start:end].replace(f'<option value="{value}">', f'<option value="{value}" selected>', 1)
+    return html[:start] + options + html[end:]
+
+
+class FakeSites:
+    """代替サーバー。with 文で使うと別スレッドで起動し、抜けるときに停止する。"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, pages: int = 10, latency: float = 0.0):
+        self.pages = pages
+        self.latency = latency
+        with open(KAKAKU_TEMPLATE, encoding="utf-8", errors="replace") as f:
+            self._kakaku_template = f.read()
+        with open(AMAZON_SEARCH_TEMPLATE, encoding="utf-8") as f:
+            search_template = f.read()
+        cards = _AMAZON_CARD_PATTERN.findall(search_template)
+        # 先頭のスポンサー枠と、型番の異なる商品1件を残し、その後ろに一致する商品を差し込む
+        self._amazon_search_head = search_template[:search_template.index(cards[0])] + cards[0] + "\n" + cards[1]
+        self._amazon_search_tail = search_template[search_template.index(cards[-1]) + len(cards[-1]):]
+        self._amazon_card_template = cards[-1]
+        with open(AMAZON_PRODUCT_TEMPLATE, encoding="utf-8") as f:
+            self._amazon_product_template = f.read()
+        self._asin_titles = {}
+        self.requests = {"kakaku": 0, "amazon": 0, "amazon_dp": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def spec_search_url(self, category_code: str = "0540") -> str:
+        return urllib.parse.urljoin(self.base_url, f"specsearch/{category_code}/")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-sites", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, site: str):
+        with self._lock:
+            self.requests[site] += 1
+
+    def kakaku_page(self, query: dict) -> bytes:
+        """価格.comのページ。実物と同じく Shift_JIS で返す。"""
+        html = self._kakaku_template
+        if query.get("_s"):
+            page = int(query.get("Page", "1"))
+            marker = f" P{page}-{query.get('LstMaker', '0')}"
+            html = _PRODUCT_NAME_PATTERN.sub(lambda m: m.group(1) + m.group(2).strip() + marker + m.group(3), html)
+            html = _TOTAL_COUNT_PATTERN.sub(f'<span class="number">{self.pages * ROWS_PER_PAGE:,}</span>件中', html)
+            start = (page - 1) * ROWS_PER_PAGE + 1
+            html = _SHOWN_RANGE_PATTERN.sub(
+                f'<span class="number">{start}-{start + ROWS_PER_PAGE - 1}</span>件の製品', html
+            )
+            if page >= self.pages:
+                html = _NEXT_IMAGE_PATTERN.sub('', html)
+            # 実物の結果ページと同じく、検索フォームの選択状態とページ送りの現在のページに条件を反映する
+            # (kakaku._check_conditions が、条件が反映されていない結果ページを読まないことを確かめる)
+            for name in ("LstMaker", "Sort"):
+                if query.get(name):
+                    html = _select_option(html, name, query[name])
+            html = html.replace("<span><strong>1</strong></span>", f"<span><strong>{page}</strong></span>", 1)
+        return html.encode("cp932", errors="xmlcharrefreplace")
+
+    @staticmethod
+    def _amazon_item(keyword: str):
+        digest = hashlib.md5(keyword.encode("utf-8")).hexdigest()
+        return "B0" + digest[:8].upper(), 5000 + int(digest, 16) % 60000
+
+    @staticmethod
+    def _fill(template: str, asin: str, title: str, price: int) -> str:
+        html = _AMAZON_ASIN_PATTERN.sub(asin, template)
+        html = _AMAZON_TITLE_PATTERN.sub(lambda m: m.group(1) + title + m.group(2), html)
+        return _AMAZON_PRICE_PATTERN.sub(lambda m: f"{m.group(1)}{price:,}{m.group(2)}", html)
+
+    def amazon_page(self, keyword: str) -> bytes:
+        """Amazonの検索結果ページ。一致する商品の価格とASINはキーワードごとに一定の値にする。"""
+        asin, price = self._amazon_item(keyword)
+        title = f"{keyword} 国内正規代理店品"
+        with self._lock:
+            self._asin_titles[asin] = (title, price)
+        card = self._fill(self._amazon_card_template, asin, title, price)
+        return (self._amazon_search_head + "\n" + card + self._amazon_search_tail).encode("utf-8")
+
+    def amazon_product_page(self, asin: str):
+        """検索結果で返した商品の商品ページ。知らないASINは None (404)。"""
+        with self._lock:
+            item = self._asin_titles.get(asin)
+        if item is None:
+            return None
+        title, price = item
+        return self._fill(self._amazon_product_template, asin, title, price).encode("utf-8")
+
+    def _make_handler(self):
+        sites = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urllib.parse.urlsplit(self.path)
+                query = dict(urllib.parse.parse_qsl(parsed.query))
+                if sites.latency:
+                    time.sleep(sites.latency)
+                if parsed.path.startswith("/specsearch/"):
+                    sites._count("kakaku")
+                    self._send(sites.kakaku_page(query), "text/html; charset=Shift_JIS")
+                elif parsed.path == "/s":
+                    sites._count("amazon")
+                    self._send(sites.amazon_page(query.get("k", "")), "text/html; charset=utf-8")
+                elif parsed.path.startswith("/dp/"):
+                    sites._count("amazon_dp")
+                    body = sites.amazon_product_page(parsed.path.split("/")[2])
+                    if body is None:
+                        self.send_error(404)
+                    else:
+                        self._send(body, "text/html; charset=utf-8")
+                else:
+                    self.send_error(404)
+
+            def _send(self, body: bytes, content_type: str):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="価格.com・Amazonの代替サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pages", type=int, default=10, help="結果ページの総ページ数")
+    parser.add_argument("--latency", type=float, default=0.0, help="応答ごとに待つ秒数")
+    args = parser.parse_args()
+
+    sites = FakeSites(args.host, args.port, args.pages, args.latency)
+    print(f"代替サーバーを起動しました: {sites.base_url}")
+    print(f"  価格.com: {sites.spec_search_url()}")
+    print(f"  Amazon:   {urllib.parse.urljoin(sites.base_url, 's?k=B760M')}")
+    try:
+        sites._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sites._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
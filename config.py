@@ -59,3 +59,226 @@ CATEGORY_URL_MAP = {
 # --- ファイルパス設定 ---
 EXCLUDED_MAKERS_FILE = 'exclude_makers.txt'
 EXCLUDED_KEYWORDS_FILE = 'exclude_keywords.txt'
+# 除外・対象キーワード、正規表現、価格帯の規則 (書式は filters.py を参照。無ければ使わない)
+FILTER_RULES_FILE = 'filter_rules.txt'
+# 上の3つのファイルの更新を確認する間隔 (秒)。更新されていれば再起動せずに読み直す (0 で監視しない)
+FILTER_WATCH_INTERVAL = 5
+
+# --- ブラウザ(WebDriver)プール設定 ---
+# 同時に起動しておくヘッドレスChromeの最大数
+DRIVER_POOL_SIZE = int(os.environ.get('DRIVER_POOL_SIZE', 5))
+# サーバー起動時にあらかじめ起動しておくセッション数
+DRIVER_POOL_WARMUP = int(os.environ.get('DRIVER_POOL_WARMUP', 2))
+# 1セッションで読み込むページ数の上限 (超えたらChromeを再起動してメモリリークを防ぐ)
+DRIVER_MAX_PAGES_PER_SESSION = 50
+# ドライバーの空きを待つ最大秒数
+DRIVER_LEASE_TIMEOUT = 300
+
+# --- ブラウザエンジン設定 ---
+# 'selenium':   ドライバープールの Chrome (1タスク = 1プロセス) で取得する
+# 'playwright': Chromium 1プロセス上の軽量なブラウザコンテキストを asyncio で並行に動かす (要 playwright install chromium)
+SCRAPER_ENGINE = os.environ.get('SCRAPER_ENGINE', 'selenium')
+# Playwright で同時に開くページ (ブラウザコンテキスト) の数
+PLAYWRIGHT_MAX_PAGES = int(os.environ.get('PLAYWRIGHT_MAX_PAGES', 24))
+PLAYWRIGHT_HEADLESS = True
+# ページ読み込み・要素の表示待ちの最大秒数
+PLAYWRIGHT_TIMEOUT = 20
+
+# --- ページ読み込み設定 ---
+# 'eager': DOMの構築が終わった時点で読み込み完了とする (画像・広告の読み込みを待たない) / 'normal': 従来どおり
+PAGE_LOAD_STRATEGY = os.environ.get('PAGE_LOAD_STRATEGY', 'eager')
+# サイトごとに読み込ませないリソースの種類 (image / media / font) とドメインを遮断する
+PAGE_LOAD_PROFILES_ENABLED = os.environ.get('PAGE_LOAD_PROFILES', '1') == '1'
+# 広告・計測用のドメイン (サブドメインも遮断する)
+PAGE_LOAD_TRACKER_DOMAINS = [
+    'doubleclick.net', 'googlesyndication.com', 'googletagmanager.com', 'google-analytics.com',
+    'googleadservices.com', 'amazon-adsystem.com', 'criteo.com', 'criteo.net', 'adnxs.com',
+    'scorecardresearch.com', 'facebook.net', 'ads-twitter.com', 'yjtag.jp',
+]
+PAGE_LOAD_PROFILES = {
+    'kakaku': {
+        'block_resource_types': ['image', 'media', 'font'],
+        'block_domains': PAGE_LOAD_TRACKER_DOMAINS,
+    },
+    'amazon': {
+        'block_resource_types': ['image', 'media', 'font'],
+        # fls-fe / unagi: Amazonのページ内の計測用
+        'block_domains': PAGE_LOAD_TRACKER_DOMAINS + ['fls-fe.amazon.co.jp', 'unagi.amazon.co.jp'],
+    },
+}
+
+# --- Amazon検索結果キャッシュ設定 ---
+AMAZON_CACHE_FILE = 'amazon_cache.sqlite3'
+# 保存する最大件数 (超えたら最終参照の古いものから削除)
+AMAZON_CACHE_MAX_ENTRIES = 50000
+# 何件保存するごとに件数上限をチェックするか
+AMAZON_CACHE_EVICT_INTERVAL = 100
+# 有効期限 (秒)。価格変動の激しいカテゴリは短めに設定する
+AMAZON_CACHE_TTL_DEFAULT = 12 * 60 * 60
+AMAZON_CACHE_TTL_BY_CATEGORY = {
+    "CPU": 6 * 60 * 60,
+    "メモリ": 6 * 60 * 60,
+    "グラフィックボード": 3 * 60 * 60,
+    "SSD": 6 * 60 * 60,
+}
+# 「見つからなかった」結果の有効期限 (秒)
+AMAZON_CACHE_NEGATIVE_TTL = 60 * 60
+# 期限切れでも猶予期間内なら古い値を返し、裏で再取得する
+AMAZON_CACHE_STALE_WHILE_REVALIDATE = True
+AMAZON_CACHE_STALE_GRACE = 24 * 60 * 60
+# 裏での再取得に使うスレッド数
+AMAZON_CACHE_REFRESH_WORKERS = 2
+
+# --- 価格.com取得設定 ---
+# 'http': 検索結果ページのURLを組み立てて requests で直接取得する (失敗時、または結果ページの検索フォームに
+#         指定したメーカー・並び順・ページが反映されていない場合はSeleniumに切り替え)
+# 'selenium': 従来どおりブラウザで検索フォームを操作する
+KAKAKU_FETCH_MODE = os.environ.get('KAKAKU_FETCH_MODE', 'http')
+# requests.Session で保持するコネクション数
+KAKAKU_HTTP_POOL_SIZE = 10
+# 価格.comへの同時リクエスト数の上限 (全メーカーの検索で共有)
+KAKAKU_MAX_CONCURRENCY_PER_HOST = 3
+# 価格.comへのリクエスト開始間隔 (秒)。ブラウザでのページ送りの待ち時間にも使う
+KAKAKU_REQUEST_INTERVAL = 1.0
+
+# --- 検索ジョブ設定 ---
+# 同時に実行する検索ジョブの数 (超えた分は順番待ち)
+JOB_MAX_CONCURRENT = 2
+# 終了したジョブの進捗・結果を保持する秒数
+JOB_RETENTION = 60 * 60
+# 進捗配信 (Server-Sent Events) で接続維持のコメントを送る間隔 (秒)
+JOB_EVENT_KEEPALIVE = 15
+
+# --- 本番構成 (Webの層とスクレイピングの層の分離) ---
+# 'thread': 検索ジョブをWebサーバーのプロセス内のスレッドで実行する (python web_server.py、開発用)
+# 'queue':  検索ジョブとメーカー一覧の取り直しを SQLite のジョブキューに入れ、worker.py のワーカープロセスが
+#           実行する。Webの層 (gunicorn wsgi:app) はHTTPの処理だけを行い、ブラウザを起動しない
+JOB_BACKEND = os.environ.get('JOB_BACKEND', 'thread')
+# ジョブキューのデータベース (Web・ワーカーのすべてのプロセスで同じファイルを使う)
+JOB_QUEUE_FILE = os.environ.get('JOB_QUEUE_FILE', 'job_queue.sqlite3')
+# Webのプロセスがジョブの状態・進捗を読み直す間隔、ワーカーが空のキューを確認する間隔 (秒)
+JOB_QUEUE_POLL_INTERVAL = 0.5
+# ワーカーのプロセス数 (worker.py -n で上書きできる)
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', 2))
+# ワーカーが実行中のジョブの生存を記録する間隔 (秒)。中止の要求もこの間隔で確認する
+WORKER_HEARTBEAT_INTERVAL = 5
+# 生存の記録がこの秒数途絶えた実行中のジョブは、ワーカーが落ちたものとして失敗にする
+WORKER_HEARTBEAT_TIMEOUT = 60
+# 1プロセスで実行するジョブ数の上限。超えたらプロセスを入れ替える (Chromeのメモリリーク対策、0 で入れ替えない)
+WORKER_MAX_JOBS = 50
+# 落ちたワーカーを起動し直すまでの秒数 (起動直後に落ち続ける場合に再起動を繰り返さないため)
+WORKER_RESTART_DELAY = 5
+# 停止を要求してから、処理中のジョブの中止を待つ秒数 (超えたら強制終了する)
+WORKER_STOP_TIMEOUT = 60
+
+# --- 検索結果の保存設定 ---
+# メモリ上に保持する検索結果の数 (超えた分は退避先ディレクトリへ書き出す)
+RESULT_STORE_MAX_ENTRIES = 20
+# 検索結果の保持期間 (秒)
+RESULT_STORE_TTL = 24 * 60 * 60
+# メモリから追い出した検索結果の退避先 (None にすると退避せず破棄する)
+RESULT_STORE_SPILL_DIR = os.environ.get('RESULT_STORE_SPILL_DIR', 'result_store')
+# 保存と同時に退避先へ書き出す。本番構成ではワーカーが保存した結果をWebのプロセスが退避先から読む
+RESULT_STORE_WRITE_THROUGH = JOB_BACKEND == 'queue'
+# 結果一覧の1ページあたりの表示件数
+RESULT_PAGE_SIZE = 50
+
+# --- クロールスケジューラ設定 ---
+# サイトごとの速度制限。rate: 1秒あたりのタスク開始数, burst: 連続して開始できる数,
+# concurrency: 同時実行数 (プロセス全体で共有)
+SCHEDULER_SITES = {
+    # 価格.comの一覧取得 (1タスク = 1メーカー分の結果ページ)
+    'kakaku': {'rate': 1.0, 'burst': 3, 'concurrency': 5},
+    # Amazonの検索 (1タスク = 1商品)。Playwright ではページが軽いため同時実行数を増やせる
+    'amazon': {'rate': 0.5, 'burst': 2, 'concurrency': PLAYWRIGHT_MAX_PAGES if SCRAPER_ENGINE == 'playwright' else 3},
+}
+# エラー時にキューを止める秒数 (連続失敗ごとに倍増し、上限で頭打ち)
+SCHEDULER_BACKOFF_BASE = 5
+SCHEDULER_BACKOFF_MAX = 300
+# キャプチャ等のアクセス制限を検知した場合は待ち時間をこの倍率で延ばす
+SCHEDULER_BLOCKED_BACKOFF_FACTOR = 4
+# アクセス制限で失敗したタスクを再試行する回数
+SCHEDULER_BLOCKED_RETRIES = 2
+
+# --- 価格履歴設定 ---
+PRICE_HISTORY_FILE = 'price_history.sqlite3'
+# 何件の観測値ごとにまとめて書き込むか
+PRICE_HISTORY_BATCH_SIZE = 200
+# 差分検索: 販売先の前回観測がこの秒数より新しく、価格.comの価格が変わっていなければ再確認しない
+PRICE_HISTORY_RECHECK_AGE = 24 * 60 * 60
+
+# --- 予算付きの検索 (上位K件) 設定 ---
+# 照合の予算と件数 (K) を指定した検索では、見込みの利益率が高い商品から販売先に問い合わせる。
+# 見込みの販売価格は 価格履歴の前回の販売価格 → カテゴリの 販売価格÷価格.comの価格 の中央値 の順に使う。
+# 中央値を使うのに必要な、カテゴリの観測済み商品数 (足りなければ TOPK_DEFAULT_SELL_RATIO を使う)
+TOPK_PRIOR_MIN_SAMPLES = 10
+TOPK_DEFAULT_SELL_RATIO = 1.0
+# 前回の販売価格から利益率に届かない商品は問い合わせない。前回からこの割合までの値上がりは見込む
+TOPK_PRUNE_SLACK = 0.05
+# 同時に問い合わせる商品数 (多いほど速く、少ないほど K 件に達した時点での無駄な問い合わせが減る)
+TOPK_LOOKUP_WINDOW = 4
+
+# --- Amazon設定 ---
+# 検索URLや商品URLの基点 (ベンチマーク用の代替サーバーに向けることもできる)
+AMAZON_BASE_URL = os.environ.get('AMAZON_BASE_URL', 'https://www.amazon.co.jp/')
+# 検索結果の先頭から何件を型番と照合するか
+AMAZON_MAX_CANDIDATES = 10
+# 型番との一致度がこれ未満の商品しか無い場合は「見つからなかった」とする
+# (一致度: 型番の語が商品名に含まれる割合 0〜1 + 型番そのものが含まれていれば 1)
+AMAZON_MATCH_MIN_SCORE = 0.5
+# スポンサー枠 (広告) の商品の減点
+AMAZON_SPONSORED_PENALTY = 0.3
+# 型番に無いのに商品名に含まれていたら付属品・互換品とみなして減点する語
+AMAZON_ACCESSORY_WORDS = ['ケース', 'カバー', 'フィルム', 'ケーブル', '対応', '互換', '交換用', 'ブラケット', 'アダプタ']
+AMAZON_ACCESSORY_PENALTY = 0.5
+# 型番の直後にこれらの語が続く商品は上位・派生モデルとみなし、型番が含まれていても
+# 一致とせずに減点する ("RX 7600" に対する "RX 7600 XT" など。"A7S" のように語の途中で続く場合は元々一致しない)
+AMAZON_MODEL_VARIANT_WORDS = [
+    'XT', 'XTX', 'TI', 'SUPER', 'PRO', 'PLUS', 'MAX', 'ULTRA', 'LITE', 'MINI', 'II', 'III', 'IV', 'MK2', 'MKII',
+]
+AMAZON_MODEL_VARIANT_PENALTY = 0.6
+# 選んだ商品のASINを覚えておき、次回からは検索せず商品ページ (/dp/<ASIN>) で価格を取り直す
+AMAZON_ASIN_REFRESH = True
+
+# --- 販売先 (マーケットプレイス) 設定 ---
+# 価格.comの商品ごとに、ここに挙げた販売先すべてへ同時に問い合わせ、最も高い販売価格に対して利益を計算する。
+# 販売先は marketplaces/<名前>.py のプラグインで、取得はプラグインが指定するスケジューラのキューで行う。
+# deadline: 取得を始めてから打ち切るまでの秒数, hedge_after: 取得がこの秒数を超えたら同じ問い合わせを
+# キューの先頭にもう1つ投入し、先に終わった方を使う (None でヘッジしない)
+MARKETPLACE_SETTINGS = {
+    'amazon': {'deadline': 45, 'hedge_after': 15},
+}
+# 使う販売先 (カンマ区切り)
+MARKETPLACES = [name.strip() for name in os.environ.get('MARKETPLACES', 'amazon').split(',') if name.strip()]
+# 問い合わせの期限・ヘッジ・キューの一時停止を確認する間隔の上限 (秒)
+MARKETPLACE_POLL_INTERVAL = 1.0
+# 検索の終了時に、打ち切った・取り消せなかった実行中の問い合わせが終わるのを待つ秒数
+# (これを過ぎても終わらない問い合わせは放棄し、その結果は使わない)
+MARKETPLACE_CLOSE_TIMEOUT = 30.0
+
+# --- HTML抽出設定 ---
+# 'lxml': 結果テーブル・結果カードの部分だけを lxml で読む (読めないページは BeautifulSoup に切り替える)
+# 'bs4':  常にページ全体を BeautifulSoup で読む (従来の処理)
+HTML_EXTRACTOR = os.environ.get('HTML_EXTRACTOR', 'lxml')
+
+# --- メーカーカタログ設定 ---
+MAKER_CATALOG_FILE = 'maker_catalog.json'
+# メーカー一覧を取り直すまでの秒数 (カテゴリ別に変えたい場合は BY_CATEGORY に書く)
+MAKER_CATALOG_TTL_DEFAULT = 7 * 24 * 60 * 60
+MAKER_CATALOG_TTL_BY_CATEGORY = {}
+# 取り直しの同時実行数 (価格.comへの同時接続数は KAKAKU_MAX_CONCURRENCY_PER_HOST でも制限される)
+MAKER_CATALOG_REFRESH_WORKERS = 4
+# 未取得のカテゴリを要求されたとき、取得を待つ秒数
+MAKER_CATALOG_FETCH_TIMEOUT = 30
+# /api/makers/<カテゴリ> をブラウザがキャッシュしてよい秒数
+MAKER_CATALOG_BROWSER_MAX_AGE = 60 * 60
+
+# --- 計測設定 ---
+# 段階ごとの所要時間のヒストグラムの区切り (秒)
+METRICS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+# ページの転送量のヒストグラムの区切り (バイト)
+METRICS_BYTES_BUCKETS = [16_000, 64_000, 128_000, 256_000, 512_000, 1_000_000, 2_000_000, 4_000_000, 8_000_000]
+# 検索1回の所要時間のヒストグラムの区切り (秒)
+METRICS_SEARCH_BUCKETS = [5, 10, 30, 60, 120, 300, 600, 1800]
+# 結果ページに検索1回分の処理時間の内訳を表示する
+SHOW_SEARCH_TIMINGS = os.environ.get('SHOW_SEARCH_TIMINGS', '1') == '1'
@@ -0,0 +1,265 @@
+# 価格.comの商品の絞り込み (除外・対象・価格帯)
+#
+# 除外メーカー・除外キーワードのリストと規則ファイルを読み、カテゴリごとに1つの正規表現へまとめて
+# コンパイルしておく。商品名の判定はリストの長さに関わらず正規表現の照合1回で済む。
+# リストのファイルは監視スレッドが更新日時を見て読み直し、コンパイルし直した規則に丸ごと差し替える
+# (サーバーの再起動は不要)。読み直しに失敗した場合は以前の規則をそのまま使う。
+#
+# 規則ファイル (config.FILTER_RULES_FILE) の書式 (1行1規則、# で始まる行はコメント):
+#   [CPU]               以降の規則をカテゴリ「CPU」にだけ適用する ([*] ですべてのカテゴリに戻る)
+#   exclude: 中古        商品名にこの文字列を含む商品を除く (接頭辞の無い行も exclude とみなす)
+#   include: Ryzen      include の規則があるカテゴリでは、いずれかを含む商品だけを残す
+#   exclude_re: \bOEM\b / include_re: ...   正規表現で指定する
+#   price: 5000-80000   この価格帯 (円) の商品だけを残す (5000- や -80000 のように片側だけでもよい)
+# 文字列・正規表現の照合では大文字と小文字を区別する (正規表現は先頭に (?i) を付けると区別しない)。
+# 検索ごとの絞り込みキーワード (RowFilter) だけは区別しない。
+import logging
+import os
+import re
+import threading
+
+import config
+import utils
+
+ALL_CATEGORIES = '*'
+
+_RULE_KINDS = ('exclude', 'include', 'exclude_re', 'include_re', 'price')
+
+
+class RuleError(ValueError):
+    """規則ファイルの書式の誤り"""
+
+
+_GLOBAL_FLAGS_PATTERN = re.compile(r'^\(\?([imsx]+)\)')
+
+
+def _scoped(pattern: str) -> str:
+    """正規表現の規則を、他の規則と1つの選択パターンにまとめられる形にする (先頭の (?i) は (?i:...) にする)"""
+    match = _GLOBAL_FLAGS_PATTERN.match(pattern)
+    if match:
+        return f"(?{match.group(1)}:{pattern[match.end():]})"
+    return f"(?:{pattern})"
+
+
+class _Matcher:
+    """1カテゴリ分の規則をコンパイルしたもの"""
+
+    def __init__(self, rules: dict):
+        self.exclude = self._compile(rules['exclude'], rules['exclude_re'])
+        self.include = self._compile(rules['include'], rules['include_re'])
+        self.price_min, self.price_max = rules['price']
+
+    @staticmethod
+    def _compile(keywords, patterns):
+        # 長い文字列を先に試すよう並べ、文字列と正規表現を1つの選択パターンにまとめる
+        alternatives = [re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True)]
+        alternatives.extend(_scoped(pattern) for pattern in patterns)
+        if not alternatives:
+            return None
+        # 従来の除外キーワードの判定 (keyword in name) と同じく大文字と小文字を区別する
+        return re.compile('|'.join(alternatives))
+
+    def accepts(self, name: str, price: int) -> bool:
+        if self.price_min is not None and price < self.price_min:
+            return False
+        if self.price_max is not None and price > self.price_max:
+            return False
+        if self.exclude is not None and self.exclude.search(name):
+            return False
+        if self.include is not None and not self.include.search(name):
+            return False
+        return True
+
+
+class RuleSet:
+    """読み込んだ時点の規則一式 (作成後は変更しない)"""
+
+    def __init__(self, excluded_makers, rules_by_category: dict):
+        self.excluded_makers = frozenset(excluded_makers)
+        common = rules_by_category.get(ALL_CATEGORIES) or _empty_rules()
+        self._default = _Matcher(common)
+        self._matchers = {
+            category: _Matcher(_merge_rules(common, rules))
+            for category, rules in rules_by_category.items() if category != ALL_CATEGORIES
+        }
+
+    def matcher(self, category: str = None) -> _Matcher:
+        return self._matchers.get(category, self._default)
+
+    def maker_visible(self, maker: str) -> bool:
+        return maker not in self.excluded_makers
+
+
+class RowFilter:
+    """1回の取得 (1メーカー分) で使う絞り込み。作成時点の規則と、検索ごとの絞り込みキーワードを持つ。"""
+
+    def __init__(self, matcher: _Matcher, filter_keyword: str = None):
+        self._matcher = matcher
+        self._keyword = filter_keyword.lower() if filter_keyword else None
+
+    def accepts(self, name: str, price: int) -> bool:
+        if self._keyword and self._keyword not in name.lower():
+            return False
+        return self._matcher.accepts(name, price)
+
+
+def _empty_rules() -> dict:
+    return {'exclude': [], 'include': [], 'exclude_re': [], 'include_re': [], 'price': (None, None)}
+
+
+def _merge_rules(common: dict, specific: dict) -> dict:
+    """すべてのカテゴリ向けの規則にカテゴリ固有の規則を加える (価格帯はカテゴリ固有のものを優先)"""
+    merged = {kind: common[kind] + specific[kind] for kind in ('exclude', 'include', 'exclude_re', 'include_re')}
+    merged['price'] = tuple(
+        own if own is not None else shared for own, shared in zip(specific['price'], common['price'])
+    )
+    return merged
+
+
+def _parse_price_band(value: str) -> tuple:
+    low, separator, high = value.replace(',', '').partition('-')
+    if not separator:
+        raise RuleError(f"価格帯は 下限-上限 の形式で指定してください: {value}")
+    try:
+        return (int(low) if low.strip() else None, int(high) if high.strip() else None)
+    except ValueError:
+        raise RuleError(f"価格帯を読み取れません: {value}") from None
+
+
+def parse_rules(lines, source: str = '') -> dict:
+    """規則ファイルの行を {カテゴリ: {種類: [値, ...]}} に変換する"""
+    rules_by_category = {}
+    category = ALL_CATEGORIES
+    for number, raw in enumerate(lines, start=1):
+        line = raw.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            category = line[1:-1].strip() or ALL_CATEGORIES
+            continue
+        kind, separator, value = line.partition(':')
+        kind = kind.strip()
+        if not separator or kind not in _RULE_KINDS:
+            kind, value = 'exclude', line
+        value = value.strip()
+        rules = rules_by_category.setdefault(category, _empty_rules())
+        try:
+            if kind == 'price':
+                rules['price'] = _parse_price_band(value)
+            else:
+                if kind.endswith('_re'):
+                    re.compile(_scoped(value))
+                rules[kind].append(value)
+        except (RuleError, re.error) as e:
+            raise RuleError(f"{source}:{number}: {e}") from None
+    return rules_by_category
+
+
+def load_rules(makers_file: str, keywords_file: str, rules_file: str) -> RuleSet:
+    """除外メーカー・除外キーワードのリストと規則ファイルを読み、コンパイルした規則を返す"""
+    rules_by_category = {}
+    if rules_file and os.path.exists(rules_file):
+        with open(rules_file, encoding='utf-8') as f:
+            rules_by_category = parse_rules(f, rules_file)
+    # 除外キーワードのリスト (1行1キーワード) はすべてのカテゴリの exclude として扱う
+    common = rules_by_category.setdefault(ALL_CATEGORIES, _empty_rules())
+    common['exclude'] = sorted(utils.load_string_list_from_file(keywords_file)) + common['exclude']
+    return RuleSet(utils.load_string_list_from_file(makers_file), rules_by_category)
+
+
+class FilterEngine:
+    """
+    現在の規則 (RuleSet) を持ち、リストのファイルが更新されたら読み直して差し替える。
+    差し替えは参照の付け替え1回で行うため、取得中の処理は作成時点の規則で最後まで判定する。
+    """
+
+    def __init__(self, makers_file: str, keywords_file: str, rules_file: str = None):
+        self._paths = (makers_file, keywords_file, rules_file)
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._watcher = None
+        self._stop = threading.Event()
+        self._mtimes = self._current_mtimes()
+        try:
+            self._rules = load_rules(*self._paths)
+        except RuleError as e:
+            # 規則ファイルに誤りがあっても、除外メーカー・除外キーワードのリストだけで動かす
+            logging.getLogger(__name__).error(f"絞り込みの規則ファイルを読み込めませんでした: {e}")
+            self._rules = load_rules(makers_file, keywords_file, None)
+
+    def _current_mtimes(self) -> tuple:
+        mtimes = []
+        for path in self._paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns if path else None)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    @property
+    def rules(self) -> RuleSet:
+        return self._rules
+
+    def row_filter(self, category: str = None, filter_keyword: str = None) -> RowFilter:
+        """category の商品を絞り込む RowFilter (現在の規則で作る)"""
+        return RowFilter(self._rules.matcher(category), filter_keyword)
+
+    def maker_visible(self, maker: str) -> bool:
+        return self._rules.maker_visible(maker)
+
+    def add_listener(self, listener):
+        """規則を差し替えたときに listener(新しい RuleSet) を呼ぶ"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def reload_if_changed(self) -> bool:
+        """ファイルが更新されていれば読み直す。差し替えた場合は True。"""
+        log = logging.getLogger(__name__)
+        with self._lock:
+            mtimes = self._current_mtimes()
+            if mtimes == self._mtimes:
+                return False
+            self._mtimes = mtimes
+            try:
+                rules = load_rules(*self._paths)
+            except (OSError, RuleError) as e:
+                log.error(f"絞り込みの規則を読み直せませんでした (以前の規則を使い続けます): {e}")
+                return False
+            self._rules = rules
+            listeners = list(self._listeners)
+        log.info("絞り込みの規則を読み直しました。")
+        for listener in listeners:
+            try:
+                listener(rules)
+            except Exception as e:
+                log.warning(f"規則の差し替えの通知でエラーが発生しました: {e}", exc_info=True)
+        return True
+
+    def _watch(self, interval: float):
+        while not self._stop.wait(interval):
+            self.reload_if_changed()
+
+    def start_watching(self, interval: float):
+        """interval 秒ごとにファイルの更新を確認するスレッドを起動する"""
+        with self._lock:
+            if self._watcher is None and interval > 0:
+                self._watcher = threading.Thread(target=self._watch, args=(interval,), name='filter-watcher', daemon=True)
+                self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+
+
+# --- プロセス全体で共有する絞り込み ---
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> FilterEngine:
+    """共有の絞り込みを返す (初回呼び出し時に規則を読み込み、ファイルの監視を始める)"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = FilterEngine(config.EXCLUDED_MAKERS_FILE, config.EXCLUDED_KEYWORDS_FILE, config.FILTER_RULES_FILE)
+            _engine.start_watching(config.FILTER_WATCH_INTERVAL)
+        return _engine
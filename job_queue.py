@@ -0,0 +1,292 @@
+# ジョブキュー (本番構成)
+#
+# 本番構成 (config.JOB_BACKEND = 'queue') では、Webのプロセスは検索ジョブを実行せず、ここ (SQLite) に
+# 入れるだけにする。worker.py のワーカープロセスがジョブを1件ずつ取り出して実行し、進捗イベントと
+# 終了時の状態を書き戻す。Webのプロセスはそれを読んで Server-Sent Events・ポーリングで配信する。
+# 外部のブローカーは使わず、Web・ワーカーのすべてのプロセスが同じデータベースファイルを開く。
+#
+# ワーカーは実行中のジョブの生存を定期的に記録する (heartbeat)。ワーカーのプロセスが落ちた場合は、
+# 監視側 (worker.py の親プロセス) がそのジョブを失敗として終わらせる。
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import config
+
+# ジョブの種類
+SEARCH = 'search'                # 検索 (params は search.run_search の引数)
+MAKER_CATALOG = 'maker_catalog'  # メーカー一覧の取り直し (params は {'category': カテゴリ})
+
+# ジョブの状態
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+FINISHED_STATES = (DONE, CANCELLED, FAILED)
+
+_JOB_COLUMNS = (
+    'id', 'kind', 'params', 'status', 'worker', 'cancel_requested', 'result_id', 'error',
+    'makers_total', 'makers_done', 'result_count', 'created_at', 'started_at', 'heartbeat_at', 'finished_at',
+)
+
+
+class JobQueue:
+    """ジョブと進捗イベントを保存するデータベース (複数のプロセスから同時に使う)"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        # 書き込みはトランザクションを明示する (取り出しは BEGIN IMMEDIATE で他のプロセスと競合させない)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                dedupe_key TEXT,
+                status TEXT NOT NULL,
+                worker TEXT,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                result_id TEXT,
+                error TEXT,
+                makers_total INTEGER NOT NULL DEFAULT 0,
+                makers_done INTEGER NOT NULL DEFAULT 0,
+                result_count INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                heartbeat_at REAL,
+                finished_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs (dedupe_key, status)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_events (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            )
+        """)
+
+    @contextmanager
+    def _transaction(self):
+        """ロックを取り、BEGIN IMMEDIATE 〜 COMMIT (例外の場合は ROLLBACK) で囲む"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    @staticmethod
+    def _row_to_dict(row) -> dict:
+        job = dict(zip(_JOB_COLUMNS, row))
+        job['params'] = json.loads(job['params'])
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        return job
+
+    @staticmethod
+    def status_event(job: dict) -> dict:
+        """'status' イベントのデータ (jobs.Job.to_dict() と同じ形)"""
+        return {
+            'job_id': job['id'],
+            'status': job['status'],
+            'makers_total': job['makers_total'],
+            'makers_done': job['makers_done'],
+            'result_count': job['result_count'],
+            'result_id': job['result_id'],
+            'error': job['error'],
+        }
+
+    def _append_event_locked(self, job_id: str, event_type: str, data: dict):
+        self._conn.execute(
+            "INSERT INTO job_events (job_id, seq, type, data) "
+            "SELECT ?, COALESCE(MAX(seq), -1) + 1, ?, ? FROM job_events WHERE job_id = ?",
+            (job_id, event_type, json.dumps(data, ensure_ascii=False), job_id)
+        )
+
+    def _get_locked(self, job_id: str):
+        row = self._conn.execute(
+            f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def enqueue(self, kind: str, params: dict, makers_total: int = 0, dedupe_key: str = None) -> str:
+        """
+        ジョブを登録してジョブIDを返す。dedupe_key を指定すると、同じキーのジョブが順番待ち・実行中なら
+        新しく登録せずにそのジョブIDを返す。
+        """
+        with self._transaction():
+            if dedupe_key is not None:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE dedupe_key = ? AND status IN (?, ?) LIMIT 1",
+                    (dedupe_key, QUEUED, RUNNING)
+                ).fetchone()
+                if row:
+                    return row[0]
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, params, dedupe_key, status, makers_total, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params, ensure_ascii=False), dedupe_key, QUEUED, makers_total, time.time())
+            )
+            self._append_event_locked(job_id, 'status', self.status_event(self._get_locked(job_id)))
+        return job_id
+
+    def get(self, job_id: str):
+        """ジョブの状態を dict で返す (無ければ None)"""
+        with self._lock:
+            return self._get_locked(job_id)
+
+    def claim(self, worker: str):
+        """最も古い順番待ちのジョブを worker の実行中にして返す (無ければ None)"""
+        now = time.time()
+        with self._transaction():
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, started_at = ?, heartbeat_at = ? WHERE id = ?",
+                (RUNNING, worker, now, now, row[0])
+            )
+            job = self._get_locked(row[0])
+            self._append_event_locked(job['id'], 'status', self.status_event(job))
+        return job
+
+    def append_event(self, job_id: str, event_type: str, data: dict, makers_done: int = None,
+                     result_count: int = None):
+        """進捗イベントを追加する (makers_done / result_count を渡すとジョブの集計も更新する)"""
+        with self._transaction():
+            self._append_event_locked(job_id, event_type, data)
+            if makers_done is not None or result_count is not None:
+                self._conn.execute(
+                    "UPDATE jobs SET makers_done = COALESCE(?, makers_done), "
+                    "result_count = COALESCE(?, result_count) WHERE id = ?",
+                    (makers_done, result_count, job_id)
+                )
+
+    def events_since(self, job_id: str, index: int, event_type: str = None) -> list:
+        """index 番目以降のイベント ({'id', 'type', 'data'}) を返す"""
+        query = "SELECT seq, type, data FROM job_events WHERE job_id = ? AND seq >= ?"
+        args = [job_id, index]
+        if event_type is not None:
+            query += " AND type = ?"
+            args.append(event_type)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY seq", args).fetchall()
+        return [{'id': seq, 'type': kind, 'data': json.loads(data)} for seq, kind, data in rows]
+
+    def heartbeat(self, job_id: str) -> bool:
+        """実行中のジョブの生存を記録し、中止が要求されていれば True を返す"""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id))
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def request_cancel(self, job_id: str) -> bool:
+        """
+        ジョブの中止を要求する。順番待ちのジョブはその場で中止し、実行中のジョブはワーカーが
+        次の heartbeat で気付いて止める。終了済み・存在しない場合は False。
+        """
+        with self._transaction():
+            job = self._get_locked(job_id)
+            if job is None or job['status'] in FINISHED_STATES:
+                return False
+            if job['status'] == QUEUED:
+                self._finish_locked(job, CANCELLED)
+            else:
+                self._conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+        return True
+
+    def _finish_locked(self, job: dict, status: str, result_id: str = None, error: str = None,
+                       makers_done: int = None, result_count: int = None):
+        now = time.time()
+        self._conn.execute(
+            "UPDATE jobs SET status = ?, result_id = ?, error = ?, finished_at = ?, "
+            "makers_done = COALESCE(?, makers_done), result_count = COALESCE(?, result_count) WHERE id = ?",
+            (status, result_id, error, now, makers_done, result_count, job['id'])
+        )
+        # 状態と最後の 'status' イベントは同じトランザクションで書く (配信側が最後のイベントを取りこぼさない)
+        self._append_event_locked(job['id'], 'status', self.status_event(self._get_locked(job['id'])))
+
+    def finish(self, job_id: str, status: str, result_id: str = None, error: str = None,
+               makers_done: int = None, result_count: int = None):
+        """ジョブを終了状態 (DONE / CANCELLED / FAILED) にする"""
+        with self._transaction():
+            job = self._get_locked(job_id)
+            if job is not None and job['status'] not in FINISHED_STATES:
+                self._finish_locked(job, status, result_id, error, makers_done, result_count)
+
+    def fail_running(self, error: str, worker: str = None, heartbeat_before: float = None) -> list:
+        """
+        worker が実行中のジョブ、または heartbeat_before より前から生存の記録が無い実行中のジョブを
+        失敗として終わらせ、そのジョブIDのリストを返す (ワーカーのプロセスが落ちた場合の後始末)。
+        """
+        conditions, args = [], []
+        if worker is not None:
+            conditions.append("worker = ?")
+            args.append(worker)
+        if heartbeat_before is not None:
+            conditions.append("heartbeat_at < ?")
+            args.append(heartbeat_before)
+        if not conditions:
+            return []
+        with self._transaction():
+            rows = self._conn.execute(
+                f"SELECT id FROM jobs WHERE status = ? AND ({' OR '.join(conditions)})", [RUNNING] + args
+            ).fetchall()
+            for (job_id,) in rows:
+                self._finish_locked(self._get_locked(job_id), FAILED, error=error)
+        if rows:
+            logging.getLogger(__name__).warning(f"ジョブキュー: 実行中のジョブ {len(rows)} 件を失敗にしました ({error})。")
+        return [job_id for (job_id,) in rows]
+
+    def wait(self, job_id: str, timeout: float = None):
+        """ジョブが終わるまで (timeout 秒まで) 待ち、その時点の状態を返す"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] in FINISHED_STATES:
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(config.JOB_QUEUE_POLL_INTERVAL)
+
+    def purge(self, retention: float):
+        """終了してから retention 秒を過ぎたジョブとその進捗イベントを削除する"""
+        threshold = time.time() - retention
+        with self._transaction():
+            self._conn.execute(
+                "DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE finished_at < ?)", (threshold,)
+            )
+            self._conn.execute("DELETE FROM jobs WHERE finished_at < ?", (threshold,))
+
+    def stats(self) -> dict:
+        """状態ごとのジョブ数"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+
+# --- プロセス全体で共有するジョブキュー ---
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> JobQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(config.JOB_QUEUE_FILE)
+        return _queue
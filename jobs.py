@@ -0,0 +1,242 @@
+# 検索ジョブの管理
+#
+# 検索はリクエストスレッドではなくバックグラウンドで実行し、
+# 進捗 (メーカーごとの開始・完了、見つかった利益商品) をイベントとして蓄積する。
+# Webサーバーはイベントを Server-Sent Events またはポーリングで配信する。
+#
+# 実行場所は config.JOB_BACKEND で選ぶ。
+#   'thread': Webサーバーのプロセス内のスレッドで実行する (JobManager、開発用)
+#   'queue':  ジョブキュー (job_queue) に入れ、worker.py のワーカープロセスが実行する (QueueJobManager、本番構成)
+import concurrent.futures
+import logging
+import threading
+import time
+import uuid
+
+import config
+import job_queue
+import metrics
+import result_store
+import search
+from job_queue import QUEUED, RUNNING, DONE, CANCELLED, FAILED, FINISHED_STATES
+
+
+class Job:
+    """1件の検索ジョブ。進捗イベントを順番に保持する。"""
+
+    def __init__(self, params: dict):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.finished_at = None
+        self.results = []
+        self.result_id = None
+        self.error = None
+        self.makers_total = len(params.get('makers', []))
+        self.makers_done = 0
+
+        self.cancel_event = threading.Event()
+        self._cond = threading.Condition()
+        self._events = []
+
+    def emit(self, event_type: str, data: dict):
+        """進捗イベントを追加し、待機中の配信スレッドを起こす"""
+        with self._cond:
+            self._events.append({'id': len(self._events), 'type': event_type, 'data': data})
+            self._cond.notify_all()
+
+    def events_since(self, index: int, timeout: float = None) -> list:
+        """index 番目以降のイベントを返す。まだ無ければ timeout 秒まで待つ。"""
+        with self._cond:
+            if index >= len(self._events) and self.status not in FINISHED_STATES and timeout:
+                self._cond.wait(timeout)
+            return self._events[index:]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def to_dict(self) -> dict:
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'makers_total': self.makers_total,
+            'makers_done': self.makers_done,
+            'result_count': len(self.results),
+            'result_id': self.result_id,
+            'error': self.error,
+        }
+
+    # --- search.run_search から呼ばれる進捗コールバック ---
+    def on_progress(self, event_type: str, data: dict):
+        with self._cond:
+            if event_type == 'maker_done':
+                self.makers_done += 1
+                data = dict(data, makers_done=self.makers_done, makers_total=self.makers_total)
+            elif event_type == 'item':
+                self.results.append(data)
+            self.emit(event_type, data)
+
+
+def run_job(job: Job) -> str:
+    """ジョブの検索を実行し、終了時の状態 (DONE / CANCELLED / FAILED) を返す"""
+    log = logging.getLogger(__name__)
+    timings = metrics.SearchTimings(job.params.get('category_name'))
+    try:
+        results = search.run_search(
+            progress=job.on_progress, cancel_event=job.cancel_event, timings=timings, **job.params
+        )
+        job.results = results
+        # 結果はサーバー側に保存し、以後は結果IDで参照する (処理時間の内訳も結果ページに表示する)
+        job.result_id = result_store.get_store().put(results, meta=dict(job.params, timings=timings.to_dict()))
+        return CANCELLED if job.cancel_event.is_set() else DONE
+    except Exception as e:
+        log.error(f"検索ジョブ {job.id} でエラーが発生しました: {e}", exc_info=True)
+        job.error = str(e)
+        return FAILED
+
+
+class JobManager:
+    """検索ジョブを実行するスレッドプールと、ジョブの一覧"""
+
+    def __init__(self, max_workers: int, retention: float):
+        self.retention = retention
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='search-job'
+        )
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, params: dict) -> Job:
+        """ジョブを登録して実行キューに入れ、すぐに返す"""
+        self._purge_expired()
+        job = Job(params)
+        with self._lock:
+            self._jobs[job.id] = job
+        job.emit('status', job.to_dict())
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """ジョブの中止を要求する。実行中のメーカーは現在の商品の処理後に止まる。"""
+        job = self.get(job_id)
+        if not job or job.finished:
+            return False
+        job.cancel_event.set()
+        return True
+
+    def _run(self, job: Job):
+        if job.cancel_event.is_set():
+            self._finish(job, CANCELLED)
+            return
+        job.status = RUNNING
+        job.emit('status', job.to_dict())
+        self._finish(job, run_job(job))
+
+    @staticmethod
+    def _finish(job: Job, status: str):
+        job.finished_at = time.time()
+        job.status = status
+        job.emit('status', job.to_dict())
+
+    def _purge_expired(self):
+        """終了してから保持期間を過ぎたジョブを一覧から削除する"""
+        threshold = time.time() - self.retention
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at < threshold]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+
+class QueuedJob:
+    """
+    ジョブキュー上の検索ジョブを Webのプロセスから見たもの (Job と同じ属性・メソッドを持つ)。
+    状態・進捗はワーカーのプロセスが書き込むため、参照のたびにジョブキューから読み直す。
+    """
+
+    def __init__(self, queue: job_queue.JobQueue, row: dict):
+        self._queue = queue
+        self.id = row['id']
+        self.params = row['params']
+        self._row = row
+
+    def _refresh(self):
+        self._row = self._queue.get(self.id) or self._row
+
+    @property
+    def status(self) -> str:
+        return self._row['status']
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    @property
+    def result_id(self):
+        return self._row['result_id']
+
+    @property
+    def results(self) -> list:
+        """これまでに見つかった利益商品"""
+        return [event['data'] for event in self._queue.events_since(self.id, 0, event_type='item')]
+
+    def events_since(self, index: int, timeout: float = None) -> list:
+        """index 番目以降のイベントを返す。まだ無ければ timeout 秒までジョブキューを読み直して待つ。"""
+        deadline = time.monotonic() + (timeout or 0)
+        while True:
+            # 状態を先に読む (終了済みなら、その後に読むイベントには最後の 'status' イベントまで含まれる)
+            self._refresh()
+            events = self._queue.events_since(self.id, index)
+            if events or self.finished or time.monotonic() >= deadline:
+                return events
+            time.sleep(config.JOB_QUEUE_POLL_INTERVAL)
+
+    def to_dict(self) -> dict:
+        return job_queue.JobQueue.status_event(self._row)
+
+
+class QueueJobManager:
+    """検索ジョブをジョブキューに入れる (実行は worker.py のワーカープロセス)。JobManager と同じメソッドを持つ。"""
+
+    def __init__(self, queue: job_queue.JobQueue, retention: float):
+        self.retention = retention
+        self._queue = queue
+        # 順番待ちのジョブ数を見て、ワーカーのプロセス数を決められるようにする
+        metrics.JOBS.set_function(lambda: {(status,): count for status, count in queue.stats().items()})
+
+    def submit(self, params: dict) -> QueuedJob:
+        self._queue.purge(self.retention)
+        job_id = self._queue.enqueue(job_queue.SEARCH, params, makers_total=len(params.get('makers', [])))
+        return QueuedJob(self._queue, self._queue.get(job_id))
+
+    def get(self, job_id: str):
+        row = self._queue.get(job_id) if job_id else None
+        if row is None or row['kind'] != job_queue.SEARCH:
+            return None
+        return QueuedJob(self._queue, row)
+
+    def cancel(self, job_id: str) -> bool:
+        return self._queue.request_cancel(job_id)
+
+
+# --- プロセス全体で共有するジョブマネージャ ---
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    """config.JOB_BACKEND に応じて JobManager または QueueJobManager を返す"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            if config.JOB_BACKEND == 'queue':
+                _manager = QueueJobManager(job_queue.get_queue(), config.JOB_RETENTION)
+            else:
+                _manager = JobManager(config.JOB_MAX_CONCURRENT, config.JOB_RETENTION)
+        return _manager
@@ -1,15 +1,75 @@
-# このファイルはアプリケーションのエントリポイントとして機能しますが、
+# このファイルはWebサーバーを使わない一括検索 (夜間バッチ) のエントリポイントです。
 # 主要なロジックは他のモジュールに分割されています。
 #
 # web_server.py: Flaskアプリケーションのルーティングとサーバー起動
-# search.py:     検索とデータ比較のコアロジック (今後作成予定)
+# wsgi.py:       本番構成のWebの層 (gunicorn wsgi:app)
+# worker.py:     本番構成のワーカーの層 (ジョブキューの検索ジョブを別プロセスで実行)
+# sweep.py:      全カテゴリ・全メーカーの一括検索 (チェックポイントからの再開、JSONL/CSV出力)
+# search.py:     検索とデータ比較のコアロジック
 # scrapers/:     各ウェブサイトからのデータ取得ロジック
 # config.py:     アプリケーション全体の設定
 # utils.py:      共通のユーティリティ関数
-
+#
+# 使い方:
+#   python main.py -o results.jsonl                      全カテゴリ・全メーカーを検索する
+#   python main.py --spec job.json -o results.csv        ジョブ指定ファイルに従って検索し、CSVに出力する
+#   python main.py -c CPU -c メモリ --limit 30 --margin 20 -o results.jsonl
+# 中断 (Ctrl+C) した場合は、同じコマンドを再実行すると完了済みの (カテゴリ, メーカー) を飛ばして再開する。
+import argparse
 import logging
+import signal
+import sys
+import threading
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="価格.comとAmazonの一括比較 (Webサーバー不要)")
+    parser.add_argument("-o", "--output", required=True, help="結果の出力先 (.jsonl または .csv)")
+    parser.add_argument("--spec", help="ジョブ指定ファイル (JSON: categories, makers, limit, profit_margin, ...)")
+    parser.add_argument("-c", "--category", action="append", dest="categories", help="検索するカテゴリ (複数指定可)")
+    parser.add_argument("-m", "--maker", action="append", dest="makers", help="検索するメーカー (複数指定可)")
+    parser.add_argument("--limit", type=int, help="1メーカーあたりの取得件数")
+    parser.add_argument("--margin", type=int, dest="profit_margin", help="利益率のしきい値 (%%)")
+    parser.add_argument("--keyword", dest="filter_keyword", help="絞り込みキーワード")
+    parser.add_argument("--sort", help="価格.comの並び順 (price_asc など)")
+    parser.add_argument("--incremental", action="store_true", default=None, help="差分モードで検索する")
+    parser.add_argument("--checkpoint", help="チェックポイントファイル (既定: 出力先 + .checkpoint)")
+    parser.add_argument("--fresh", action="store_true", help="チェックポイントと出力先を消して最初から検索する")
+    args = parser.parse_args(argv)
 
-# アプリケーションの主要な処理は web_server.py から開始されます。
-if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(threadName)s: %(message)s')
-    logging.info("アプリケーションを起動するには web_server.py を実行してください。")
\ No newline at end of file
+
+    import sweep
+    try:
+        spec = sweep.load_spec(
+            args.spec, categories=args.categories, makers=args.makers, limit=args.limit,
+            profit_margin=args.profit_margin, filter_keyword=args.filter_keyword, sort=args.sort,
+            incremental=args.incremental,
+        )
+    except (OSError, ValueError, sweep.SweepError) as e:
+        print(f"ジョブ指定を読み込めませんでした: {e}", file=sys.stderr)
+        return 2
+
+    # Ctrl+C では検索中のメーカーを打ち切り、完了済みの単位だけを記録して終了する
+    cancel_event = threading.Event()
+
+    def request_stop(signum, frame):
+        if cancel_event.is_set():
+            raise KeyboardInterrupt
+        logging.warning("中断を要求されました。処理中の単位を打ち切って終了します (もう一度押すと強制終了)。")
+        cancel_event.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    try:
+        stats = sweep.run_sweep(spec, args.output, args.checkpoint, fresh=args.fresh, cancel_event=cancel_event)
+    except sweep.SweepError as e:
+        print(e, file=sys.stderr)
+        return 2
+    print(sweep.format_summary(stats))
+    return 1 if stats['cancelled'] or stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
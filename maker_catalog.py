@@ -0,0 +1,249 @@
+# メーカー一覧のカタログ
+#
+# カテゴリ → メーカー一覧 をJSONファイルに保存し、サーバーを再起動してもすぐに使えるようにする。
+# カテゴリごとの有効期限が切れたものは裏で取り直す (条件付きGETで、変わっていなければ本文を受け取らない)。
+# 取り直しは同時実行数を制限したスレッドプールで並行に行う。
+# 本番構成 (config.JOB_BACKEND = 'queue') では SharedMakerCatalog を使い、取り直しはジョブキューに入れて
+# ワーカーのプロセスに任せる (Webのプロセスは価格.comにアクセスしない)。各プロセスはファイルの更新を見て読み直す。
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import config
+import filters
+import job_queue
+from scrapers import kakaku
+
+
+class MakerCatalog:
+    """
+    カテゴリごとのメーカー一覧。
+    エントリは {'makers': [...], 'maker_ids': {メーカー名: LstMakerの値}, 'fetched_at': 取得日時,
+    'changed_at': 一覧が最後に変わった日時, 'etag' / 'last_modified': 価格.comの応答ヘッダ, 'version': 一覧のハッシュ}。
+    """
+
+    def __init__(self, path: str, refresh_workers: int):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._refreshing = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, refresh_workers), thread_name_prefix='maker-catalog'
+        )
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.getLogger(__name__).warning(f"メーカーカタログを読み込めませんでした: {e}")
+            return
+        self._entries = entries
+        # 検索URLの組み立てに使うメーカーIDも、取り直さずにそのまま使う
+        for category, entry in entries.items():
+            kakaku.set_maker_ids(category, entry.get('maker_ids', {}))
+        logging.getLogger(__name__).info(f"メーカーカタログを読み込みました ({len(entries)} カテゴリ)。")
+
+    def _save_locked(self):
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logging.getLogger(__name__).warning(f"メーカーカタログの保存に失敗しました: {e}")
+
+    @staticmethod
+    def _ttl(category: str) -> float:
+        return config.MAKER_CATALOG_TTL_BY_CATEGORY.get(category, config.MAKER_CATALOG_TTL_DEFAULT)
+
+    def is_fresh(self, category: str, entry: dict) -> bool:
+        return time.time() - entry['fetched_at'] <= self._ttl(category)
+
+    def _refresh(self, category: str):
+        """カテゴリのメーカー一覧を取り直して保存する。取得できなければ以前のエントリのまま。"""
+        with self._lock:
+            previous = self._entries.get(category)
+        fetched = kakaku.fetch_maker_options(
+            category,
+            etag=previous.get('etag') if previous else None,
+            last_modified=previous.get('last_modified') if previous else None,
+        )
+        if fetched is None:
+            return previous
+
+        now = time.time()
+        with self._lock:
+            if fetched == kakaku.NOT_MODIFIED:
+                entry = dict(previous, fetched_at=now)
+            else:
+                makers = kakaku.visible_makers(fetched['options'])
+                version = self._version(makers)
+                unchanged = previous is not None and previous.get('version') == version
+                entry = {
+                    'makers': makers,
+                    'maker_ids': {name: value for value, name in fetched['options']},
+                    'fetched_at': now,
+                    'changed_at': previous['changed_at'] if unchanged else now,
+                    'etag': fetched['etag'],
+                    'last_modified': fetched['last_modified'],
+                    'version': version,
+                }
+            self._entries[category] = entry
+            self._save_locked()
+        return entry
+
+    @staticmethod
+    def _version(makers: list) -> str:
+        """APIのETagに使う (一覧が同じなら取り直しても変わらない)"""
+        return hashlib.sha1(json.dumps(makers, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+    def apply_rules(self, rules: filters.RuleSet):
+        """除外メーカーのリストが変わったとき、保存済みのメーカーIDから各カテゴリの一覧を作り直す"""
+        now = time.time()
+        with self._lock:
+            changed = False
+            for category, entry in self._entries.items():
+                options = [(value, name) for name, value in entry.get('maker_ids', {}).items()]
+                makers = kakaku.visible_makers(options, rules)
+                version = self._version(makers)
+                if version != entry.get('version'):
+                    self._entries[category] = dict(entry, makers=makers, version=version, changed_at=now)
+                    changed = True
+            if changed:
+                self._save_locked()
+
+    def _run_refresh(self, category: str):
+        try:
+            return self._refresh(category)
+        finally:
+            with self._lock:
+                self._refreshing.pop(category, None)
+
+    def refresh_async(self, category: str) -> concurrent.futures.Future:
+        """取り直しを予約する (同じカテゴリの取り直しが進行中ならその Future を返す)"""
+        with self._lock:
+            future = self._refreshing.get(category)
+            if future is None:
+                future = self._executor.submit(self._run_refresh, category)
+                self._refreshing[category] = future
+            return future
+
+    def get(self, category: str, timeout: float = None):
+        """
+        カテゴリのメーカー一覧のエントリを返す。
+        期限切れなら古いエントリを返しつつ裏で取り直し、無ければ取得を待つ (timeout 秒まで)。
+        取得できなかった場合は None。
+        """
+        with self._lock:
+            entry = self._entries.get(category)
+        if entry is not None:
+            if not self.is_fresh(category, entry):
+                self.refresh_async(category)
+            return entry
+        try:
+            return self.refresh_async(category).result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            return None
+
+    def refresh_stale(self, categories) -> list:
+        """有効期限切れ・未取得のカテゴリをまとめて並行に取り直す (完了を待たずに Future のリストを返す)"""
+        with self._lock:
+            stale = [
+                category for category in categories
+                if category not in self._entries or not self.is_fresh(category, self._entries[category])
+            ]
+        if stale:
+            logging.getLogger(__name__).info(f"メーカーカタログ: {len(stale)} カテゴリを取り直します。")
+        return [self.refresh_async(category) for category in stale]
+
+
+class SharedMakerCatalog(MakerCatalog):
+    """
+    複数のプロセスで1つのファイルを共有するカタログ (本番構成)。
+    取り直しはジョブキューの MAKER_CATALOG ジョブとして登録し、ワーカーが refresh_now() で実行する。
+    """
+
+    def __init__(self, path: str, queue: job_queue.JobQueue):
+        self._queue = queue
+        self._mtime = None
+        super().__init__(path, refresh_workers=1)
+        self._mtime = self._file_mtime()
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _reload_if_changed_locked(self):
+        """他のプロセスがファイルを更新していれば読み直す"""
+        mtime = self._file_mtime()
+        if mtime != self._mtime:
+            self._mtime = mtime
+            self._load()
+
+    def _save_locked(self):
+        # 他のプロセスが後から取り直したカテゴリは、手元の古いエントリで上書きしない
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                on_disk = json.load(f)
+        except (OSError, ValueError):
+            on_disk = {}
+        for category, entry in on_disk.items():
+            mine = self._entries.get(category)
+            if mine is None or entry.get('fetched_at', 0) > mine.get('fetched_at', 0):
+                self._entries[category] = entry
+        super()._save_locked()
+        self._mtime = self._file_mtime()
+
+    def refresh_async(self, category: str) -> str:
+        """取り直しをジョブキューに登録し、ジョブIDを返す (同じカテゴリの取り直しが登録済みならそのジョブID)"""
+        return self._queue.enqueue(job_queue.MAKER_CATALOG, {'category': category}, dedupe_key=f"maker_catalog:{category}")
+
+    def refresh_now(self, category: str):
+        """このプロセスで取り直す (ワーカーが MAKER_CATALOG ジョブを実行するときに呼ぶ)"""
+        with self._lock:
+            self._reload_if_changed_locked()
+        return self._refresh(category)
+
+    def get(self, category: str, timeout: float = None):
+        with self._lock:
+            self._reload_if_changed_locked()
+            entry = self._entries.get(category)
+        if entry is not None:
+            if not self.is_fresh(category, entry):
+                self.refresh_async(category)
+            return entry
+        # 未取得のカテゴリはワーカーの取り直しを待つ
+        self._queue.wait(self.refresh_async(category), timeout)
+        with self._lock:
+            self._reload_if_changed_locked()
+            return self._entries.get(category)
+
+
+# --- プロセス全体で共有するカタログ ---
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> MakerCatalog:
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            if config.JOB_BACKEND == 'queue':
+                _catalog = SharedMakerCatalog(config.MAKER_CATALOG_FILE, job_queue.get_queue())
+            else:
+                _catalog = MakerCatalog(config.MAKER_CATALOG_FILE, config.MAKER_CATALOG_REFRESH_WORKERS)
+            # 前回の起動から除外メーカーのリストが変わっていれば反映し、以降の変更も反映する
+            engine = filters.get_engine()
+            _catalog.apply_rules(engine.rules)
+            engine.add_listener(_catalog.apply_rules)
+        return _catalog
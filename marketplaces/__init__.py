@@ -0,0 +1,76 @@
+# 販売先 (マーケットプレイス) のプラグイン
+#
+# 価格.comで見つけた商品を「どこで売れば一番高いか」を調べるための、販売先ごとの実装。
+# 販売先は Marketplace を継承したクラスを marketplaces/<名前>.py に書き、@register で登録する。
+# config.MARKETPLACES に挙げた販売先だけが検索で使われ、search が商品ごとにすべての販売先へ
+# 同時に問い合わせる (fanout.FanOut)。
+import importlib
+import threading
+
+import config
+
+
+class Marketplace:
+    """
+    販売先1つ分。サブクラスは name / label / site と search_url(), lookup() を実装する。
+    lookup() はスケジューラの site のキューのワーカーで実行される。
+    """
+    name = None    # 設定・価格履歴で使う識別子
+    label = None   # 結果ページでの表示名
+    site = None    # 取得に使うスケジューラのキュー (config.SCHEDULER_SITES)
+
+    def __init__(self, deadline: float, hedge_after: float = None):
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+
+    @property
+    def history_source(self) -> str:
+        """価格履歴 (price_history) に記録するときの取得元"""
+        return self.name
+
+    def search_url(self, keyword: str) -> str:
+        """販売価格が見つからなかったときに結果ページからリンクする、検索結果ページのURL"""
+        raise NotImplementedError
+
+    def lookup_cached(self, keyword: str, category: str):
+        """
+        キャッシュだけを引く (検索スレッドで呼ばれるため、サイトにはアクセスしないこと)。
+        使える値があれば (結果 または None, amazon_cache.HIT/STALE) を、無ければ None を返す。
+        """
+        return None
+
+    def lookup(self, keyword: str, category: str):
+        """販売価格を取得し、{'price': 価格, 'url': 商品URL} または見つからなければ None を返す"""
+        raise NotImplementedError
+
+
+_registry = {}
+_enabled = None
+_enabled_lock = threading.Lock()
+
+
+def register(cls):
+    """販売先のクラスを登録するデコレーター"""
+    _registry[cls.name] = cls
+    return cls
+
+
+def enabled() -> list:
+    """config.MARKETPLACES の販売先のインスタンス (初回呼び出し時にプラグインを読み込む)"""
+    global _enabled
+    with _enabled_lock:
+        if _enabled is None:
+            instances = []
+            for name in config.MARKETPLACES:
+                if name not in _registry:
+                    try:
+                        importlib.import_module(f"{__name__}.{name}")
+                    except ModuleNotFoundError as e:
+                        # プラグインの中で読み込めないモジュールがあった場合はそのまま知らせる
+                        if e.name != f"{__name__}.{name}":
+                            raise
+                if name not in _registry:
+                    raise ValueError(f"販売先 '{name}' のプラグインがありません (marketplaces/{name}.py)。")
+                instances.append(_registry[name](**config.MARKETPLACE_SETTINGS.get(name, {})))
+            _enabled = instances
+        return list(_enabled)
@@ -0,0 +1,33 @@
+# Amazon.co.jp (販売先プラグイン)
+#
+# 取得は scrapers.amazon、結果の保存と期限切れの再取得は amazon_cache が行う。
+import amazon_cache
+import price_history
+import scheduler
+from marketplaces import Marketplace, register
+from scrapers import amazon
+
+
+@register
+class AmazonMarketplace(Marketplace):
+    name = 'amazon'
+    label = 'Amazon'
+    site = 'amazon'
+
+    @property
+    def history_source(self) -> str:
+        return price_history.AMAZON
+
+    def search_url(self, keyword: str) -> str:
+        return amazon.search_url(keyword)
+
+    def _fetch_scheduled(self, keyword: str, asin: str = None):
+        """Amazon用のキューを通して検索する (キャッシュの裏での再取得に使う)"""
+        return scheduler.get_scheduler().submit(self.site, amazon.scrape_product, keyword, asin=asin).result()
+
+    def lookup_cached(self, keyword: str, category: str):
+        return amazon_cache.get_cache().lookup_cached(keyword, category, self._fetch_scheduled)
+
+    def lookup(self, keyword: str, category: str):
+        # ベンチマークが差し替えられるよう、scrape_product は呼び出し時に参照する
+        return amazon_cache.get_cache().fetch_and_store(keyword, category, amazon.scrape_product)
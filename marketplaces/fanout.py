@@ -0,0 +1,200 @@
+# 販売先への問い合わせの同時実行 (期限とヘッジ)
+#
+# 商品 × 販売先の問い合わせを、それぞれの販売先のスケジューラのキューへ投入し、
+# 終わったものから返す。遅い・止まっている販売先が検索全体を止めないように、
+#   - 取得を始めてから deadline 秒たっても終わらなければ打ち切る (部分的な結果で先に進む)
+#   - hedge_after 秒たっても終わらなければ同じ問い合わせをキューの先頭にもう1つ投入し、先に終わった方を使う
+#   - 販売先のキューがアクセス制限などで deadline 秒より長く止まっていたら、順番待ちの問い合わせを諦める
+# 打ち切った取得はワーカーの中で最後まで実行され、その結果はキャッシュに残る (次回の検索で使われる)。
+# 検索の終わりに close() で、まだ始まっていない取得を取り消し、実行中の取得が終わるのを待つ
+# (検索が返った後にスケジューラ・ブラウザを止めても、取得が動き続けないようにするため)。
+import concurrent.futures
+import logging
+import time
+
+import config
+import metrics
+import scheduler
+
+# 問い合わせの結果
+OK = 'ok'              # 取得できた (見つからなかった場合を含む)
+ERROR = 'error'        # すべての試行が失敗した
+DEADLINE = 'deadline'  # 期限内に終わらなかった
+BLOCKED = 'blocked'    # 販売先のキューが止まっていて、取得を始められなかった
+
+
+class _Attempt:
+    """1回分の取得。ワーカーで実行が始まった時刻を記録する。"""
+
+    def __init__(self, marketplace, keyword: str, category: str):
+        self.marketplace = marketplace
+        self.keyword = keyword
+        self.category = category
+        self.started_at = None
+        self.future = None
+        self.abandoned = False
+
+    def run(self):
+        if self.abandoned:
+            # 取り消せなかった (再試行でキューに戻っていた) 取得は実行しない
+            return None
+        self.started_at = time.monotonic()
+        with metrics.timed('marketplace_lookup', self.marketplace.name):
+            return self.marketplace.lookup(self.keyword, self.category)
+
+
+class _Lookup:
+    """1商品 × 1販売先の問い合わせ (ヘッジした再試行を含む)"""
+
+    def __init__(self, key, marketplace, keyword: str, category: str):
+        self.key = key
+        self.marketplace = marketplace
+        self.keyword = keyword
+        self.category = category
+        self.attempts = []
+
+    @property
+    def started_at(self):
+        started = [attempt.started_at for attempt in self.attempts if attempt.started_at is not None]
+        return min(started) if started else None
+
+    def cancel(self):
+        for attempt in self.attempts:
+            attempt.future.cancel()
+
+
+class FanOut:
+    """
+    商品ごとの販売先への問い合わせをまとめて管理する。
+    submit() で投入し、results() で (キー, 販売先, 結果 または None, OK/ERROR/DEADLINE/BLOCKED) を
+    終わった順に受け取る。cancel_event がセットされたら残りを取り消して終了する。
+    """
+
+    def __init__(self, crawl_scheduler=None, cancel_event=None):
+        self._scheduler = crawl_scheduler or scheduler.get_scheduler()
+        self._cancel_event = cancel_event
+        self._open = []
+        self._pending_keys = {}
+        self._attempts = []
+
+    def submit(self, key, marketplace, keyword: str, category: str):
+        lookup = _Lookup(key, marketplace, keyword, category)
+        self._start_attempt(lookup, scheduler.PRIORITY_NORMAL)
+        self._open.append(lookup)
+        self._pending_keys[key] = self._pending_keys.get(key, 0) + 1
+
+    def pending(self, key) -> bool:
+        """key の問い合わせがまだ終わっていないか"""
+        return self._pending_keys.get(key, 0) > 0
+
+    def _start_attempt(self, lookup: _Lookup, priority: float):
+        attempt = _Attempt(lookup.marketplace, lookup.keyword, lookup.category)
+        attempt.future = self._scheduler.submit_with_priority(lookup.marketplace.site, priority, attempt.run)
+        lookup.attempts.append(attempt)
+        self._attempts.append(attempt)
+
+    def _check(self, lookup: _Lookup, now: float, paused: dict):
+        """終わっていれば (結果, OK/ERROR/DEADLINE/BLOCKED) を、まだなら None を返す"""
+        log = logging.getLogger(__name__)
+        marketplace = lookup.marketplace
+        finished = [attempt.future for attempt in lookup.attempts if attempt.future.done()]
+        for future in finished:
+            if not future.cancelled() and future.exception() is None:
+                lookup.cancel()
+                return future.result(), OK
+        if len(finished) == len(lookup.attempts):
+            # 取り消された試行の exception() は CancelledError を送出するため、失敗した試行の例外だけを見る
+            errors = [future.exception() for future in finished if not future.cancelled()]
+            if errors:
+                log.warning(f"    {marketplace.label}の照合に失敗しました ({lookup.keyword}): {errors[-1]}")
+            else:
+                log.warning(f"    {marketplace.label}の照合は取り消されました (cancelled) ({lookup.keyword})。")
+            return None, ERROR
+
+        started_at = lookup.started_at
+        if started_at is None:
+            if paused.get(marketplace.site, 0.0) > marketplace.deadline:
+                lookup.cancel()
+                return None, BLOCKED
+            return None
+        elapsed = now - started_at
+        if elapsed >= marketplace.deadline:
+            lookup.cancel()
+            log.info(f"    {marketplace.label}の照合が {marketplace.deadline}秒以内に終わらなかったため打ち切りました ({lookup.keyword})。")
+            return None, DEADLINE
+        if len(lookup.attempts) == 1 and marketplace.hedge_after is not None and elapsed >= marketplace.hedge_after:
+            metrics.HEDGED_LOOKUPS.inc(marketplace=marketplace.name)
+            self._start_attempt(lookup, scheduler.PRIORITY_URGENT)
+        return None
+
+    def _next_wakeup(self, now: float) -> float:
+        """次にヘッジ・期限を確認すべきまでの秒数"""
+        timeout = config.MARKETPLACE_POLL_INTERVAL
+        for lookup in self._open:
+            started_at = lookup.started_at
+            if started_at is None:
+                continue
+            marketplace = lookup.marketplace
+            due = started_at + marketplace.deadline
+            if len(lookup.attempts) == 1 and marketplace.hedge_after is not None:
+                due = min(due, started_at + marketplace.hedge_after)
+            timeout = min(timeout, due - now)
+        return max(timeout, 0.0)
+
+    def cancel(self):
+        for lookup in self._open:
+            lookup.cancel()
+        self._open = []
+        self._pending_keys.clear()
+
+    def close(self, timeout: float = None) -> int:
+        """
+        まだ始まっていない取得を取り消し、実行中の取得が終わるのを timeout 秒
+        (既定は MARKETPLACE_CLOSE_TIMEOUT) まで待つ。戻り値は待ちきれずに放棄した取得の数。
+        """
+        self.cancel()
+        for attempt in self._attempts:
+            attempt.abandoned = True
+            attempt.future.cancel()
+        running = [attempt.future for attempt in self._attempts if not attempt.future.done()]
+        self._attempts = []
+        if not running:
+            return 0
+        timeout = config.MARKETPLACE_CLOSE_TIMEOUT if timeout is None else timeout
+        _, not_done = concurrent.futures.wait(running, timeout=timeout)
+        if not_done:
+            logging.getLogger(__name__).warning(
+                f"販売先への問い合わせ {len(not_done)}件が {timeout}秒以内に終わらなかったため放棄しました。"
+            )
+        return len(not_done)
+
+    def results(self):
+        while self._open:
+            if self._cancel_event is not None and self._cancel_event.is_set():
+                self.cancel()
+                return
+            now = time.monotonic()
+            paused = {site: stats['paused_for'] for site, stats in self._scheduler.stats().items()}
+            finished, still_open = [], []
+            for lookup in self._open:
+                checked = self._check(lookup, now, paused)
+                if checked is None:
+                    still_open.append(lookup)
+                else:
+                    finished.append((lookup, checked))
+            self._open = still_open
+
+            for lookup, (result, outcome) in finished:
+                if outcome in (DEADLINE, BLOCKED):
+                    metrics.MARKETPLACE_TIMEOUTS.inc(marketplace=lookup.marketplace.name, reason=outcome)
+                self._pending_keys[lookup.key] -= 1
+                yield lookup.key, lookup.marketplace, result, outcome
+
+            if self._open:
+                # 失敗済みの試行 (ヘッジの結果待ち) は待たない
+                futures = [
+                    attempt.future for lookup in self._open for attempt in lookup.attempts if not attempt.future.done()
+                ]
+                concurrent.futures.wait(
+                    futures, timeout=self._next_wakeup(time.monotonic()), return_when=concurrent.futures.FIRST_COMPLETED
+                )
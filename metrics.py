@@ -0,0 +1,291 @@
+# 計測 (メトリクス)
+#
+# 検索のどの段階 (ドライバー起動・ページ読み込み・要素待ち・パース・重複排除・販売先の照合など) に
+# 時間がかかっているかを、サイト・カテゴリ別のヒストグラムとして記録する。
+# 再試行・失敗・結果なしの回数はカウンタ、ドライバーやキューの状態はゲージとして持ち、
+# web_server の /metrics で Prometheus のテキスト形式で公開する。
+#
+# 検索1回分の内訳 (SearchTimings) は contextvars で保持する。検索の処理は複数のスレッドに
+# 分かれるため、スレッドプールやスケジューラへ投入するときに bind() / copy_context() で引き継ぐ。
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """ラベルの値の組ごとに値を持つメトリクスの共通部分"""
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} のラベルは {self.labelnames} です (指定: {tuple(labels)})")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        """(接尾辞, ラベルの値, 追加ラベル, 値) を返す"""
+        with self._lock:
+            return [('', key, (), value) for key, value in sorted(self._values.items())]
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, key, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """増える一方の回数"""
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """
+    現在の値。set() で設定するか、set_function() で /metrics の出力時に値を読み取る関数を登録する。
+    関数は {ラベルの値のタプル: 値} を返す。
+    """
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def _samples(self):
+        if self._function is None:
+            return super()._samples()
+        return [('', tuple(str(v) for v in key), (), value) for key, value in sorted(self._function().items())]
+
+
+class Histogram(_Metric):
+    """観測値の分布 (上限ごとの累積件数・合計・件数)"""
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=None):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets or config.METRICS_BUCKETS)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # 上限ごとの件数 (累積しない), 合計
+                counts = self._values[key] = [[0] * len(self.buckets), 0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][index] += 1
+                    break
+            counts[1] += value
+
+    def totals(self) -> dict:
+        """{ラベルの値のタプル: (件数, 合計)}"""
+        with self._lock:
+            return {key: (sum(counts[0]), counts[1]) for key, counts in self._values.items()}
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            items = sorted((key, (list(counts[0]), counts[1])) for key, counts in self._values.items())
+        for key, (bucket_counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, bucket_counts):
+                cumulative += count
+                samples.append(('_bucket', key, (('le', _format_value(float(bound))),), cumulative))
+            samples.append(('_sum', key, (), total))
+            samples.append(('_count', key, (), cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式 (text/plain; version=0.0.4) で出力する"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# --- 記録するメトリクス ---
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'pricecheck_stage_seconds', '検索の段階ごとの所要時間 (秒)', ('stage', 'site', 'category')
+))
+SEARCH_SECONDS = REGISTRY.register(Histogram(
+    'pricecheck_search_seconds', '検索1回の所要時間 (秒)', ('category',), buckets=config.METRICS_SEARCH_BUCKETS
+))
+SEARCHES = REGISTRY.register(Counter('pricecheck_searches_total', '実行した検索の回数', ('category',)))
+RETRIES = REGISTRY.register(Counter('pricecheck_retries_total', '取得を再試行した回数', ('site',)))
+FAILURES = REGISTRY.register(Counter('pricecheck_failures_total', '取得に失敗した回数', ('site',)))
+BLOCKED = REGISTRY.register(Counter('pricecheck_blocked_total', 'アクセス制限 (キャプチャ・429など) を検知した回数', ('site',)))
+EMPTY_RESULTS = REGISTRY.register(Counter(
+    'pricecheck_empty_results_total', '結果が無かった (価格.comで製品0件・Amazonで一致する商品なし) 回数',
+    ('site', 'category')
+))
+PAGE_BYTES = REGISTRY.register(Histogram(
+    'pricecheck_page_bytes', 'ページ1回の読み込みで転送したバイト数', ('site', 'engine'), buckets=config.METRICS_BYTES_BUCKETS
+))
+BLOCKED_REQUESTS = REGISTRY.register(Counter(
+    'pricecheck_blocked_requests_total', '読み込みプロファイルで遮断したリクエスト数 (Playwrightのみ)', ('site',)
+))
+HEDGED_LOOKUPS = REGISTRY.register(Counter(
+    'pricecheck_hedged_lookups_total', '販売先への問い合わせが遅いため、同じ問い合わせを追加で投入した回数', ('marketplace',)
+))
+MARKETPLACE_TIMEOUTS = REGISTRY.register(Counter(
+    'pricecheck_marketplace_timeouts_total',
+    '販売先への問い合わせを打ち切った回数 (deadline: 期限切れ, blocked: キューの停止)', ('marketplace', 'reason')
+))
+DRIVER_SESSIONS = REGISTRY.register(Gauge(
+    'pricecheck_driver_sessions', 'ドライバープールのセッション数 (active: 貸出中・起動中, idle: 待機中)', ('state',)
+))
+QUEUED_TASKS = REGISTRY.register(Gauge('pricecheck_scheduler_queued_tasks', 'スケジューラで順番待ちのタスク数', ('site',)))
+ACTIVE_TASKS = REGISTRY.register(Gauge('pricecheck_scheduler_active_tasks', 'スケジューラで実行中のタスク数', ('site',)))
+JOBS = REGISTRY.register(Gauge('pricecheck_jobs', 'ジョブキューの状態ごとのジョブ数 (本番構成のみ)', ('status',)))
+
+
+# 段階名 (stage ラベル) と結果ページでの表示名
+STAGE_LABELS = {
+    'queue_wait': 'スケジューラの順番待ち',
+    'driver_wait': 'ドライバーの空き待ち',
+    'driver_start': 'ドライバー起動',
+    'page_load': 'ページ読み込み',
+    'wait_selector': '要素の表示待ち',
+    'parse': 'パース',
+    'dedup': '重複排除',
+    'marketplace_lookup': '販売先の照合',
+}
+
+
+# --- 検索1回分の内訳 ---
+class SearchTimings:
+    """検索1回分の、段階・サイトごとの回数と合計時間"""
+
+    def __init__(self, category: str = ''):
+        self.category = category or ''
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._started = time.perf_counter()
+        self.elapsed = None
+
+    def add(self, stage: str, site: str, seconds: float):
+        with self._lock:
+            entry = self._stages.setdefault((stage, site), [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def finish(self) -> float:
+        self.elapsed = time.perf_counter() - self._started
+        return self.elapsed
+
+    def to_dict(self) -> dict:
+        """結果ページ用。並行して進んだ処理の時間も合算するため、合計が全体の時間を超えることがある。"""
+        with self._lock:
+            stages = [
+                {'stage': stage, 'site': site, 'count': count, 'seconds': seconds}
+                for (stage, site), (count, seconds) in self._stages.items()
+            ]
+        stages.sort(key=lambda entry: entry['seconds'], reverse=True)
+        return {'elapsed': self.elapsed, 'stages': stages}
+
+
+_current_timings = contextvars.ContextVar('search_timings', default=None)
+
+
+@contextmanager
+def activate(timings: SearchTimings):
+    """ブロック内 (と、そこから bind() したスレッド) の計測を timings にも記録する"""
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+def current_category() -> str:
+    timings = _current_timings.get()
+    return timings.category if timings else ''
+
+
+def bind(fn):
+    """現在の計測の文脈を引き継いで fn を実行する関数を返す (別スレッドに渡す処理に使う)"""
+    context = contextvars.copy_context()
+    # 同じ文脈を複数のスレッドで同時に run() できないため、呼び出しごとに複製する
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+def observe_stage(stage: str, site: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage, site=site, category=current_category())
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(stage, site, seconds)
+
+
+@contextmanager
+def timed(stage: str, site: str):
+    """ブロックの所要時間を段階 stage の時間として記録する (例外で抜けた場合も記録する)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, site, time.perf_counter() - started)
+
+
+def render() -> str:
+    return REGISTRY.render()
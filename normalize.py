@@ -0,0 +1,103 @@
+# 製品名の正規化
+#
+# 重複排除のキー、Amazonの検索キーワード、キャッシュ・価格履歴のキーは
+# すべてここで製品名から作る。正規表現はあらかじめコンパイルし、
+# 同じ製品名に対する結果はメモ化する (検索のたびに同じ名前が何度も現れるため)。
+import functools
+import re
+import unicodedata
+
+# 製品名中のメーカー名表記 [〇〇] 【〇〇】
+_BRACKETED_PATTERN = re.compile(r'[\[【].*?[\]】]')
+_BRACKET_CHARS_PATTERN = re.compile(r'[\[\]【】]')
+_PARENS_PATTERN = re.compile(r'[()]')
+_PARENTHETICAL_PATTERN = re.compile(r'\(.*?\)')
+_SPACES_PATTERN = re.compile(r'\s+')
+_DIGIT_PATTERN = re.compile(r'\d')
+# 同じ型番の販売形態違い (CPUのBOX/バルクなど) を表す末尾の語
+_PACKAGING_SUFFIX_PATTERN = re.compile(r'(?:\s+(?:BOX|バルク|BULK|TRAY|MPK))+$', re.IGNORECASE)
+# 型番の区切りとして扱う記号 (Amazonの商品名と比べるとき)
+_MODEL_SEPARATOR_PATTERN = re.compile(r'[\s\-_/()\[\]【】、,:：|+]+')
+
+# --- カテゴリ別のキーの作り方 ---
+# 'first_token':        最初の単語 (=型番) を使う。数字を含まない単語 (シリーズ名など) で始まる場合は
+#                       数字を含む単語まで (最大3語) をつなげる ("MX Master 3S" など)
+# 'keep_parenthetical': 丸括弧だけを外し、中のスペック情報 (DDR4など) は残す
+# 'full_name':          販売形態の表記 (BOX/バルク) を除いた製品名全体を使う
+FIRST_TOKEN = 'first_token'
+KEEP_PARENTHETICAL = 'keep_parenthetical'
+FULL_NAME = 'full_name'
+
+_MAX_MODEL_TOKENS = 3
+
+CATEGORY_KEY_STRATEGIES = {
+    'マザーボード': KEEP_PARENTHETICAL,
+    # CPUは "Core i7 14700K BOX" のように最初の単語がシリーズ名になる
+    'CPU': FULL_NAME,
+}
+
+
+def fold_width(text: str) -> str:
+    """全角英数字・全角スペースなどを半角にそろえる (NFKC)"""
+    return unicodedata.normalize('NFKC', text)
+
+
+def base_name(name: str) -> str:
+    """製品名からメーカー名表記を除き、全角・半角と空白をそろえる"""
+    folded = fold_width(name)
+    stripped = _SPACES_PATTERN.sub(' ', _BRACKETED_PATTERN.sub('', folded)).strip()
+    if stripped:
+        return stripped
+    # 製品名がメーカー名表記だけの場合は、括弧だけを外して使う
+    return _SPACES_PATTERN.sub(' ', _BRACKET_CHARS_PATTERN.sub(' ', folded)).strip()
+
+
+def _apply_strategy(name: str, strategy: str) -> str:
+    if strategy == KEEP_PARENTHETICAL:
+        return _SPACES_PATTERN.sub(' ', _PARENS_PATTERN.sub('', name)).strip()
+    if strategy == FULL_NAME:
+        without_notes = _SPACES_PATTERN.sub(' ', _PARENTHETICAL_PATTERN.sub('', name)).strip() or name
+        return _PACKAGING_SUFFIX_PATTERN.sub('', without_notes) or without_notes
+    tokens = name.split(' ', _MAX_MODEL_TOKENS)[:_MAX_MODEL_TOKENS]
+    for i, token in enumerate(tokens):
+        if _DIGIT_PATTERN.search(token):
+            return ' '.join(tokens[:i + 1])
+    return tokens[0]
+
+
+@functools.lru_cache(maxsize=65536)
+def search_keyword(name: str, category_name: str = None) -> str:
+    """製品名からAmazonで検索するキーワード (型番) を作る"""
+    strategy = CATEGORY_KEY_STRATEGIES.get(category_name, FIRST_TOKEN)
+    return _apply_strategy(base_name(name), strategy)
+
+
+def normalize_key(keyword: str) -> str:
+    """検索キーワードを比較用のキーにする (全角・半角、大文字・小文字、空白の違いを無視)"""
+    return _SPACES_PATTERN.sub(' ', fold_width(keyword)).strip().upper()
+
+
+@functools.lru_cache(maxsize=65536)
+def product_key(name: str, category_name: str = None) -> str:
+    """
+    製品を識別するキー。重複排除、Amazon検索キャッシュ、価格履歴で共通に使う。
+    同じ製品の表記ゆれ (全角・半角、大文字・小文字) は同じキーになる。
+    """
+    return normalize_key(search_keyword(name, category_name))
+
+
+@functools.lru_cache(maxsize=65536)
+def model_token_list(text: str) -> tuple:
+    """型番・商品名を区切り記号で分けた語の並び ("".join() すると compact() と同じ文字列になる)"""
+    return tuple(token for token in _MODEL_SEPARATOR_PATTERN.split(normalize_key(text)) if token)
+
+
+@functools.lru_cache(maxsize=65536)
+def model_tokens(text: str) -> frozenset:
+    """型番・商品名を区切り記号で分けた語の集合 (Amazonの検索結果との照合に使う)"""
+    return frozenset(model_token_list(text))
+
+
+def compact(text: str) -> str:
+    """区切り記号を除いた比較用の文字列 ("B760M-HDV/M.2 D4" → "B760MHDVM.2D4")"""
+    return _MODEL_SEPARATOR_PATTERN.sub('', normalize_key(text))
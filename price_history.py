@@ -0,0 +1,173 @@
+# 価格履歴データベース
+#
+# 価格.com・Amazonで観測したすべての価格を時系列で SQLite に保存する。
+# 検索のたびに捨てていたデータを残し、価格変動の追跡や
+# 「前回から変化した商品だけAmazonを再確認する」差分検索に使う。
+import logging
+import sqlite3
+import threading
+import time
+
+import config
+
+# 観測元
+KAKAKU = 'kakaku'
+AMAZON = 'amazon'
+
+
+class PriceHistory:
+    """価格の観測値 (商品キー, 観測元, 価格, URL, 観測日時) を保存するデータベース"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS price_observations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_key TEXT NOT NULL,
+                source TEXT NOT NULL,
+                category TEXT,
+                name TEXT,
+                price INTEGER,
+                url TEXT,
+                observed_at REAL NOT NULL
+            )
+        """)
+        # 「商品ごとの最新価格」と「商品の価格履歴」のどちらもこの索引で引ける
+        self._conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_price_observations_product
+            ON price_observations (product_key, source, observed_at DESC)
+        """)
+        self._conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_price_observations_category
+            ON price_observations (category, source, observed_at DESC)
+        """)
+        self._conn.commit()
+
+    def record_batch(self, observations: list):
+        """観測値のリストを1トランザクションでまとめて書き込む"""
+        if not observations:
+            return
+        rows = [
+            (o['product_key'], o['source'], o.get('category'), o.get('name'), o.get('price'), o.get('url'),
+             o.get('observed_at') or time.time())
+            for o in observations
+        ]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO price_observations (product_key, source, category, name, price, url, observed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+                )
+
+    @staticmethod
+    def _row_to_dict(row) -> dict:
+        product_key, source, category, name, price, url, observed_at = row
+        return {'product_key': product_key, 'source': source, 'category': category, 'name': name,
+                'price': price, 'url': url, 'observed_at': observed_at}
+
+    def latest(self, product_key: str, source: str):
+        """商品の最新の観測値を返す (無ければ None)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT product_key, source, category, name, price, url, observed_at FROM price_observations "
+                "WHERE product_key = ? AND source = ? ORDER BY observed_at DESC LIMIT 1",
+                (product_key, source)
+            ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def latest_many(self, product_keys, source: str) -> dict:
+        """複数商品の最新の観測値を {商品キー: 観測値} で返す"""
+        return {key: obs for key in set(product_keys) if (obs := self.latest(key, source)) is not None}
+
+    def price_ratios(self, category: str, source: str, limit: int = 1000) -> list:
+        """
+        カテゴリの商品ごとに、最新の source の価格 ÷ 最新の価格.comの価格 を返す (新しく観測した商品から limit 件)。
+        販売先の価格がどの程度になりそうかの目安 (事前分布) に使う。
+        """
+        # 集約関数 MAX() と同じ SELECT の列は、SQLite では最大値を持つ行の値になる
+        query = """
+            SELECT sold.price * 1.0 / listed.price FROM
+                (SELECT product_key, price, MAX(observed_at) AS observed_at FROM price_observations
+                 WHERE category = ? AND source = ? GROUP BY product_key) AS sold
+            JOIN
+                (SELECT product_key, price, MAX(observed_at) FROM price_observations
+                 WHERE category = ? AND source = ? GROUP BY product_key) AS listed
+            USING (product_key)
+            WHERE sold.price > 0 AND listed.price > 0
+            ORDER BY sold.observed_at DESC LIMIT ?
+        """
+        with self._lock:
+            rows = self._conn.execute(query, (category, source, category, KAKAKU, limit)).fetchall()
+        return [ratio for ratio, in rows]
+
+    def history(self, product_key: str, source: str = None, limit: int = 100) -> list:
+        """商品の価格履歴を新しい順に返す"""
+        query = ("SELECT product_key, source, category, name, price, url, observed_at FROM price_observations "
+                 "WHERE product_key = ?")
+        params = [product_key]
+        if source:
+            query += " AND source = ?"
+            params.append(source)
+        query += " ORDER BY observed_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+
+class PriceRecorder:
+    """
+    1回の検索中の観測値を溜めておき、一定件数ごとにまとめて書き込む。
+    複数メーカーのスレッドから同時に add() されてもよい。
+    """
+
+    def __init__(self, history: PriceHistory, batch_size: int):
+        self._history = history
+        self._batch_size = batch_size
+        self._lock = threading.Lock()
+        self._buffer = []
+        self.recorded = 0
+
+    def add(self, product_key: str, source: str, price, url: str = None, category: str = None, name: str = None):
+        with self._lock:
+            self._buffer.append({
+                'product_key': product_key, 'source': source, 'category': category, 'name': name,
+                'price': price, 'url': url, 'observed_at': time.time(),
+            })
+            if len(self._buffer) < self._batch_size:
+                return
+            batch, self._buffer = self._buffer, []
+        self._write(batch)
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        self._write(batch)
+
+    def _write(self, batch: list):
+        try:
+            self._history.record_batch(batch)
+            with self._lock:
+                self.recorded += len(batch)
+        except sqlite3.Error as e:
+            logging.getLogger(__name__).error(f"価格履歴の書き込みに失敗しました: {e}")
+
+
+# --- プロセス全体で共有するデータベース ---
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history() -> PriceHistory:
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = PriceHistory(config.PRICE_HISTORY_FILE)
+        return _history
+
+
+def new_recorder() -> PriceRecorder:
+    """検索1回分の書き込みバッファを作る"""
+    return PriceRecorder(get_history(), config.PRICE_HISTORY_BATCH_SIZE)
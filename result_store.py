@@ -0,0 +1,203 @@
+# 検索結果のサーバー側保存
+#
+# 検索結果をFlaskのセッション (署名付きCookie) に入れると、件数が多い場合に
+# Cookieの上限 (約4KB) を超えてしまう。結果はここに保存し、セッションには結果IDだけを持たせる。
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import config
+
+# 並べ替えに使える項目
+SORT_KEYS = ('profit_margin', 'price_difference', 'price', 'sell_price', 'amazon_price', 'name')
+
+
+class ResultSet:
+    """1回の検索結果と、その検索条件"""
+
+    def __init__(self, result_id: str, items: list, meta: dict, created_at: float):
+        self.id = result_id
+        self.items = items
+        self.meta = meta
+        self.created_at = created_at
+
+    def to_json(self) -> dict:
+        return {'id': self.id, 'items': self.items, 'meta': self.meta, 'created_at': self.created_at}
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls(data['id'], data['items'], data.get('meta', {}), data['created_at'])
+
+
+class ResultStore:
+    """
+    検索結果の保存先。
+    - 直近 max_entries 件はメモリ上に保持 (LRU)
+    - spill_dir を指定すると、メモリから追い出した結果をJSONファイルに退避する
+    - 保存から ttl 秒経過した結果は削除する
+    - write_through が真なら保存と同時にファイルにも書き出す (本番構成でワーカーのプロセスが保存した結果を
+      Webのプロセスから読むため。spill_dir を全プロセスで共有する)
+    """
+
+    def __init__(self, max_entries: int, ttl: float, spill_dir: str = None, write_through: bool = False):
+        if write_through and not spill_dir:
+            raise ValueError("write_through には spill_dir の指定が必要です。")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.write_through = write_through
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _spill_path(self, result_id: str) -> str:
+        return os.path.join(self.spill_dir, f"{result_id}.json")
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return now - created_at > self.ttl
+
+    def put(self, items: list, meta: dict = None) -> str:
+        """結果を保存し、結果IDを返す"""
+        result_set = ResultSet(uuid.uuid4().hex, list(items), dict(meta or {}), time.time())
+        if self.write_through:
+            # 書き出せなければ他のプロセスから読めないため、保存の失敗とする
+            self._write(result_set)
+        with self._lock:
+            self._entries[result_set.id] = result_set
+            overflow = []
+            while len(self._entries) > self.max_entries:
+                overflow.append(self._entries.popitem(last=False)[1])
+        for evicted in overflow:
+            self._spill(evicted)
+        self._purge_spilled()
+        return result_set.id
+
+    def _write(self, result_set: ResultSet):
+        # 読み手が書きかけのファイルを開かないよう、一時ファイルに書いてから置き換える
+        path = self._spill_path(result_set.id)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(result_set.to_json(), f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def _spill(self, result_set: ResultSet):
+        if not self.spill_dir or self.write_through:
+            return
+        try:
+            self._write(result_set)
+        except OSError as e:
+            logging.getLogger(__name__).warning(f"検索結果のファイル退避に失敗しました: {e}")
+
+    def get(self, result_id: str):
+        """結果IDから ResultSet を返す。存在しない・期限切れの場合は None。"""
+        if not result_id or not result_id.isalnum():
+            return None
+        now = time.time()
+        with self._lock:
+            result_set = self._entries.get(result_id)
+            if result_set is not None:
+                if self._expired(result_set.created_at, now):
+                    del self._entries[result_id]
+                    return None
+                self._entries.move_to_end(result_id)
+                return result_set
+
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(result_id)
+        try:
+            with open(path, encoding='utf-8') as f:
+                result_set = ResultSet.from_json(json.load(f))
+        except (OSError, ValueError):
+            return None
+        if self._expired(result_set.created_at, now):
+            self._remove_file(path)
+            return None
+        return result_set
+
+    def query(self, result_id: str, page: int = 1, per_page: int = None, sort: str = 'profit_margin',
+              order: str = 'desc', keyword: str = None, min_margin: float = None):
+        """
+        保存済みの結果を絞り込み・並べ替えし、指定ページ分だけを返す。
+        結果IDが見つからなければ None。
+        """
+        result_set = self.get(result_id)
+        if result_set is None:
+            return None
+
+        items = result_set.items
+        if keyword:
+            lowered = keyword.lower()
+            items = [item for item in items if lowered in item.get('name', '').lower()]
+        if min_margin is not None:
+            items = [item for item in items if (item.get('profit_margin') or 0) >= min_margin]
+
+        if sort not in SORT_KEYS:
+            sort = 'profit_margin'
+        reverse = order != 'asc'
+        # 値が無い項目は並び順に関わらず末尾に置く
+        present = [item for item in items if item.get(sort) is not None]
+        missing = [item for item in items if item.get(sort) is None]
+        items = sorted(present, key=lambda item: item[sort], reverse=reverse) + missing
+
+        per_page = per_page or config.RESULT_PAGE_SIZE
+        total = len(items)
+        pages = max(1, -(-total // per_page))
+        page = min(max(1, page), pages)
+        start = (page - 1) * per_page
+        return {
+            'result_id': result_set.id,
+            'meta': result_set.meta,
+            'items': items[start:start + per_page],
+            'total': total,
+            'page': page,
+            'pages': pages,
+            'per_page': per_page,
+            'sort': sort,
+            'order': 'desc' if reverse else 'asc',
+        }
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _purge_spilled(self):
+        """期限切れの退避ファイルを削除する"""
+        if not self.spill_dir:
+            return
+        threshold = time.time() - self.ttl
+        try:
+            names = os.listdir(self.spill_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.spill_dir, name)
+            try:
+                if name.endswith('.json') and os.path.getmtime(path) < threshold:
+                    self._remove_file(path)
+            except OSError:
+                continue
+
+
+# --- プロセス全体で共有する保存先 ---
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ResultStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultStore(
+                config.RESULT_STORE_MAX_ENTRIES, config.RESULT_STORE_TTL, config.RESULT_STORE_SPILL_DIR,
+                write_through=config.RESULT_STORE_WRITE_THROUGH,
+            )
+        return _store
@@ -0,0 +1,235 @@
+# サイト別のクロールスケジューラ
+#
+# 価格.comの一覧取得やAmazonの検索は、検索リクエストごとのスレッドプールではなく
+# プロセス全体で共有するサイト別キューに投入する。キューごとに
+# トークンバケットによる速度制限・同時実行数の上限・エラー時のバックオフを持つため、
+# 複数の検索が同時に走ってもサイトへの負荷は設定値を超えない。
+import concurrent.futures
+import contextvars
+import itertools
+import logging
+import math
+import queue
+import threading
+import time
+
+import config
+import metrics
+from scrapers import BlockedError
+
+# タスクの優先度 (小さいほど先に実行する。同じ優先度なら投入順)
+PRIORITY_NORMAL = 0
+PRIORITY_URGENT = -math.inf   # ヘッジした再試行など、順番待ちの先頭に割り込ませるタスク
+
+class TokenBucket:
+    """rate 個/秒で補充され、最大 capacity 個まで貯まるトークンバケット"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得する。足りなければ補充されるまで待つ。"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class _Task:
+    def __init__(self, fn, args, kwargs, priority):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = concurrent.futures.Future()
+        self.attempts = 0
+        # 投入した検索の計測の文脈 (metrics.SearchTimings) をワーカースレッドに引き継ぐ
+        self.context = contextvars.copy_context()
+        self.submitted_at = time.perf_counter()
+
+
+class SiteQueue:
+    """
+    1サイト分のタスクキュー。
+    - concurrency 個のワーカースレッドで、優先度の高い (値の小さい) 順・投入順に実行する
+    - タスク開始ごとにトークンバケットからトークンを取得する
+    - 失敗するとキュー全体を一時停止し、連続失敗ごとに待ち時間を倍にする
+    - BlockedError (キャプチャ等) の場合はタスクをキューに戻して再試行する
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, concurrency: int):
+        self.name = name
+        self.concurrency = concurrency
+        self._bucket = TokenBucket(rate, burst)
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._failures = 0
+        self._paused_until = 0.0
+        self._active = 0
+        self._stats = {'completed': 0, 'failed': 0, 'blocked': 0, 'retried': 0}
+
+    def submit(self, fn, *args, **kwargs) -> concurrent.futures.Future:
+        return self.submit_with_priority(PRIORITY_NORMAL, fn, *args, **kwargs)
+
+    def submit_with_priority(self, priority: float, fn, *args, **kwargs) -> concurrent.futures.Future:
+        task = _Task(fn, args, kwargs, priority)
+        self._put(task)
+        self._ensure_workers()
+        return task.future
+
+    def _put(self, task):
+        # 同じ優先度のタスクは投入順に取り出す (タスク同士は比較しない)
+        priority = math.inf if task is None else task.priority
+        self._queue.put((priority, next(self._sequence), task))
+
+    def _ensure_workers(self):
+        with self._lock:
+            while len(self._workers) < self.concurrency:
+                worker = threading.Thread(
+                    target=self._work, name=f"{self.name}-worker-{len(self._workers) + 1}", daemon=True
+                )
+                self._workers.append(worker)
+                worker.start()
+
+    def _wait_while_paused(self):
+        while True:
+            with self._lock:
+                remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def _backoff(self, blocked: bool):
+        """連続失敗回数に応じてキューを一時停止する"""
+        with self._lock:
+            self._failures += 1
+            delay = config.SCHEDULER_BACKOFF_BASE * (2 ** (self._failures - 1))
+            if blocked:
+                delay *= config.SCHEDULER_BLOCKED_BACKOFF_FACTOR
+            delay = min(delay, config.SCHEDULER_BACKOFF_MAX)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        logging.getLogger(__name__).warning(f"[{self.name}] {'アクセス制限を検知' if blocked else 'エラー発生'}。{delay:.0f}秒間待機します。")
+
+    def _work(self):
+        log = logging.getLogger(__name__)
+        while True:
+            _, _, task = self._queue.get()
+            if task is None:
+                return
+            # 再試行で戻ってきたタスクは既に実行中扱いになっている
+            if task.attempts == 0 and not task.future.set_running_or_notify_cancel():
+                continue
+
+            self._wait_while_paused()
+            self._bucket.acquire()
+            if task.attempts == 0:
+                task.context.run(metrics.observe_stage, 'queue_wait', self.name, time.perf_counter() - task.submitted_at)
+            task.attempts += 1
+            with self._lock:
+                self._active += 1
+            try:
+                result = task.context.run(task.fn, *task.args, **task.kwargs)
+            except BlockedError as e:
+                self._backoff(blocked=True)
+                metrics.BLOCKED.inc(site=self.name)
+                with self._lock:
+                    self._stats['blocked'] += 1
+                if task.attempts <= config.SCHEDULER_BLOCKED_RETRIES:
+                    # Future は実行中のまま、同じ優先度のタスクの末尾に戻して再試行する
+                    metrics.RETRIES.inc(site=self.name)
+                    with self._lock:
+                        self._stats['retried'] += 1
+                    self._put(task)
+                else:
+                    metrics.FAILURES.inc(site=self.name)
+                    task.future.set_exception(e)
+            except Exception as e:
+                self._backoff(blocked=False)
+                metrics.FAILURES.inc(site=self.name)
+                with self._lock:
+                    self._stats['failed'] += 1
+                log.debug(f"[{self.name}] タスクが失敗しました: {e}")
+                task.future.set_exception(e)
+            else:
+                with self._lock:
+                    self._failures = 0
+                    self._stats['completed'] += 1
+                task.future.set_result(result)
+            finally:
+                with self._lock:
+                    self._active -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queued'] = self._queue.qsize()
+            stats['active'] = self._active
+            stats['paused_for'] = max(0.0, self._paused_until - time.monotonic())
+        return stats
+
+    def shutdown(self):
+        for _ in self._workers:
+            self._put(None)
+
+
+class CrawlScheduler:
+    """サイト名ごとの SiteQueue をまとめたもの"""
+
+    def __init__(self, site_settings: dict):
+        self._sites = {
+            name: SiteQueue(name, settings['rate'], settings['burst'], settings['concurrency'])
+            for name, settings in site_settings.items()
+        }
+
+    def _collect(self, key: str) -> dict:
+        return {(name,): stats[key] for name, stats in self.stats().items()}
+
+    def submit(self, site: str, fn, *args, **kwargs) -> concurrent.futures.Future:
+        """site のキューにタスクを投入し、結果の Future を返す"""
+        return self._sites[site].submit(fn, *args, **kwargs)
+
+    def submit_with_priority(self, site: str, priority: float, fn, *args, **kwargs) -> concurrent.futures.Future:
+        """優先度を指定して site のキューにタスクを投入する (値が小さいほど先に実行される)"""
+        return self._sites[site].submit_with_priority(priority, fn, *args, **kwargs)
+
+    def stats(self) -> dict:
+        return {name: site.stats() for name, site in self._sites.items()}
+
+    def log_stats(self):
+        log = logging.getLogger(__name__)
+        for name, s in self.stats().items():
+            log.info(
+                f"スケジューラ[{name}]: 完了{s['completed']}件, 失敗{s['failed']}件, "
+                f"制限検知{s['blocked']}回 (再試行{s['retried']}回), 待機中{s['queued']}件"
+            )
+
+    def shutdown(self):
+        for site in self._sites.values():
+            site.shutdown()
+
+
+# --- プロセス全体で共有するスケジューラ ---
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> CrawlScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = CrawlScheduler(config.SCHEDULER_SITES)
+            metrics.QUEUED_TASKS.set_function(lambda: _scheduler._collect('queued'))
+            metrics.ACTIVE_TASKS.set_function(lambda: _scheduler._collect('active'))
+        return _scheduler
@@ -1 +1,9 @@
 # scrapers package
+
+
+class BlockedError(Exception):
+    """アクセス制限 (キャプチャ画面・429など) を検知した場合の例外"""
+
+
+class ScrapeError(Exception):
+    """再試行しても取得できなかった場合の例外 (「結果が無かった」とは区別し、キャッシュしない)"""
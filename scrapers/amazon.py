@@ -1,72 +1,288 @@
-import time
+import re
 import urllib.parse
 import logging
-import selenium.webdriver as webdriver
-from selenium.webdriver.chrome.options import Options
+import config
+import metrics
+import normalize
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from bs4 import BeautifulSoup
 
-def scrape_product(product_name: str):
+from scrapers import driver_pool, extract, page_profile, BlockedError, ScrapeError
+
+RESULT_SELECTOR = 'div[data-component-type="s-search-result"]'
+# 検索結果ページの本体 (結果が0件のページにもある)。これが現れたら結果の有無を判断できる
+SEARCH_READY_SELECTOR = f'{RESULT_SELECTOR}, div.s-main-slot'
+PRODUCT_TITLE_SELECTOR = '#productTitle'
+# アクセスが多すぎるとAmazonはキャプチャ入力画面を返す
+CAPTCHA_SELECTOR = 'form[action*="validateCaptcha"]'
+# ブラウザ側で先頭の検索結果カードだけをHTMLとして取り出す (ページ全体の page_source を転送しない)
+_RESULT_CARDS_SCRIPT = (
+    "return Array.from(document.querySelectorAll(arguments[0])).slice(0, arguments[1])"
+    ".map(e => e.outerHTML).join('') || null;"
+)
+# 商品ページの商品名・価格がある中央の列
+_PRODUCT_COLUMN_SCRIPT = "const e = document.querySelector('#centerCol'); return e ? e.outerHTML : null;"
+
+_DIGITS_PATTERN = re.compile(r'\d+')
+# 検索結果ページの取得を試みる回数
+_SEARCH_ATTEMPTS = 2
+
+def search_url(product_name: str) -> str:
+    """Amazonの検索結果ページのURL"""
+    return urllib.parse.urljoin(config.AMAZON_BASE_URL, f"s?k={urllib.parse.quote(product_name)}")
+
+def product_url(asin: str) -> str:
+    """Amazonの商品ページのURL"""
+    return urllib.parse.urljoin(config.AMAZON_BASE_URL, f"dp/{asin}")
+
+def _parse_price(price_text):
+    digits = ''.join(_DIGITS_PATTERN.findall(price_text or ''))
+    return int(digits) if digits else None
+
+def _result_cards_from_soup(html_content):
+    """BeautifulSoupでページ全体をパースする従来の処理 (extract で読めないページの代替)"""
+    soup = BeautifulSoup(html_content, 'lxml')
+
+    cards = []
+    for card in soup.select(RESULT_SELECTOR)[:config.AMAZON_MAX_CANDIDATES]:
+        title_element = card.select_one("h2")
+        price_element = card.select_one(".a-price-whole")
+        # a-link-normal s-underline-text s-underline-link-text s-link-style a-text-normal
+        url_element = card.select_one("a.a-link-normal.s-underline-text")
+        sponsored = 'AdHolder' in (card.get('class') or []) or card.select_one('a[href*="/sspa/"]') is not None
+        cards.append((
+            card.get('data-asin') or None,
+            title_element.get_text(' ', strip=True) if title_element else '',
+            price_element.get_text(strip=True) if price_element else None,
+            url_element.get('href') if url_element else None,
+            sponsored,
+        ))
+    return cards
+
+def _extract_result_cards(html_content):
+    """先頭の検索結果カードを (ASIN, 商品名, 価格表記, URL, スポンサー枠か) のリストで返す"""
+    if config.HTML_EXTRACTOR == 'lxml':
+        try:
+            return extract.amazon_result_cards(html_content, config.AMAZON_MAX_CANDIDATES)
+        except extract.ExtractionError as e:
+            logging.getLogger(__name__).debug(f"検索結果の高速抽出に失敗したため BeautifulSoup で読み直します: {e}")
+    return _result_cards_from_soup(html_content)
+
+# _model_match の結果
+_EXACT = 'exact'      # 型番が語の区切りに沿ってそのまま含まれる
+_VARIANT = 'variant'  # 型番は含まれるが、直後に派生モデルの語が続く
+
+def _is_variant_word(token: str) -> bool:
+    # 英字1文字 (色・サイズの表記など) は派生モデルとみなさない。必要な語は設定のリストに挙げる
+    return token in config.AMAZON_MODEL_VARIANT_WORDS
+
+def _model_match(product_name: str, title: str):
+    """
+    区切り記号を除いた型番が、商品名の語の区切りに沿って (語の途中から・途中まででなく) 含まれるか。
+    "A7" は "A7S III" に、"RX 7600" は "RX 7600 XT" (派生モデル) に一致しない。
+    """
+    wanted = normalize.compact(product_name)
+    tokens = normalize.model_token_list(title)
+    if not wanted or not tokens:
+        return None
+    # 語の開始位置 → 語の番号
+    starts, position = {}, 0
+    for index, token in enumerate(tokens):
+        starts[position] = index
+        position += len(token)
+    joined = ''.join(tokens)
+
+    found = None
+    begin = joined.find(wanted)
+    while begin != -1:
+        end = begin + len(wanted)
+        if begin in starts and (end in starts or end == len(joined)):
+            following = tokens[starts[end]] if end in starts else None
+            if following is None or not _is_variant_word(following):
+                return _EXACT
+            found = _VARIANT
+        begin = joined.find(wanted, begin + 1)
+    return found
+
+def _score_candidate(product_name: str, title: str, sponsored: bool) -> float:
+    """
+    検索結果の商品名が型番とどれだけ一致するか。
+    型番の語がいくつ商品名に含まれるか (0〜1) に、区切り記号を除いた型番が語の区切りに沿って
+    そのまま含まれていれば 1 を足す。派生モデル (型番の直後に XT・Ti などが続く)、スポンサー枠、
+    型番に無い付属品の語を含む商品は減点する。
+    """
+    wanted = normalize.model_tokens(product_name)
+    if not wanted:
+        return 0.0
+    score = len(wanted & normalize.model_tokens(title)) / len(wanted)
+    match = _model_match(product_name, title)
+    if match == _EXACT:
+        score += 1.0
+    elif match == _VARIANT:
+        score -= config.AMAZON_MODEL_VARIANT_PENALTY
+    if sponsored:
+        score -= config.AMAZON_SPONSORED_PENALTY
+    title_key = normalize.normalize_key(title)
+    product_key = normalize.normalize_key(product_name)
+    if any(word in title_key and word not in product_key for word in config.AMAZON_ACCESSORY_WORDS):
+        score -= config.AMAZON_ACCESSORY_PENALTY
+    return score
+
+def _parse_search_results(html_content, product_name: str):
+    """
+    検索結果ページの各カードを型番と照合し、最も一致する商品を選ぶ。
+    戻り値は (検索結果があったか, {"price", "url", "asin", "title", "score"} または None)。
+    一致度が AMAZON_MATCH_MIN_SCORE に届く商品が無い場合も None を返す。
     """
-    Amazon.co.jpで指定された製品名で検索し、最初の検索結果の価格とURLを取得する
+    with metrics.timed('parse', 'amazon'):
+        cards = _extract_result_cards(html_content)
+    if not cards:
+        return False, None
+
+    best = None
+    for asin, title, price_text, href, sponsored in cards:
+        price = _parse_price(price_text)
+        if price is None or not href:
+            continue
+        score = _score_candidate(product_name, title, sponsored)
+        # 同点なら検索結果の上位を優先する
+        if best is None or score > best[0]:
+            best = (score, asin, title, price, href)
+
+    if best is None or best[0] < config.AMAZON_MATCH_MIN_SCORE:
+        return True, None
+
+    score, asin, title, price, href = best
+    url = urllib.parse.urljoin(config.AMAZON_BASE_URL, href)
+    # URLからフラグメント（#以降）を削除
+    url = url.split('#')[0]
+    return True, {"price": price, "url": url, "asin": asin, "title": title, "score": score}
+
+def _product_page_from_soup(html_content):
+    """BeautifulSoupで商品ページを読む (extract で読めないページの代替)"""
+    soup = BeautifulSoup(html_content, 'lxml')
+    title_element = soup.select_one(PRODUCT_TITLE_SELECTOR)
+    if not title_element:
+        return None
+    price_element = soup.select_one(
+        "#corePrice_feature_div .a-price-whole, #corePriceDisplay_desktop_feature_div .a-price-whole"
+    )
+    return title_element.get_text(' ', strip=True), (price_element.get_text(strip=True) if price_element else None)
+
+def _extract_product_page(html_content):
+    """商品ページの (商品名, 価格表記) を返す。商品ページでなければ None。"""
+    if config.HTML_EXTRACTOR == 'lxml':
+        try:
+            return extract.amazon_product_page(html_content)
+        except extract.ExtractionError as e:
+            logging.getLogger(__name__).debug(f"商品ページの高速抽出に失敗したため BeautifulSoup で読み直します: {e}")
+    return _product_page_from_soup(html_content)
+
+def _parse_product_page(html_content, asin: str):
+    """商品ページから {"price", "url", "asin", "title"} を取り出す。価格が無い (在庫切れなど) 場合は None。"""
+    with metrics.timed('parse', 'amazon'):
+        page = _extract_product_page(html_content)
+    if page is None:
+        return None
+    title, price_text = page
+    price = _parse_price(price_text)
+    if price is None:
+        return None
+    return {"price": price, "url": product_url(asin), "asin": asin, "title": title}
+
+def _load_page(url: str, ready_selector: str, script: str, *script_args):
+    """ドライバーでページを開き、ready_selector の要素が現れたら script で必要な部分のHTMLを取り出す"""
+    if config.SCRAPER_ENGINE == 'playwright':
+        from scrapers import playwright_engine
+        return playwright_engine.get_engine().run(
+            playwright_engine.load_fragment, 'amazon', url, ready_selector, CAPTCHA_SELECTOR, script, *script_args
+        )
+
+    with driver_pool.get_pool().lease() as lease:
+        driver = lease.driver
+        page_profile.apply_to_driver(driver, 'amazon')
+        with metrics.timed('page_load', 'amazon'):
+            driver.get(url)
+        lease.count_page()
+
+        # 目的の要素 (またはキャプチャ画面) が表示されるまで待機
+        wait = WebDriverWait(driver, 10)
+        with metrics.timed('wait_selector', 'amazon'):
+            wait.until(EC.any_of(
+                EC.presence_of_element_located((By.CSS_SELECTOR, ready_selector)),
+                EC.presence_of_element_located((By.CSS_SELECTOR, CAPTCHA_SELECTOR)),
+            ))
+        if driver.find_elements(By.CSS_SELECTOR, CAPTCHA_SELECTOR):
+            raise BlockedError("Amazonのキャプチャ画面が表示されました。")
+
+        page_profile.record_driver_page(driver, 'amazon')
+        return driver.execute_script(script, *script_args) or driver.page_source
+
+def _refresh_by_asin(product_name: str, asin: str):
+    """前回選んだ商品の商品ページから価格を取り直す。取れなければ None (検索し直す)。"""
+    log = logging.getLogger(__name__)
+    try:
+        html_content = _load_page(product_url(asin), PRODUCT_TITLE_SELECTOR, _PRODUCT_COLUMN_SCRIPT)
+    except BlockedError:
+        raise
+    except Exception as e:
+        log.warning(f"    商品ページ ({asin}) の取得中にエラー: {e}")
+        return None
+    result = _parse_product_page(html_content, asin)
+    if result:
+        log.info(f"    -> Amazon価格 (商品ページ {asin}): ¥{result['price']:,}")
+    else:
+        log.info(f"    商品ページ ({asin}) に価格がありません。検索し直します: {product_name[:30]}")
+    return result
+
+def scrape_product(product_name: str, asin: str = None):
+    """
+    Amazon.co.jpで指定された製品名で検索し、検索結果のうち型番に最も一致する商品の価格とURLを取得する。
+    asin (前回選んだ商品) が分かっている場合は、検索せずにその商品ページから価格を取り直す。
+    キャプチャ画面が表示された場合は BlockedError を送出する (スケジューラが待機して再試行する)。
+    検索結果が無い・型番に一致する商品が無い場合は None を返し、読み込みに失敗し続けた場合は
+    ScrapeError を送出する (失敗を「見つからなかった」としてキャッシュしないため)。
     """
     log = logging.getLogger(__name__)
+    if asin:
+        result = _refresh_by_asin(product_name, asin)
+        if result:
+            return result
+
     log.info(f"  Amazon検索: {product_name[:30]}...")
-    
-    driver = None
-    # 2回までリトライ
-    for attempt in range(2):
+
+    # 読み込みに失敗した場合は2回までリトライ
+    # (検索結果ページの本体が現れるまで待っているため、結果が0件ならそれ以上待っても変わらない)
+    for attempt in range(_SEARCH_ATTEMPTS):
         try:
-            options = webdriver.ChromeOptions()
-            options.add_argument('--headless')
-            options.add_argument('--no-sandbox')
-            options.add_argument('--disable-dev-shm-usage')
-            options.add_argument('--disable-gpu')
-            options.add_argument('--window-size=1920x1080')
-            driver = webdriver.Chrome(options=options)
-            
-            search_url = f"https://www.amazon.co.jp/s?k={urllib.parse.quote(product_name)}"
-            driver.get(search_url)
-            
-            # 検索結果が表示されるまで待機
-            wait = WebDriverWait(driver, 10)
-            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, 'div[data-component-type="s-search-result"]')))
-            
-            html_content = driver.page_source
-            soup = BeautifulSoup(html_content, 'lxml')
-            
-            # 最初の検索結果を取得
-            first_result = soup.select_one('div[data-component-type="s-search-result"]')
-            
-            if not first_result:
-                log.warning(f"    Attempt {attempt + 1}: 検索結果が見つかりませんでした。")
-                time.sleep(3) # 少し待ってリトライ
-                continue
-                
-            price_element = first_result.select_one(".a-price-whole")
-            # a-link-normal s-underline-text s-underline-link-text s-link-style a-text-normal
-            url_element = first_result.select_one("a.a-link-normal.s-underline-text")
-            
-            if price_element and url_element:
-                price = int(price_element.get_text(strip=True).replace(',', ''))
-                url = urllib.parse.urljoin("https://www.amazon.co.jp/", url_element.get('href'))
-                # URLからフラグメント（#以降）を削除
-                url = url.split('#')[0]
-                log.info(f"    -> Amazon価格: ¥{price:,}")
-                return {"price": price, "url": url}
+            html_content = _load_page(
+                search_url(product_name), SEARCH_READY_SELECTOR, _RESULT_CARDS_SCRIPT, RESULT_SELECTOR,
+                config.AMAZON_MAX_CANDIDATES
+            )
+            found, result = _parse_search_results(html_content, product_name)
+
+            if not found:
+                log.info(f"    -> 検索結果がありませんでした: {product_name[:30]}")
+                metrics.EMPTY_RESULTS.inc(site='amazon', category=metrics.current_category())
+                return None
+
+            if result:
+                log.info(f"    -> Amazon価格: ¥{result['price']:,} ({result['asin']}, 一致度 {result['score']:.2f})")
             else:
-                log.warning(f"    Attempt {attempt + 1}: 価格またはURLが見つかりませんでした。")
-                time.sleep(3) # 少し待ってリトライ
-                continue
+                log.info(f"    -> 型番に一致する商品がありませんでした: {product_name[:30]}")
+                metrics.EMPTY_RESULTS.inc(site='amazon', category=metrics.current_category())
+            return result
 
+        except BlockedError:
+            raise
         except Exception as e:
             log.warning(f"    Attempt {attempt + 1}: Amazon検索中にエラー: {e}")
-            time.sleep(3) # エラー発生時も待機
-        finally:
-            if driver:
-                driver.quit()
-                
+            # 待機の上限 (タイムアウト) まで待った後なので、すぐに新しいページで読み込み直す
+            if attempt + 1 < _SEARCH_ATTEMPTS:
+                metrics.RETRIES.inc(site='amazon')
+
     log.error(f"  -> Amazon検索失敗: {product_name[:30]}...")
-    return None
+    # 失敗の回数はスケジューラが数える
+    raise ScrapeError(f"Amazon検索に{_SEARCH_ATTEMPTS}回失敗しました: {product_name[:30]}")
@@ -0,0 +1,308 @@
+# Selenium WebDriver のプール管理
+#
+# Chrome の起動はページ読み込みよりも時間がかかるため、スクレイパーは
+# 毎回 webdriver.Chrome を生成せず、このプールからドライバーを借り受ける。
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import selenium.webdriver as webdriver
+
+import config
+import metrics
+
+
+class PoolTimeoutError(Exception):
+    """規定時間内にドライバーを借り受けられなかった場合の例外"""
+
+
+class _PooledDriver:
+    """プール内の1つの Chrome セッションと、その利用状況"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.leases = 0
+        self.created_at = time.monotonic()
+
+
+class Lease:
+    """借り受け中のドライバー。ページ読み込みごとに count_page() を呼ぶ。"""
+
+    def __init__(self, pooled: _PooledDriver):
+        self._pooled = pooled
+        self.driver = pooled.driver
+        self.discarded = False
+
+    def count_page(self):
+        self._pooled.pages += 1
+
+    def discard(self):
+        """返却時にセッションを破棄し、新しいものに入れ替えさせる"""
+        self.discarded = True
+
+
+class DriverPool:
+    """
+    ヘッドレス Chrome セッションのプール。
+    - 最大 size 個までオンデマンドで起動し、返却されたセッションを再利用する
+    - max_pages ページ読み込んだセッションや、異常終了したセッションは破棄して作り直す
+    - 借り受け時の待ち時間と再利用回数を記録する
+    """
+
+    def __init__(self, size: int, max_pages: int, lease_timeout: float):
+        self.size = size
+        self.max_pages = max_pages
+        self.lease_timeout = lease_timeout
+
+        self._cond = threading.Condition()
+        self._idle = []   # 待機中の _PooledDriver (LIFO)
+        self._total = 0   # 起動済み (待機中 + 貸出中 + 起動中) のセッション数
+        self._closed = False
+
+        self._stats = {
+            'created': 0,
+            'recycled': 0,
+            'crashed': 0,
+            'leases': 0,
+            'reuses': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+        }
+
+    @staticmethod
+    def _build_options():
+        options = webdriver.ChromeOptions()
+        options.add_argument('--headless')
+        options.add_argument('--no-sandbox')
+        options.add_argument('--disable-dev-shm-usage')
+        options.add_argument('--disable-gpu')
+        options.add_argument('--window-size=1920x1080')
+        # DOMの構築が終わった時点で driver.get から戻る (要素は各スクレイパーが個別に待つ)
+        options.page_load_strategy = config.PAGE_LOAD_STRATEGY
+        return options
+
+    def _create(self) -> _PooledDriver:
+        with metrics.timed('driver_start', 'browser'):
+            driver = webdriver.Chrome(options=self._build_options())
+        with self._cond:
+            self._stats['created'] += 1
+        return _PooledDriver(driver)
+
+    @staticmethod
+    def _quit(pooled: _PooledDriver):
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            logging.getLogger(__name__).debug(f"ドライバー終了時にエラー: {e}")
+
+    @staticmethod
+    def _is_healthy(pooled: _PooledDriver) -> bool:
+        """セッションが応答するかを確認する (クラッシュしたChromeは例外になる)"""
+        try:
+            pooled.driver.execute_script("return 1;")
+            return True
+        except Exception:
+            return False
+
+    def warm_up(self, count: int = None):
+        """サーバー起動時などに、あらかじめセッションを起動しておく"""
+        log = logging.getLogger(__name__)
+        count = min(self.size, count if count is not None else self.size)
+        log.info(f"ドライバープールのウォームアップを開始 ({count}セッション)...")
+        started = 0
+        for _ in range(count):
+            with self._cond:
+                if self._closed or self._total >= self.size:
+                    break
+                self._total += 1
+            try:
+                pooled = self._create()
+            except Exception as e:
+                log.error(f"ウォームアップ中にドライバーの起動に失敗しました: {e}")
+                with self._cond:
+                    self._total -= 1
+                    self._cond.notify()
+                break
+            with self._cond:
+                self._idle.append(pooled)
+                self._cond.notify()
+            started += 1
+        log.info(f"ドライバープールのウォームアップが完了。{started}セッションが待機中です。")
+
+    def _acquire(self) -> _PooledDriver:
+        started = time.monotonic()
+        deadline = started + self.lease_timeout
+        create_new = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("ドライバープールは既にシャットダウンされています。")
+                if self._idle:
+                    pooled = self._idle.pop()
+                    break
+                if self._total < self.size:
+                    self._total += 1
+                    create_new = True
+                    pooled = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(f"{self.lease_timeout}秒以内にドライバーを取得できませんでした。")
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - started
+            self._stats['leases'] += 1
+            self._stats['wait_total'] += waited
+            self._stats['wait_max'] = max(self._stats['wait_max'], waited)
+        metrics.observe_stage('driver_wait', 'browser', waited)
+
+        if create_new:
+            try:
+                pooled = self._create()
+            except Exception:
+                with self._cond:
+                    self._total -= 1
+                    self._cond.notify()
+                raise
+        elif not self._is_healthy(pooled):
+            # 待機中にChromeが落ちていた場合は作り直す
+            with self._cond:
+                self._stats['crashed'] += 1
+            self._quit(pooled)
+            try:
+                pooled = self._create()
+            except Exception:
+                with self._cond:
+                    self._total -= 1
+                    self._cond.notify()
+                raise
+
+        if pooled.leases > 0:
+            with self._cond:
+                self._stats['reuses'] += 1
+        pooled.leases += 1
+        return pooled
+
+    def _release(self, pooled: _PooledDriver, discard: bool):
+        log = logging.getLogger(__name__)
+        if discard:
+            reason = "異常終了"
+            with self._cond:
+                self._stats['crashed'] += 1
+        elif self.max_pages and pooled.pages >= self.max_pages:
+            reason = f"{pooled.pages}ページ使用"
+            with self._cond:
+                self._stats['recycled'] += 1
+        else:
+            reason = None
+
+        if reason is None:
+            with self._cond:
+                if not self._closed:
+                    self._idle.append(pooled)
+                    self._cond.notify()
+                    return
+            # シャットダウン後に返却されたセッションはそのまま終了する
+            reason = "シャットダウン済み"
+
+        log.info(f"ドライバーを破棄します ({reason})。")
+        self._quit(pooled)
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def lease(self):
+        """
+        ドライバーを借り受けるコンテキストマネージャ。
+        ブロック内で例外が発生した場合はセッションの状態を確認し、
+        応答しなければ破棄して次回は新しいセッションを起動する。
+        """
+        pooled = self._acquire()
+        lease = Lease(pooled)
+        try:
+            yield lease
+        except BaseException:
+            if not lease.discarded and not self._is_healthy(pooled):
+                lease.discard()
+            raise
+        finally:
+            self._release(pooled, lease.discarded)
+
+    def shutdown(self):
+        """待機中のセッションをすべて終了し、以後の貸し出しを停止する"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._total -= len(idle)
+            self._cond.notify_all()
+        for pooled in idle:
+            self._quit(pooled)
+        logging.getLogger(__name__).info(f"ドライバープールをシャットダウンしました ({len(idle)}セッションを終了)。")
+
+    def stats(self) -> dict:
+        """プールの利用状況 (借り受け待ち時間・再利用回数など) を返す"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['active'] = self._total - len(self._idle)
+            stats['idle'] = len(self._idle)
+        stats['wait_avg'] = stats['wait_total'] / stats['leases'] if stats['leases'] else 0.0
+        return stats
+
+
+# --- プロセス全体で共有するプール ---
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> DriverPool:
+    """共有ドライバープールを返す (初回呼び出し時に生成)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = DriverPool(
+                size=config.DRIVER_POOL_SIZE,
+                max_pages=config.DRIVER_MAX_PAGES_PER_SESSION,
+                lease_timeout=config.DRIVER_LEASE_TIMEOUT,
+            )
+            atexit.register(shutdown_pool)
+            metrics.DRIVER_SESSIONS.set_function(_collect_sessions)
+        return _pool
+
+
+def shutdown_pool():
+    """共有ドライバープールを終了する"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool:
+        pool.shutdown()
+
+
+def _collect_sessions() -> dict:
+    with _pool_lock:
+        pool = _pool
+    if not pool:
+        return {}
+    s = pool.stats()
+    return {('active',): s['active'], ('idle',): s['idle']}
+
+
+def log_stats():
+    """共有ドライバープールの利用状況をログに出力する"""
+    with _pool_lock:
+        pool = _pool
+    if not pool:
+        return
+    s = pool.stats()
+    logging.getLogger(__name__).info(
+        f"ドライバープール: 貸出{s['leases']}回 (再利用{s['reuses']}回), "
+        f"起動{s['created']}回, 入替{s['recycled']}回, 異常{s['crashed']}回, "
+        f"平均待ち{s['wait_avg']:.2f}秒 (最大{s['wait_max']:.2f}秒)"
+    )
@@ -0,0 +1,194 @@
+# 検索結果ページからの高速な値の取り出し
+#
+# ページ全体 (価格.comで約250KB) から BeautifulSoup の木を作る代わりに、
+# 結果テーブル・結果カードを含む範囲だけを文字列として切り出して lxml でパースし、
+# あらかじめコンパイルした XPath で必要な値だけを小さなタプルで返す。
+# 想定した構造が見つからない場合は ExtractionError を送出し、呼び出し元は
+# 従来の BeautifulSoup による処理 (kakaku._parse_result_page_soup など) に切り替える。
+import re
+
+from lxml import etree, html as lxml_html
+
+
+class ExtractionError(ValueError):
+    """想定したページ構造が見つからなかった (BeautifulSoupでの処理に切り替える)"""
+
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# --- 価格.com スペック検索の結果ページ ---
+# 結果テーブルと件数表示は #spec_result の中、ページ送りはその後ろ、フッタより前にある
+_KAKAKU_START_MARKER = 'id="spec_result"'
+_KAKAKU_END_MARKER = 'id="footer"'
+_KAKAKU_ROWS = etree.XPath(f'//*[@id="spec_result"]//table[{_has_class("tblBorderGray02")}]//tr')
+_KAKAKU_NAME_LINK = etree.XPath(f'.//td[{_has_class("textL")}]//a')
+_KAKAKU_PRICE_LINK = etree.XPath(f'.//span[{_has_class("priceText")}]//a')
+_KAKAKU_NEXT = etree.XPath(
+    f'//a[{_has_class("pagerNext")}] | //div[{_has_class("paging")}]//img[@alt="次へ"][ancestor::a]'
+)
+_KAKAKU_COUNTER = etree.XPath(f'//*[@id="spec_result"]//*[{_has_class("traffic")}]//span[{_has_class("number")}]')
+_KAKAKU_HEADER_CLASSES = {'bgColor02', 'bgColor03'}
+# 結果ページに表示し直される検索フォーム (specForm) と、その後ろのページ送り
+_KAKAKU_FORM_MARKER = 'name="specForm"'
+_KAKAKU_SELECT = etree.XPath('//form[@name="specForm"]//select[@name=$name]')
+_KAKAKU_CURRENT_PAGE = etree.XPath(f'//div[{_has_class("paging")}]/span/strong')
+
+# --- Amazon の検索結果ページ ---
+_AMAZON_CARD_MARKER = 'data-component-type="s-search-result"'
+_AMAZON_END_MARKER = 'id="navFooter"'
+_AMAZON_CARD = etree.XPath('//div[@data-component-type="s-search-result"]')
+_AMAZON_TITLE = etree.XPath('.//h2')
+_AMAZON_PRICE = etree.XPath(f'.//*[{_has_class("a-price-whole")}]')
+_AMAZON_LINK = etree.XPath(f'.//a[{_has_class("a-link-normal")} and {_has_class("s-underline-text")}]')
+# スポンサー枠 (広告) のカードは AdHolder クラスを持つか、リンクが /sspa/ を経由する
+_AMAZON_SPONSORED = etree.XPath(f'self::*[{_has_class("AdHolder")}] | .//a[contains(@href, "/sspa/")]')
+# 商品ページ (/dp/<ASIN>) の商品名と価格は中央の列にある
+_AMAZON_PRODUCT_START_MARKER = 'id="centerCol"'
+_AMAZON_PRODUCT_END_MARKER = 'id="rightCol"'
+_AMAZON_PRODUCT_TITLE = etree.XPath('//*[@id="productTitle"]')
+_AMAZON_PRODUCT_PRICE = etree.XPath(
+    f'//*[@id="corePrice_feature_div" or @id="corePriceDisplay_desktop_feature_div"]//*[{_has_class("a-price-whole")}]'
+)
+
+_TEXT = etree.XPath('.//text()')
+_CHARSET_PATTERN = re.compile(rb'charset=["\']?([A-Za-z0-9_-]+)', re.IGNORECASE)
+# Shift_JIS と宣言されたページにも機種依存文字 (①など) が含まれるため、上位互換の cp932 で読む
+_ENCODING_ALIASES = {'shift_jis': 'cp932', 'shift-jis': 'cp932', 'sjis': 'cp932', 'x-sjis': 'cp932'}
+
+
+def _text(element, separator: str = '') -> str:
+    """BeautifulSoup の get_text(separator, strip=True) と同じ文字列を作る"""
+    return separator.join(part for part in (text.strip() for text in _TEXT(element)) if part)
+
+
+def _decode(content, default_encoding: str) -> str:
+    """HTTPで取得したバイト列はページ先頭の meta charset に従って文字列にする"""
+    if isinstance(content, str):
+        return content
+    match = _CHARSET_PATTERN.search(content, 0, 4096)
+    encoding = match.group(1).decode('ascii').lower() if match else default_encoding
+    return content.decode(_ENCODING_ALIASES.get(encoding, encoding), errors='replace')
+
+
+def _slice(text: str, start_marker: str, end_marker: str = None):
+    """start_marker を含むタグの先頭から end_marker を含むタグの手前までを切り出す。無ければ None。"""
+    position = text.find(start_marker)
+    if position < 0:
+        return None
+    start = text.rfind('<', 0, position)
+    end = text.find(end_marker, position) if end_marker else -1
+    end = text.rfind('<', position, end) if end >= 0 else len(text)
+    return text[max(start, 0):end]
+
+
+def _parse_fragment(fragment: str):
+    try:
+        return lxml_html.document_fromstring(fragment)
+    except (etree.ParserError, ValueError) as e:
+        raise ExtractionError(f"HTMLをパースできませんでした: {e}") from e
+
+
+def kakaku_result_page(content):
+    """
+    価格.comの結果ページ (bytes または str) から値を取り出す。
+    結果テーブルが無いページ (エラー画面など) は None を返す。
+    戻り値は (行のリスト, 次ページの有無, 件数表示の文字列リスト)。
+    行は (製品名, 価格表記, 相対URL) のタプルで、製品名・価格のどちらかが無い行は含まない。
+    """
+    fragment = _slice(_decode(content, 'cp932'), _KAKAKU_START_MARKER, _KAKAKU_END_MARKER)
+    if fragment is None:
+        return None
+    root = _parse_fragment(fragment)
+    row_elements = _KAKAKU_ROWS(root)
+    if not row_elements:
+        raise ExtractionError("#spec_result はあるが結果テーブルが見つかりません")
+
+    rows = []
+    for row in row_elements:
+        if _KAKAKU_HEADER_CLASSES.intersection(row.get('class', '').split()):
+            continue
+        name_links = _KAKAKU_NAME_LINK(row)
+        price_links = _KAKAKU_PRICE_LINK(row)
+        if name_links and price_links:
+            rows.append((_text(name_links[0]), _text(price_links[0]), name_links[0].get('href')))
+    has_next = bool(_KAKAKU_NEXT(root))
+    counter = [_text(element) for element in _KAKAKU_COUNTER(root)]
+    return rows, has_next, counter
+
+
+def kakaku_search_conditions(content):
+    """
+    価格.comの結果ページに表示された検索条件 (specForm の選択状態と、ページ送りの現在のページ) を返す。
+    戻り値は {'LstMaker': 値, 'Sort': 値, 'Page': ページ番号 または None}。
+    select の値は selected の option (無ければ、フォームを送信したときと同じく先頭の option) の値。
+    検索フォームが無いページは ExtractionError を送出する。
+    """
+    fragment = _slice(_decode(content, 'cp932'), _KAKAKU_FORM_MARKER, _KAKAKU_END_MARKER)
+    if fragment is None:
+        raise ExtractionError("検索フォーム (specForm) が見つかりません")
+    root = _parse_fragment(fragment)
+    conditions = {}
+    for name in ('LstMaker', 'Sort'):
+        selects = _KAKAKU_SELECT(root, name=name)
+        if not selects:
+            raise ExtractionError(f"検索フォームに {name} がありません")
+        options = selects[0].findall('.//option')
+        chosen = [option for option in options if option.get('selected') is not None] or options[:1]
+        conditions[name] = chosen[0].get('value', '') if chosen else ''
+    pages = [int(text) for text in (_text(element) for element in _KAKAKU_CURRENT_PAGE(root)) if text.isdigit()]
+    conditions['Page'] = pages[0] if pages else None
+    return conditions
+
+
+def amazon_result_cards(content, max_cards: int):
+    """
+    Amazonの検索結果ページ (または結果カードを並べたHTML) から先頭 max_cards 件のカードを取り出す。
+    戻り値は (ASIN, 商品名, 価格表記 または None, URL または None, スポンサー枠か) のタプルのリスト。
+    検索結果が無いページは空のリスト。
+    """
+    fragment = _slice(_decode(content, 'utf-8'), _AMAZON_CARD_MARKER, _AMAZON_END_MARKER)
+    if fragment is None:
+        return []
+    # max_cards 件目より後のカードはパースしない
+    position = 0
+    for _ in range(max_cards + 1):
+        position = fragment.find(_AMAZON_CARD_MARKER, position)
+        if position < 0:
+            break
+        position += len(_AMAZON_CARD_MARKER)
+    if position >= 0:
+        fragment = fragment[:fragment.rfind('<', 0, position - len(_AMAZON_CARD_MARKER))]
+
+    cards = _AMAZON_CARD(_parse_fragment(fragment))
+    if not cards:
+        raise ExtractionError("検索結果カードの目印はあるが要素が見つかりません")
+    results = []
+    for card in cards[:max_cards]:
+        titles = _AMAZON_TITLE(card)
+        prices = _AMAZON_PRICE(card)
+        links = _AMAZON_LINK(card)
+        results.append((
+            card.get('data-asin') or None,
+            _text(titles[0], ' ') if titles else '',
+            _text(prices[0]) if prices else None,
+            links[0].get('href') if links else None,
+            bool(_AMAZON_SPONSORED(card)),
+        ))
+    return results
+
+
+def amazon_product_page(content):
+    """
+    Amazonの商品ページ (/dp/<ASIN>) から (商品名, 価格表記 または None) を取り出す。
+    商品ページでない場合 (商品名が無い) は None を返す。
+    """
+    text = _decode(content, 'utf-8')
+    fragment = _slice(text, _AMAZON_PRODUCT_START_MARKER, _AMAZON_PRODUCT_END_MARKER) or text
+    root = _parse_fragment(fragment)
+    titles = _AMAZON_PRODUCT_TITLE(root)
+    if not titles:
+        return None
+    prices = _AMAZON_PRODUCT_PRICE(root)
+    return _text(titles[0], ' '), (_text(prices[0]) if prices else None)
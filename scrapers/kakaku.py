@@ -1,25 +1,256 @@
+import asyncio
 import time
+import math
+import re
 import urllib.parse
 import logging
+import threading
+import concurrent.futures
 import requests
-import selenium.webdriver as webdriver
-from selenium.webdriver.chrome.options import Options
+from requests.adapters import HTTPAdapter
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait, Select
 from selenium.webdriver.support import expected_conditions as EC
 from bs4 import BeautifulSoup
 
 import config
-import utils
+import filters
+import metrics
+from scrapers import driver_pool, extract, page_profile, BlockedError, ScrapeError
 
-# --- 除外リストの読み込み ---
-EXCLUDED_MAKERS = utils.load_string_list_from_file(config.EXCLUDED_MAKERS_FILE)
-EXCLUDED_KEYWORDS = utils.load_string_list_from_file(config.EXCLUDED_KEYWORDS_FILE)
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'
+}
+RESULT_TABLE_SELECTOR = "#spec_result table.tblBorderGray02"
+# ブラウザ側で結果部分だけをHTMLとして取り出す (ページ全体の page_source を転送しない)
+_RESULT_FRAGMENT_SCRIPT = "const e = document.querySelector('#spec_result'); return e ? e.outerHTML : null;"
+
+# --- HTTPセッション (コネクションを使い回す) ---
+_session = None
+_session_lock = threading.Lock()
+
+# カテゴリ → {メーカー名: LstMakerの値} (検索URLの組み立てに使う)
+_maker_id_cache = {}
+
+_NUMBER_PATTERN = re.compile(r'\d[\d,]*')
+
+
+class _ConditionMismatch(Exception):
+    """組み立てたURLの検索条件が結果ページに反映されていない (ブラウザでの取得に切り替える)"""
+
+
+class _HostThrottle:
+    """
+    ホストごとの同時接続数とリクエスト間隔を制限する。
+    複数メーカーの検索が並行していても、価格.comへの負荷は設定値を超えない。
+    """
+
+    def __init__(self, max_concurrency: int, interval: float):
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+
+    async def __aenter__(self):
+        # イベントループを止めないよう、待機は別スレッドで行う。
+        # 待っているコルーチンが中止されても別スレッドの待機は止められないため、
+        # 枠が取れた時点で中止済みならそのスレッドが、中止より先に取れていればコルーチンが枠を返す。
+        handoff = {'acquired': False, 'abandoned': False}
+        handoff_lock = threading.Lock()
+
+        def enter():
+            self.__enter__()
+            with handoff_lock:
+                if handoff['abandoned']:
+                    self._semaphore.release()
+                else:
+                    handoff['acquired'] = True
+
+        try:
+            await asyncio.to_thread(enter)
+        except BaseException:
+            # __aexit__ は呼ばれないため、ここで枠を返す (まだ取れていなければスレッドに任せる)
+            with handoff_lock:
+                handoff['abandoned'] = True
+                if handoff['acquired']:
+                    self._semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.__exit__(exc_type, exc, tb)
+
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+
+def _get_throttle(url: str) -> _HostThrottle:
+    host = urllib.parse.urlsplit(url).netloc
+    with _throttles_lock:
+        throttle = _throttles.get(host)
+        if throttle is None:
+            throttle = _HostThrottle(config.KAKAKU_MAX_CONCURRENCY_PER_HOST, config.KAKAKU_REQUEST_INTERVAL)
+            _throttles[host] = throttle
+        return throttle
+
+
+def _get_session() -> requests.Session:
+    """価格.com用の共有 requests.Session を返す"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=config.KAKAKU_HTTP_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update(HTTP_HEADERS)
+            _session = session
+        return _session
+
+
+def _parse_maker_options(soup):
+    """スペック検索ページの LstMaker から (値, メーカー名) のリストを取り出す。見つからなければ None。"""
+    maker_select_element = soup.find("select", {"name": "LstMaker"})
+    if not maker_select_element:
+        return None
+    return [
+        (option.get("value"), option.get_text(strip=True))
+        for option in maker_select_element.find_all("option")
+        if option.get("value")
+    ]
+
+
+def _product_rows_from_soup(soup):
+    """
+    BeautifulSoupの木から (製品名, 価格表記, 相対URL) のタプルを取り出す。
+    結果テーブルが存在しない場合は None を返す。
+    """
+    product_rows = soup.select(f"{RESULT_TABLE_SELECTOR} tr")
+    if not product_rows:
+        return None
+
+    rows = []
+    for row in product_rows:
+        # ヘッダー行などをスキップ
+        if row.get('class') and ('bgColor02' in row.get('class') or 'bgColor03' in row.get('class')):
+            continue
+
+        name_element = row.select_one("td.textL a")
+        price_element = row.select_one("span.priceText a")
+
+        if name_element and price_element:
+            rows.append((
+                name_element.get_text(strip=True), price_element.get_text(strip=True), name_element.get('href')
+            ))
+    return rows
+
+
+def _rows_to_products(rows, row_filter: filters.RowFilter = None):
+    """
+    (製品名, 価格表記, 相対URL) のタプルを絞り込みの規則 (filters) で選別し、製品情報にする。
+    row_filter を省略した場合は、すべてのカテゴリに共通の規則だけで選別する。
+    """
+    if row_filter is None:
+        row_filter = filters.get_engine().row_filter()
+    products = []
+    for name, price_text, relative_url in rows:
+        price_text = price_text.replace('¥', '').replace(',', '')
+        if not (name and price_text.isdigit() and relative_url):
+            continue
+
+        # 絞り込みキーワード・除外キーワード・価格帯のチェック
+        price = int(price_text)
+        if not row_filter.accepts(name, price):
+            continue
+
+        full_url = urllib.parse.urljoin("https://kakaku.com/", relative_url)
+        products.append({"name": name, "price": price, "url": full_url})
+    return products
+
+
+def _parse_product_rows(soup, row_filter: filters.RowFilter = None):
+    """
+    検索結果ページから製品情報を取り出す。
+    結果テーブルが存在しない場合は None を返す。
+    """
+    rows = _product_rows_from_soup(soup)
+    if rows is None:
+        return None
+    return _rows_to_products(rows, row_filter)
+
+
+def _has_next_page(soup) -> bool:
+    """結果ページに「次へ」のリンクがあるか"""
+    if soup.select_one("a.pagerNext"):
+        return True
+    return any(img.find_parent("a") for img in soup.select('div.paging img[alt="次へ"]'))
+
+
+def _total_pages_from_counter(numbers):
+    """「7,981件中 1-30件」の表示 (['7,981', '1-30']) から総ページ数を求める。読み取れなければ None。"""
+    if len(numbers) < 2:
+        return None
+    total = _NUMBER_PATTERN.search(numbers[0])
+    shown = _NUMBER_PATTERN.findall(numbers[1])
+    if not total or len(shown) < 2:
+        return None
+    per_page = int(shown[1].replace(',', '')) - int(shown[0].replace(',', '')) + 1
+    if per_page <= 0:
+        return None
+    return math.ceil(int(total.group().replace(',', '')) / per_page)
+
+
+def _parse_total_pages(soup):
+    """件数表示から総ページ数を求める。読み取れなければ None。"""
+    return _total_pages_from_counter(
+        [element.get_text(strip=True) for element in soup.select("#spec_result .traffic span.number")]
+    )
+
+
+def _parse_result_page_soup(html_content, row_filter: filters.RowFilter = None):
+    """BeautifulSoupでページ全体をパースする従来の処理 (extract で読めないページの代替)"""
+    soup = BeautifulSoup(html_content, 'lxml')
+    return _parse_product_rows(soup, row_filter), _has_next_page(soup), _parse_total_pages(soup)
+
+
+def _parse_result_page(html_content, row_filter: filters.RowFilter = None):
+    """結果ページを1回だけパースし、(製品リスト または None, 次ページの有無, 総ページ数) を返す"""
+    with metrics.timed('parse', 'kakaku'):
+        return _parse_result_page_untimed(html_content, row_filter)
+
+
+def _parse_result_page_untimed(html_content, row_filter: filters.RowFilter = None):
+    if config.HTML_EXTRACTOR == 'lxml':
+        try:
+            page = extract.kakaku_result_page(html_content)
+        except extract.ExtractionError as e:
+            logging.getLogger(__name__).debug(f"結果ページの高速抽出に失敗したため BeautifulSoup で読み直します: {e}")
+        else:
+            if page is None:
+                return None, False, None
+            rows, has_next, counter = page
+            return _rows_to_products(rows, row_filter), has_next, _total_pages_from_counter(counter)
+    return _parse_result_page_soup(html_content, row_filter)
 
 
 def scrape_products(category_name: str, filter_keyword: str = None, limit: int = 0, maker: str = None, sort: str = None):
     """
-    価格.comから指定されたカテゴリの製品情報をスクレイピングする
+    価格.comから指定されたカテゴリの製品情報をスクレイピングする。
+    ブラウザでの取得に失敗した場合は ScrapeError を送出する (該当する製品が無い場合は空のリストを返す)。
     """
     log = logging.getLogger(__name__)
     spec_search_url = config.CATEGORY_URL_MAP.get(category_name)
@@ -28,127 +259,343 @@ def scrape_products(category_name: str, filter_keyword: str = None, limit: int =
         return []
 
     log.info(f"価格.com処理開始: カテゴリ='{category_name}', メーカー='{maker}'")
-    
-    driver = None
+    # 絞り込みの規則はこの取得の間は変えない (途中でファイルが更新されても次の取得から反映する)
+    row_filter = filters.get_engine().row_filter(category_name, filter_keyword)
+
+    if config.KAKAKU_FETCH_MODE == 'http':
+        try:
+            results = _scrape_via_http(log, category_name, spec_search_url, row_filter, limit, maker, sort)
+        except requests.exceptions.RequestException as e:
+            log.warning(f"HTTPでの取得に失敗しました: {e}")
+            results = None
+        except _ConditionMismatch as e:
+            log.warning(f"HTTPで取得した結果ページの検索条件が一致しません: {e}")
+            results = None
+        if results is not None:
+            log.info(f"価格.com処理完了 (HTTP)。{len(results)}件の製品情報を取得しました。")
+            return results
+        log.info("HTTPで結果を取得できなかったため、ブラウザでの取得に切り替えます。")
+        metrics.RETRIES.inc(site='kakaku')
+
     try:
-        options = webdriver.ChromeOptions()
-        options.add_argument('--headless')
-        options.add_argument('--no-sandbox')
-        options.add_argument('--disable-dev-shm-usage')
-        options.add_argument('--disable-gpu')
-        options.add_argument('--window-size=1920x1080')
-        driver = webdriver.Chrome(options=options)
-        wait = WebDriverWait(driver, 20)
-        
+        if config.SCRAPER_ENGINE == 'playwright':
+            from scrapers import playwright_engine
+            return playwright_engine.get_engine().run(
+                _scrape_with_page, log, spec_search_url, row_filter, limit, maker, sort
+            )
+        with driver_pool.get_pool().lease() as lease:
+            return _scrape_with_driver(lease, log, spec_search_url, row_filter, limit, maker, sort)
+    except Exception as e:
+        log.error(f"スクレイピングで致命的なエラーが発生: {e}", exc_info=True)
+        # 「製品が無かった」と区別できるよう例外にする (失敗の回数はスケジューラが数える)
+        raise ScrapeError(f"価格.comの取得に失敗しました (メーカー '{maker}'): {e}") from e
+
+
+def _scrape_with_driver(lease, log, spec_search_url, row_filter, limit, maker, sort):
+    """借り受けたドライバーで検索フォームを操作し、結果ページを順に読み取る"""
+    driver = lease.driver
+    wait = WebDriverWait(driver, 20)
+    page_profile.apply_to_driver(driver, 'kakaku')
+
+    with _get_throttle(spec_search_url), metrics.timed('page_load', 'kakaku'):
         driver.get(spec_search_url)
-        
-        if maker:
-            maker_select = Select(wait.until(EC.element_to_be_clickable((By.NAME, "LstMaker"))))
-            maker_select.select_by_visible_text(maker)
-
-        if sort:
-            sort_select = Select(wait.until(EC.element_to_be_clickable((By.NAME, "Sort"))))
-            sort_select.select_by_value(sort)
-        
-        driver.find_element(By.CSS_SELECTOR, 'input[type="image"][value="検索する"]').click()
-        
-        results = []
-        page_num = 1
-        while len(results) < limit:
-            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "#spec_result table.tblBorderGray02")))
-            html_content = driver.page_source
-            soup = BeautifulSoup(html_content, 'lxml')
-            product_rows = soup.select("#spec_result table.tblBorderGray02 tr")
-
-            if not product_rows:
-                log.info("製品リストが見つかりませんでした。")
-                break
-
-            for row in product_rows:
-                if len(results) >= limit:
-                    break
-                # ヘッダー行などをスキップ
-                if row.get('class') and ('bgColor02' in row.get('class') or 'bgColor03' in row.get('class')):
-                    continue
-                
-                name_element = row.select_one("td.textL a")
-                price_element = row.select_one("span.priceText a")
-                
-                if name_element and price_element:
-                    name = name_element.get_text(strip=True)
-                    price_text = price_element.get_text(strip=True).replace('¥', '').replace(',', '')
-                    relative_url = name_element.get('href')
-                    
-                    # 絞り込みキーワードのチェック
-                    if filter_keyword and filter_keyword.lower() not in name.lower():
-                        continue
-                    
-                    # 除外キーワードのチェック
-                    if any(keyword in name for keyword in EXCLUDED_KEYWORDS):
-                        continue
-
-                    if name and price_text.isdigit() and relative_url:
-                        full_url = urllib.parse.urljoin("https://kakaku.com/", relative_url)
-                        results.append({"name": name, "price": int(price_text), "url": full_url})
-            
-            # 「次へ」ボタンが存在するか確認してクリック
-            try:
-                next_button = driver.find_element(By.CSS_SELECTOR, "a.pagerNext")
-                driver.execute_script("arguments[0].click();", next_button)
-                log.info(f"{page_num}ページ目を取得。現在{len(results)}件。")
-                page_num += 1
-                time.sleep(2)  # サーバー負荷軽減
-            except:
-                log.info("次のページが見つかりませんでした。処理を終了します。")
-                break
-        
-        log.info(f"価格.com処理完了。{len(results)}件の製品情報を取得しました。")
+    lease.count_page()
+    
+    if maker:
+        maker_select = Select(wait.until(EC.element_to_be_clickable((By.NAME, "LstMaker"))))
+        maker_select.select_by_visible_text(maker)
+
+    if sort:
+        sort_select = Select(wait.until(EC.element_to_be_clickable((By.NAME, "Sort"))))
+        sort_select.select_by_value(sort)
+    
+    search_button = driver.find_element(By.CSS_SELECTOR, 'input[type="image"][value="検索する"]')
+    with _get_throttle(spec_search_url), metrics.timed('page_load', 'kakaku'):
+        search_button.click()
+        # フォームのページから結果ページに切り替わるまで待つ
+        wait.until(EC.staleness_of(search_button))
+    lease.count_page()
+    
+    results = []
+    page_num = 1
+    while len(results) < limit:
+        with metrics.timed('wait_selector', 'kakaku'):
+            result_table = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, RESULT_TABLE_SELECTOR)))
+        page_profile.record_driver_page(driver, 'kakaku')
+        html_content = driver.execute_script(_RESULT_FRAGMENT_SCRIPT) or driver.page_source
+        products, _, _ = _parse_result_page(html_content, row_filter)
+
+        if products is None:
+            log.info("製品リストが見つかりませんでした。")
+            break
+
+        results.extend(products[:limit - len(results)])
+
+        # 「次へ」ボタンが存在するか確認してクリック
+        next_buttons = driver.find_elements(By.CSS_SELECTOR, "a.pagerNext")
+        if not next_buttons:
+            log.info("次のページが見つかりませんでした。処理を終了します。")
+            break
+        # リクエスト間隔はHTTPでの取得と同じホストごとの制限に従う (サーバー負荷軽減)
+        with _get_throttle(spec_search_url), metrics.timed('page_load', 'kakaku'):
+            driver.execute_script("arguments[0].click();", next_buttons[0])
+            # 結果テーブルが次のページのものに置き換わるまで待つ
+            wait.until(EC.staleness_of(result_table))
+        lease.count_page()
+        log.info(f"{page_num}ページ目を取得。現在{len(results)}件。")
+        page_num += 1
+
+    log.info(f"価格.com処理完了。{len(results)}件の製品情報を取得しました。")
+    return results
+
+
+async def _scrape_with_page(page, log, spec_search_url, row_filter, limit, maker, sort):
+    """Playwright のページで検索フォームを操作し、結果ページを順に読み取る (_scrape_with_driver と同じ手順)"""
+    from scrapers import playwright_engine
+
+    await page_profile.apply_to_page(page, 'kakaku')
+    throttle = _get_throttle(spec_search_url)
+    async with throttle:
+        with metrics.timed('page_load', 'kakaku'):
+            await page.goto(spec_search_url, wait_until='domcontentloaded')
+
+    if maker:
+        await page.select_option('select[name="LstMaker"]', label=maker)
+    if sort:
+        await page.select_option('select[name="Sort"]', value=sort)
+
+    async with throttle:
+        with metrics.timed('page_load', 'kakaku'):
+            async with page.expect_navigation(wait_until='domcontentloaded'):
+                await page.click('input[type="image"][value="検索する"]')
+
+    results = []
+    page_num = 1
+    while len(results) < limit:
+        with metrics.timed('wait_selector', 'kakaku'):
+            await page.wait_for_selector(RESULT_TABLE_SELECTOR, state='attached')
+        await page_profile.record_playwright_page(page, 'kakaku')
+        html_content = await playwright_engine.evaluate(page, _RESULT_FRAGMENT_SCRIPT) or await page.content()
+        # パースはイベントループを止めないよう別スレッドで行う
+        products, _, _ = await asyncio.to_thread(_parse_result_page, html_content, row_filter)
+
+        if products is None:
+            log.info("製品リストが見つかりませんでした。")
+            break
+
+        results.extend(products[:limit - len(results)])
+
+        next_button = await page.query_selector("a.pagerNext")
+        if next_button is None:
+            log.info("次のページが見つかりませんでした。処理を終了します。")
+            break
+        # リクエスト間隔はHTTPでの取得と同じホストごとの制限に従う (サーバー負荷軽減)
+        async with throttle:
+            with metrics.timed('page_load', 'kakaku'):
+                async with page.expect_navigation(wait_until='domcontentloaded'):
+                    await next_button.click()
+        log.info(f"{page_num}ページ目を取得。現在{len(results)}件。")
+        page_num += 1
+
+    log.info(f"価格.com処理完了。{len(results)}件の製品情報を取得しました。")
+    return results
+
+
+def _build_result_url(spec_search_url: str, maker_id: str = None, sort: str = None, page: int = 1) -> str:
+    """スペック検索フォームの送信内容をクエリパラメータにした結果ページのURLを組み立てる"""
+    params = {'_s': 2}
+    if maker_id:
+        params['LstMaker'] = maker_id
+    if sort:
+        params['Sort'] = sort
+    if page > 1:
+        params['Page'] = page
+    return f"{spec_search_url}?{urllib.parse.urlencode(params)}"
+
+
+def _get_maker_id(category_name: str, spec_search_url: str, maker: str):
+    """メーカー名に対応する LstMaker の値を返す (カテゴリごとにキャッシュ)"""
+    maker_ids = _maker_id_cache.get(category_name)
+    if maker_ids is None:
+        with _get_throttle(spec_search_url), metrics.timed('page_load', 'kakaku'):
+            response = _get_session().get(spec_search_url, timeout=30)
+        response.raise_for_status()
+        options = _parse_maker_options(BeautifulSoup(response.content, 'lxml'))
+        if options is None:
+            return None
+        maker_ids = {name: value for value, name in options}
+        _maker_id_cache[category_name] = maker_ids
+    return maker_ids.get(maker)
+
+
+def _scrape_via_http(log, category_name, spec_search_url, row_filter, limit, maker, sort):
+    """
+    ブラウザを使わず、検索結果ページのURLを直接組み立てて requests で取得する。
+    結果テーブルが得られなかった場合は None を返す (呼び出し元でSeleniumに切り替える)。
+    """
+    maker_id = None
+    if maker:
+        maker_id = _get_maker_id(category_name, spec_search_url, maker)
+        if not maker_id:
+            log.info(f"メーカー '{maker}' の検索条件が見つかりませんでした。")
+            return None
+
+    # 1ページ目で総ページ数を確認する
+    html_content = _fetch_result_page(spec_search_url, maker_id, sort, 1)
+    products, has_next, total_pages = _parse_result_page(html_content, row_filter)
+    if products is None:
+        return None
+
+    results = products[:limit]
+    log.info(f"1ページ目を取得 (HTTP)。現在{len(results)}件。")
+    if len(results) >= limit or not has_next:
         return results
 
-    except Exception as e:
-        log.error(f"スクレイピングで致命的なエラーが発生: {e}", exc_info=True)
-        return []
-    finally:
-        if driver:
-            driver.quit()
+    _collect_following_pages(log, results, spec_search_url, maker_id, sort, row_filter, limit, total_pages)
+    return results
 
 
-def get_makers(category_name: str):
+def _fetch_result_page(spec_search_url, maker_id, sort, page_num):
+    url = _build_result_url(spec_search_url, maker_id, sort, page_num)
+    with _get_throttle(url), metrics.timed('page_load', 'kakaku'):
+        response = _get_session().get(url, timeout=30)
+    if response.status_code in (403, 429):
+        raise BlockedError(f"価格.comからアクセスを制限されました (HTTP {response.status_code})。")
+    response.raise_for_status()
+    page_profile.record_response(response, 'kakaku')
+    _check_conditions(response.content, maker_id, sort, page_num)
+    return response.content
+
+
+def _check_conditions(html_content, maker_id, sort, page_num):
     """
-    価格.comから指定されたカテゴリのメーカーリストを取得する
+    結果ページに表示し直された検索フォームの選択状態とページ送りが、要求した条件と同じか確かめる。
+    URLのパラメータが無視されると、絞り込まれていない (別のメーカー・並び順・ページの) 結果が
+    そのまま読めてしまうため、食い違えば _ConditionMismatch を送出してブラウザでの取得に切り替える。
+    """
+    try:
+        with metrics.timed('parse', 'kakaku'):
+            conditions = extract.kakaku_search_conditions(html_content)
+    except extract.ExtractionError as e:
+        raise _ConditionMismatch(f"検索条件を確認できません: {e}") from e
+    if maker_id and conditions['LstMaker'] != str(maker_id):
+        raise _ConditionMismatch(f"メーカー {maker_id} を指定しましたが、結果ページは '{conditions['LstMaker']}' です")
+    if sort and conditions['Sort'] != sort:
+        raise _ConditionMismatch(f"並び順 {sort} を指定しましたが、結果ページは '{conditions['Sort']}' です")
+    if (page_num > 1 or conditions['Page'] is not None) and conditions['Page'] != page_num:
+        raise _ConditionMismatch(f"{page_num}ページ目を指定しましたが、結果ページは {conditions['Page']}ページ目です")
+
+
+def _collect_following_pages(log, results, spec_search_url, maker_id, sort, row_filter, limit, total_pages):
+    """
+    2ページ目以降を並行して先読みし、サイトの並び順どおりに results へ追加する。
+    上限件数に達した時点で、まだ始まっていない取得は取り消す。
+    総ページ数が分からない場合は「次へ」が無くなるまで辿る。
+    """
+    window = max(1, config.KAKAKU_MAX_CONCURRENCY_PER_HOST)
+    last_page = total_pages or math.inf
+    pending = {}
+    next_to_submit = 2
+    next_to_consume = 2
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=window, thread_name_prefix='kakaku-page') as executor:
+        try:
+            while len(results) < limit and next_to_consume <= last_page:
+                # 消費位置から window ページ先までを先読みしておく
+                while next_to_submit <= last_page and next_to_submit < next_to_consume + window:
+                    pending[next_to_submit] = executor.submit(
+                        metrics.bind(_fetch_result_page), spec_search_url, maker_id, sort, next_to_submit
+                    )
+                    next_to_submit += 1
+
+                page_num = next_to_consume
+                products, has_next, _ = _parse_result_page(pending.pop(page_num).result(), row_filter)
+                next_to_consume += 1
+                if products is None:
+                    log.info(f"{page_num}ページ目に製品リストが見つかりませんでした。")
+                    break
+
+                results.extend(products[:limit - len(results)])
+                log.info(f"{page_num}ページ目を取得 (HTTP)。現在{len(results)}件。")
+                if not has_next:
+                    break
+        finally:
+            for future in pending.values():
+                future.cancel()
+
+
+# fetch_maker_options: 条件付きGETでページが変わっていなかった
+NOT_MODIFIED = 'not_modified'
+
+
+def set_maker_ids(category_name: str, maker_ids: dict):
+    """保存済みのメーカーID ({メーカー名: LstMakerの値}) を検索URLの組み立て用に登録する"""
+    _maker_id_cache[category_name] = dict(maker_ids)
+
+
+def fetch_maker_options(category_name: str, etag: str = None, last_modified: str = None):
+    """
+    スペック検索ページからメーカーの選択肢を取得する。
+    etag / last_modified を渡すと条件付きGETを行い、ページが変わっていなければ NOT_MODIFIED を返す。
+    戻り値は {'options': [(値, メーカー名), ...], 'etag': ..., 'last_modified': ...}、
+    NOT_MODIFIED、または取得できなかった場合は None。
     """
     log = logging.getLogger(__name__)
     spec_search_url = config.CATEGORY_URL_MAP.get(category_name)
     if not spec_search_url:
         log.warning(f"カテゴリ '{category_name}' のURLが見つかりません。")
-        return []
+        return None
+
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
 
     log.info(f"メーカーリスト取得開始: カテゴリ='{category_name}'")
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'
-        }
-        response = requests.get(spec_search_url, headers=headers, timeout=30)
+        with _get_throttle(spec_search_url), metrics.timed('page_load', 'kakaku'):
+            response = _get_session().get(spec_search_url, headers=headers, timeout=30)
+        if response.status_code == 304:
+            log.info(f"  -> {category_name} のメーカーリストは更新されていません。")
+            return NOT_MODIFIED
         response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'lxml')
-        
-        maker_select_element = soup.find("select", {"name": "LstMaker"})
-        if not maker_select_element:
+        page_profile.record_response(response, 'kakaku')
+
+        options = _parse_maker_options(BeautifulSoup(response.content, 'lxml'))
+        if options is None:
             log.warning(f"  -> {category_name} のメーカー選択リストが見つかりませんでした。")
-            return []
+            return None
 
-        makers = [
-            option.get_text(strip=True) 
-            for option in maker_select_element.find_all("option") 
-            if option.get("value") and option.get_text(strip=True) not in EXCLUDED_MAKERS
-        ]
-        log.info(f"  -> {category_name} のメーカーを {len(makers)} 件取得しました。")
-        return makers
+        # 取得したついでに、検索URLの組み立て用にメーカーIDを覚えておく
+        _maker_id_cache[category_name] = {name: value for value, name in options}
+        return {
+            'options': options,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
 
     except requests.exceptions.RequestException as e:
         log.error(f"メーカーリスト取得でHTTPエラーが発生: {e}", exc_info=True)
-        return []
+        return None
     except Exception as e:
         log.error(f"メーカーリスト取得で予期せぬエラーが発生: {e}", exc_info=True)
+        return None
+
+
+def visible_makers(options, rules: filters.RuleSet = None) -> list:
+    """メーカーの選択肢から、除外リストにないメーカー名を取り出す (rules を省略すると現在の規則で判定する)"""
+    rules = rules or filters.get_engine().rules
+    return [name for _, name in options if rules.maker_visible(name)]
+
+
+def get_makers(category_name: str):
+    """
+    価格.comから指定されたカテゴリのメーカーリストを取得する
+    """
+    fetched = fetch_maker_options(category_name)
+    if not fetched or fetched == NOT_MODIFIED:
         return []
+    makers = visible_makers(fetched['options'])
+    logging.getLogger(__name__).info(f"  -> {category_name} のメーカーを {len(makers)} 件取得しました。")
+    return makers
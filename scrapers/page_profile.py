@@ -0,0 +1,105 @@
+# サイトごとのページ読み込みプロファイル
+#
+# スクレイピングに必要なのはHTML (とページ送りに使うスクリプト) だけなので、
+# 画像・動画・フォントと、広告・計測用のドメインへのリクエストは読み込ませない。
+#   Selenium:   CDP の Network.setBlockedURLs でURLのパターンごとに遮断する
+#   Playwright: page.route でリクエストの種類とドメインを見て中断する
+# 読み込んだページの転送量は Resource Timing API から集計し、metrics.PAGE_BYTES に記録する。
+import logging
+import urllib.parse
+
+import config
+import metrics
+
+# Selenium (CDP) ではリクエストの種類で遮断できないため、拡張子のパターンに置き換える
+_RESOURCE_TYPE_PATTERNS = {
+    'image': ['*.jpg*', '*.jpeg*', '*.png*', '*.gif*', '*.webp*', '*.avif*', '*.svg*', '*.ico*'],
+    'media': ['*.mp4*', '*.webm*', '*.m3u8*', '*.mp3*', '*.m4a*'],
+    'font': ['*.woff*', '*.woff2*', '*.ttf*', '*.otf*', '*.eot*'],
+}
+
+# ナビゲーションと、このページで読み込んだリソースの転送量 (バイト) の合計。
+# 別ドメインのリソースは Timing-Allow-Origin が無いと 0 になるため、実際より少なめの値になる。
+PAGE_BYTES_SCRIPT = (
+    "return performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'))"
+    ".reduce((total, entry) => total + (entry.transferSize || 0), 0);"
+)
+
+
+def get_profile(site: str) -> dict:
+    """サイトのプロファイル ({'block_resource_types': [...], 'block_domains': [...]})。無効なら空。"""
+    if not config.PAGE_LOAD_PROFILES_ENABLED:
+        return {}
+    return config.PAGE_LOAD_PROFILES.get(site, {})
+
+
+def blocked_url_patterns(site: str) -> list:
+    """CDP の Network.setBlockedURLs に渡すURLのパターン"""
+    profile = get_profile(site)
+    patterns = []
+    for resource_type in profile.get('block_resource_types', []):
+        patterns.extend(_RESOURCE_TYPE_PATTERNS.get(resource_type, []))
+    patterns.extend(f"*://*{domain}/*" for domain in profile.get('block_domains', []))
+    return patterns
+
+
+def _is_blocked_domain(url: str, domains) -> bool:
+    host = urllib.parse.urlsplit(url).hostname or ''
+    return any(host == domain or host.endswith('.' + domain) for domain in domains)
+
+
+def apply_to_driver(driver, site: str):
+    """借り受けたドライバーに site のプロファイルを適用する (プールのドライバーはサイト間で共有される)"""
+    patterns = blocked_url_patterns(site)
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns})
+    except Exception as e:
+        # CDP に対応していないブラウザでは遮断せずに読み込む
+        logging.getLogger(__name__).debug(f"リソースの遮断を設定できませんでした: {e}")
+
+
+async def apply_to_page(page, site: str):
+    """Playwright のページに site のプロファイルを適用する"""
+    profile = get_profile(site)
+    resource_types = set(profile.get('block_resource_types', []))
+    domains = profile.get('block_domains', [])
+    if not resource_types and not domains:
+        return
+
+    async def handle(route):
+        request = route.request
+        if request.resource_type in resource_types or _is_blocked_domain(request.url, domains):
+            metrics.BLOCKED_REQUESTS.inc(site=site)
+            await route.abort()
+        else:
+            await route.continue_()
+
+    await page.route('**/*', handle)
+
+
+def record_page_bytes(site: str, engine: str, size):
+    if size:
+        metrics.PAGE_BYTES.observe(size, site=site, engine=engine)
+
+
+def record_driver_page(driver, site: str):
+    """Selenium で読み込んだ現在のページの転送量を記録する"""
+    try:
+        record_page_bytes(site, 'selenium', driver.execute_script(PAGE_BYTES_SCRIPT))
+    except Exception as e:
+        logging.getLogger(__name__).debug(f"転送量を取得できませんでした: {e}")
+
+
+async def record_playwright_page(page, site: str):
+    """Playwright で読み込んだ現在のページの転送量を記録する"""
+    try:
+        record_page_bytes(site, 'playwright', await page.evaluate(f"() => {{ {PAGE_BYTES_SCRIPT} }}"))
+    except Exception as e:
+        logging.getLogger(__name__).debug(f"転送量を取得できませんでした: {e}")
+
+
+def record_response(response, site: str):
+    """requests で取得したページの転送量 (圧縮されていれば圧縮後のバイト数) を記録する"""
+    size = response.raw.tell() if response.raw is not None else 0
+    record_page_bytes(site, 'http', size or len(response.content))
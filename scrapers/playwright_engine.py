@@ -0,0 +1,186 @@
+# Playwright (asyncio) によるブラウザエンジン
+#
+# Selenium のドライバープールはタスクごとに Chrome のプロセスを1つ占有するため、
+# 同時実行数がメモリで頭打ちになる。このエンジンは Chromium を1プロセスだけ起動し、
+# タスクごとに独立したブラウザコンテキスト (Cookie・キャッシュを共有しない軽量なセッション) を作って
+# 専用スレッドのイベントループ上で並行に動かす。
+#
+# config.SCRAPER_ENGINE = 'playwright' のとき、scrapers.kakaku / scrapers.amazon のブラウザでの取得が
+# このエンジンを使う。呼び出し側 (スケジューラのワーカースレッド) からは run() で同期的に使える。
+import asyncio
+import atexit
+import concurrent.futures
+import contextvars
+import logging
+import threading
+import time
+
+from playwright.async_api import async_playwright
+
+import config
+import metrics
+from scrapers import page_profile, BlockedError
+
+USER_AGENT = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/124.0.0.0 Safari/537.36'
+)
+
+
+class PlaywrightEngine:
+    """
+    1つの Chromium プロセスと、それを動かすイベントループのスレッド。
+    - 同時に開くページ (コンテキスト) は max_pages 個まで
+    - ブラウザが落ちていたら次のタスクで起動し直す
+    """
+
+    def __init__(self, max_pages: int, headless: bool = True):
+        self.max_pages = max_pages
+        self.headless = headless
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='playwright-loop', daemon=True)
+        self._thread.start()
+        self._playwright = None
+        self._browser = None
+        self._closed = False
+        # asyncio の同期プリミティブはループのスレッドで作る
+        self._semaphore, self._browser_lock = self._call(self._create_primitives()).result()
+        self._stats = {'launched': 0, 'contexts': 0, 'active': 0}
+
+    async def _create_primitives(self):
+        return asyncio.Semaphore(self.max_pages), asyncio.Lock()
+
+    def _call(self, coro) -> concurrent.futures.Future:
+        """呼び出し元の contextvars (検索ごとの計測など) を引き継いでループ上で coro を実行する"""
+        future = concurrent.futures.Future()
+        context = contextvars.copy_context()
+
+        def on_done(task):
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+
+        def schedule():
+            if not future.set_running_or_notify_cancel():
+                coro.close()
+                return
+            context.run(self._loop.create_task, coro).add_done_callback(on_done)
+
+        self._loop.call_soon_threadsafe(schedule)
+        return future
+
+    async def _get_browser(self):
+        async with self._browser_lock:
+            if self._closed:
+                raise RuntimeError("Playwrightエンジンは既にシャットダウンされています。")
+            if self._browser is None or not self._browser.is_connected():
+                if self._browser is not None:
+                    logging.getLogger(__name__).warning("Chromiumが終了していたため起動し直します。")
+                if self._playwright is None:
+                    self._playwright = await async_playwright().start()
+                with metrics.timed('driver_start', 'browser'):
+                    self._browser = await self._playwright.chromium.launch(
+                        headless=self.headless, args=['--disable-dev-shm-usage', '--disable-gpu']
+                    )
+                self._stats['launched'] += 1
+            return self._browser
+
+    async def _run_in_page(self, fn, args):
+        started = time.perf_counter()
+        async with self._semaphore:
+            metrics.observe_stage('driver_wait', 'browser', time.perf_counter() - started)
+            browser = await self._get_browser()
+            context = await browser.new_context(
+                user_agent=USER_AGENT, locale='ja-JP', viewport={'width': 1920, 'height': 1080}
+            )
+            self._stats['contexts'] += 1
+            self._stats['active'] += 1
+            try:
+                page = await context.new_page()
+                page.set_default_timeout(config.PLAYWRIGHT_TIMEOUT * 1000)
+                return await fn(page, *args)
+            finally:
+                self._stats['active'] -= 1
+                await context.close()
+
+    def warm_up(self):
+        """サーバー起動時などに、あらかじめ Chromium を起動しておく"""
+        self._call(self._get_browser()).result()
+
+    def run(self, fn, *args):
+        """
+        新しいブラウザコンテキストのページで await fn(page, *args) を実行し、結果を返す。
+        スレッドから同期的に呼び出す (イベントループのスレッドからは呼ばないこと)。
+        """
+        return self._call(self._run_in_page(fn, args)).result()
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats['max_pages'] = self.max_pages
+        return stats
+
+    async def _close(self):
+        async with self._browser_lock:
+            self._closed = True
+            if self._browser is not None:
+                await self._browser.close()
+            if self._playwright is not None:
+                await self._playwright.stop()
+
+    def shutdown(self):
+        """ブラウザを終了し、イベントループを止める"""
+        try:
+            self._call(self._close()).result(timeout=30)
+        except Exception as e:
+            logging.getLogger(__name__).debug(f"Playwrightの終了時にエラー: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        logging.getLogger(__name__).info(f"Playwrightエンジンをシャットダウンしました (コンテキスト {self._stats['contexts']} 個を使用)。")
+
+
+async def evaluate(page, script: str, *args):
+    """Selenium の execute_script と同じ書き方のスクリプト (arguments[n] を参照し return で値を返す) を実行する"""
+    return await page.evaluate(f"args => (function() {{ {script} }}).apply(null, args)", list(args))
+
+
+async def load_fragment(page, site: str, url: str, ready_selector: str, blocked_selector: str, script: str, *args):
+    """
+    url を開き、ready_selector (または blocked_selector) の要素が現れたら script で必要な部分のHTMLを取り出す。
+    blocked_selector の要素 (キャプチャ画面など) があれば BlockedError を送出する。
+    """
+    await page_profile.apply_to_page(page, site)
+    with metrics.timed('page_load', site):
+        await page.goto(url, wait_until='domcontentloaded')
+    with metrics.timed('wait_selector', site):
+        await page.wait_for_selector(
+            f"{ready_selector}, {blocked_selector}" if blocked_selector else ready_selector, state='attached'
+        )
+    if blocked_selector and await page.query_selector(blocked_selector):
+        raise BlockedError(f"アクセス制限の画面が表示されました: {url}")
+    await page_profile.record_playwright_page(page, site)
+    return await evaluate(page, script, *args) or await page.content()
+
+
+# --- プロセス全体で共有するエンジン ---
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> PlaywrightEngine:
+    """共有エンジンを返す (初回呼び出し時に生成)"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = PlaywrightEngine(config.PLAYWRIGHT_MAX_PAGES, headless=config.PLAYWRIGHT_HEADLESS)
+            atexit.register(shutdown_engine)
+        return _engine
+
+
+def shutdown_engine():
+    global _engine
+    with _engine_lock:
+        engine, _engine = _engine, None
+    if engine:
+        engine.shutdown()
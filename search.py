@@ -1,8 +1,17 @@
 import logging
-import re
-import urllib.parse
 import concurrent.futures
-from scrapers import kakaku, amazon
+import heapq
+import statistics
+import time
+import amazon_cache
+import config
+import marketplaces
+import metrics
+import normalize
+import price_history
+import scheduler
+from marketplaces import fanout
+from scrapers import kakaku, driver_pool
 
 def _deduplicate_products(products: list, category_name: str) -> list:
     """
@@ -13,107 +22,467 @@ def _deduplicate_products(products: list, category_name: str) -> list:
     log.info(f"取得した {len(products)} 件の製品から重複を排除します...")
     
     unique_products = {}
-    for item in products:
-        # 製品名からメーカー名 [〇〇] や【〇〇】を削除
-        base_name = re.sub(r'[\[【].*?[\]】]', '', item['name']).strip()
+    with metrics.timed('dedup', 'kakaku'):
+        for item in products:
+            product_key = normalize.product_key(item['name'], category_name)
 
-        if category_name == 'マザーボード':
-            # マザーボードの場合：丸括弧のみを削除し、中のスペック情報（DDR4など）は残す
-            product_key = re.sub(r'[()]', '', base_name).strip()
-        else:
-            # その他のカテゴリの場合：製品名の最初の単語（=型番）をキーとする
-            product_key = base_name.split()[0]
-
-        # 辞書にキーが存在しないか、存在しても現在の価格の方が安い場合は登録/更新
-        if product_key not in unique_products or item['price'] < unique_products[product_key]['price']:
-            unique_products[product_key] = item
+            # 辞書にキーが存在しないか、存在しても現在の価格の方が安い場合は登録/更新
+            if product_key not in unique_products or item['price'] < unique_products[product_key]['price']:
+                unique_products[product_key] = item
     
     deduplicated_list = list(unique_products.values())
     log.info(f"重複排除後、{len(deduplicated_list)} 件の製品が残りました。")
     return deduplicated_list
 
-def _search_and_compare_for_maker(category_name, filter_keyword, limit, profit_margin, maker, sort):
+def _unchanged_since_last_crawl(last_kakaku, last_sold, kakaku_price) -> bool:
+    """価格.comの価格が前回と同じで、販売先の前回観測が再確認の期限内か"""
+    if not last_kakaku or not last_sold or last_sold.get('price') is None:
+        return False
+    if last_kakaku['price'] != kakaku_price:
+        return False
+    return time.time() - last_sold['observed_at'] <= config.PRICE_HISTORY_RECHECK_AGE
+
+class _Comparison:
     """
-    単一のメーカーに対して価格.comとAmazonの価格を比較する内部関数
+    価格.comの商品と販売先 (marketplaces) の価格の比較。通常の検索と予算付きの検索で共通の部分。
+    cache_stats ({販売先名: amazon_cache.LookupStats}) にはキャッシュの参照結果を数え、
+    recorder (price_history.PriceRecorder) には観測した価格を記録する。
     """
-    log = logging.getLogger(__name__)
-    log.info(f"  -> メーカー '{maker}' の検索処理を開始...")
-    
-    # 価格.comから製品情報を取得
-    kakaku_results = kakaku.scrape_products(
+
+    def __init__(self, category_name, profit_margin, cache_stats=None, progress=None, recorder=None, incremental=False):
+        self.category_name = category_name
+        self.profit_margin = profit_margin
+        self.cache_stats = cache_stats
+        self.progress = progress
+        self.recorder = recorder
+        self.incremental = incremental
+        self.sellers = marketplaces.enabled()
+        self.last_kakaku = {}
+        self.last_sold = {seller.name: {} for seller in self.sellers}
+        # メーカーごとの、価格を確かめられなかった販売先がある商品の数
+        self.unanswered = {}
+
+    def product_key(self, item) -> str:
+        return normalize.product_key(item['name'], self.category_name)
+
+    def record_lookup(self, seller, outcome):
+        if self.cache_stats is not None and seller.name in self.cache_stats:
+            self.cache_stats[seller.name].record(outcome)
+
+    def prepare(self, items, load_history=False):
+        """
+        今回の価格を記録する前に、前回の観測値を読んでおく (差分モード、または load_history が真の場合)。
+        そのあと価格.comの価格を記録する。
+        """
+        if self.incremental or load_history:
+            history = price_history.get_history()
+            product_keys = [self.product_key(item) for item in items]
+            self.last_kakaku.update(history.latest_many(product_keys, price_history.KAKAKU))
+            for seller in self.sellers:
+                self.last_sold[seller.name].update(history.latest_many(product_keys, seller.history_source))
+        if self.recorder is not None:
+            for item in items:
+                self.recorder.add(self.product_key(item), price_history.KAKAKU, item['price'],
+                                  item['url'], self.category_name, item['name'])
+
+    def known_answers(self, item):
+        """
+        問い合わせずに分かる販売価格を集める。
+        戻り値は (検索キーワード, {販売先名: 結果}, 問い合わせが必要な販売先のリスト)。
+        差分モードでは、価格.comの価格が前回から変わらず販売先の前回観測が新しければその値を使う。
+        """
+        search_keyword = normalize.search_keyword(item['name'], self.category_name)
+        if not search_keyword:
+            return search_keyword, {}, []
+        product_key = self.product_key(item)
+        answers, missing = {}, []
+        for seller in self.sellers:
+            previous = self.last_sold[seller.name].get(product_key)
+            if self.incremental and _unchanged_since_last_crawl(self.last_kakaku.get(product_key), previous, item['price']):
+                self.record_lookup(seller, amazon_cache.HISTORY)
+                answers[seller.name] = {'price': previous['price'], 'url': previous['url']}
+                continue
+
+            cached = seller.lookup_cached(search_keyword, self.category_name)
+            if cached is not None:
+                answers[seller.name], outcome = cached
+                self.record_lookup(seller, outcome)
+                continue
+            missing.append(seller)
+        return search_keyword, answers, missing
+
+    def record_answer(self, item, seller, result):
+        if self.recorder is not None and result:
+            self.recorder.add(self.product_key(item), seller.history_source, result.get('price'), result.get('url'),
+                              self.category_name, item['name'])
+
+    def evaluate(self, item, search_keyword, answers, unanswered, maker) -> bool:
+        """最も高く売れる販売先の価格で利益を計算し、利益率がしきい値以上なら通知して True を返す"""
+        # 販売先ごとの価格 (amazon_price / amazon_url など) と、最も高く売れる販売先
+        best = None
+        for seller in self.sellers:
+            result = answers.get(seller.name)
+            price = result.get('price') if result else None
+            item[f'{seller.name}_price'] = price
+            item[f'{seller.name}_url'] = result.get('url') if result else seller.search_url(search_keyword)
+            if price and (best is None or price > item['sell_price']):
+                best = seller
+                item['sell_price'] = price
+                item['sell_url'] = result.get('url')
+        if best is None:
+            item['sell_price'] = None
+            item['sell_url'] = None
+        item['sell_marketplace'] = best.label if best else None
+        # 期限切れ・失敗で価格を確かめられなかった販売先
+        item['unanswered_marketplaces'] = unanswered
+        if unanswered:
+            self.unanswered[maker] = self.unanswered.get(maker, 0) + 1
+
+        # 利益計算
+        if item.get('sell_price') and item.get('price') and item.get('price') > 0:
+            price_diff = item['sell_price'] - item['price']
+            margin = (price_diff / item['price']) * 100
+
+            if margin >= self.profit_margin:
+                item['price_difference'] = price_diff
+                item['profit_margin'] = margin
+                item['maker'] = maker
+                if self.progress:
+                    self.progress('item', item)
+                return True
+        return False
+
+def _fetch_kakaku(category_name, filter_keyword, limit, maker, sort):
+    """価格.comから製品情報を取得し (価格.com用のキューで実行)、重複を除いて返す"""
+    kakaku_results = scheduler.get_scheduler().submit(
+        'kakaku',
+        kakaku.scrape_products,
         category_name=category_name, 
         filter_keyword=filter_keyword, 
         limit=limit, 
         maker=maker, 
         sort=sort
-    )
+    ).result()
     
     if not kakaku_results:
-        log.info(f"  -> メーカー '{maker}' の製品は見つかりませんでした。")
+        logging.getLogger(__name__).info(f"  -> メーカー '{maker}' の製品は見つかりませんでした。")
+        metrics.EMPTY_RESULTS.inc(site='kakaku', category=category_name)
         return []
 
     # 重複排除
-    deduplicated_results = _deduplicate_products(kakaku_results, category_name)
+    return _deduplicate_products(kakaku_results, category_name)
+
+def _search_and_compare_for_maker(category_name, filter_keyword, limit, profit_margin, maker, sort,
+                                  cache_stats=None, progress=None, cancel_event=None,
+                                  recorder=None, incremental=False):
+    """
+    単一のメーカーに対して価格.comの価格と各販売先 (marketplaces) の価格を比較する内部関数。
+    商品ごとに有効なすべての販売先へ同時に問い合わせ、最も高い販売価格に対して利益を計算する。
+    期限内に答えなかった販売先は除いて (部分的な結果で) 判定する。
+    progress が指定されていれば、利益商品が見つかるたびに progress('item', 商品) を呼ぶ。
+    cancel_event がセットされたら、次の商品に進む前に処理を打ち切る。
+    incremental が真なら、価格.comの価格が前回から変わらず、販売先の前回観測が
+    新しい商品はその販売先を再確認せず前回の観測値を使う。
+    戻り値は (利益商品のリスト, 価格を確かめられなかった販売先がある商品の数)。
+    価格.comの取得に失敗した場合は例外 (scrapers.ScrapeError など) をそのまま送出する。
+    """
+    log = logging.getLogger(__name__)
+    log.info(f"  -> メーカー '{maker}' の検索処理を開始...")
+    if progress:
+        progress('maker_started', {'maker': maker})
+
+    deduplicated_results = _fetch_kakaku(category_name, filter_keyword, limit, maker, sort)
+    if not deduplicated_results:
+        return [], 0
 
+    comparison = _Comparison(category_name, profit_margin, cache_stats, progress, recorder, incremental)
+    comparison.prepare(deduplicated_results)
     maker_results = []
-    for item in deduplicated_results:
-        # 製品名から不要な部分を削除
-        base_name = re.sub(r'[\[【].*?[\]】]', '', item['name']).strip()
 
-        if category_name == 'マザーボード':
-            # マザーボードの場合：丸括弧のみを削除し、中のスペック情報（DDR4など）は残す
-            search_keyword = re.sub(r'[()]', '', base_name).strip()
-        else:
-            # その他のカテゴリの場合：製品名の最初の単語（=型番）を使用
-            search_keyword = base_name.split()[0]
-
-        # 抽出した型番でAmazonを検索
-        amazon_result = amazon.scrape_product(search_keyword)
-        
-        if amazon_result:
-            item['amazon_price'] = amazon_result.get('price')
-            item['amazon_url'] = amazon_result.get('url')
-        else:
-            item['amazon_price'] = None
-            item['amazon_url'] = f"https://www.amazon.co.jp/s?k={urllib.parse.quote(search_keyword)}"
-        
-        # 利益計算
-        if item.get('amazon_price') and item.get('price') and item.get('price') > 0:
-            price_diff = item['amazon_price'] - item['price']
-            margin = (price_diff / item['price']) * 100
-            
-            if margin >= profit_margin:
-                item['price_difference'] = price_diff
-                item['profit_margin'] = margin
+    # キャッシュに無い (商品, 販売先) は、各販売先のキューにまとめて投入する
+    # (全メーカー・全検索の問い合わせがスケジューラの速度制限の範囲で並行に進む)
+    lookups = fanout.FanOut(cancel_event=cancel_event)
+    pending = {}
+    try:
+        for index, item in enumerate(deduplicated_results):
+            if cancel_event is not None and cancel_event.is_set():
+                break
+
+            search_keyword, answers, missing = comparison.known_answers(item)
+            for seller in missing:
+                comparison.record_lookup(seller, amazon_cache.MISS)
+                lookups.submit(index, seller, search_keyword, category_name)
+
+            if lookups.pending(index):
+                pending[index] = (item, search_keyword, answers, [])
+            elif comparison.evaluate(item, search_keyword, answers, [], maker):
                 maker_results.append(item)
+
+        for index, seller, result, outcome in lookups.results():
+            item, search_keyword, answers, unanswered = pending[index]
+            if outcome == fanout.OK:
+                answers[seller.name] = result
+                comparison.record_answer(item, seller, result)
+            else:
+                unanswered.append(seller.label)
+            if not lookups.pending(index) and comparison.evaluate(item, search_keyword, answers, unanswered, maker):
+                maker_results.append(item)
+    finally:
+        # 打ち切った問い合わせがこのメーカーの処理の後まで動き続けないようにする
+        lookups.close()
+
+    if cancel_event is not None and cancel_event.is_set():
+        log.info(f"  -> メーカー '{maker}' の処理は中止されました。")
     
+    unanswered = comparison.unanswered.get(maker, 0)
+    if unanswered:
+        log.warning(f"  -> メーカー '{maker}': 販売価格を確かめられなかった商品が {unanswered}件あります。")
     log.info(f"  -> メーカー '{maker}' の処理完了。{len(maker_results)}件の利益商品を発見。")
-    return maker_results
+    return maker_results, unanswered
+
+def _sell_ratio_priors(category_name, sellers) -> dict:
+    """販売先ごとの 販売価格÷価格.comの価格 の見込み (カテゴリの観測済み商品の中央値)"""
+    history = price_history.get_history()
+    priors = {}
+    for seller in sellers:
+        ratios = history.price_ratios(category_name, seller.history_source)
+        if len(ratios) >= config.TOPK_PRIOR_MIN_SAMPLES:
+            priors[seller.name] = statistics.median(ratios)
+        else:
+            priors[seller.name] = config.TOPK_DEFAULT_SELL_RATIO
+    return priors
 
-def run_search(category_name, filter_keyword, limit, profit_margin, makers, sort):
+def _estimate_sell_price(comparison, item, answers, missing, priors):
     """
-    指定された条件で並列検索を実行し、結果を返す
+    問い合わせる前の、最も高く売れる販売先の見込み価格と、分かっている範囲での上限を返す。
+    上限は問い合わせが必要なすべての販売先に前回の観測がある場合だけ求まる (それ以外は None)。
+    """
+    expected = max((result['price'] for result in answers.values() if result and result.get('price')), default=0)
+    bound = expected
+    product_key = comparison.product_key(item)
+    for seller in missing:
+        previous = comparison.last_sold[seller.name].get(product_key)
+        if previous is None:
+            expected = max(expected, item['price'] * priors[seller.name])
+            bound = None
+            continue
+        price = previous['price']
+        expected = max(expected, price)
+        if bound is not None:
+            bound = max(bound, price * (1 + config.TOPK_PRUNE_SLACK))
+    return expected, bound
+
+def _run_budgeted_search(category_name, filter_keyword, limit, profit_margin, makers, sort, progress, cancel_event,
+                         incremental, top_k, lookup_budget, cache_stats, recorder):
+    """
+    予算付きの検索。全メーカーの価格.comの商品を見込みの利益率の高い順に並べ、販売先への問い合わせを
+    lookup_budget 回 (キャッシュ・価格履歴で済んだ分は数えない) まで行う。利益商品が top_k 件に達したら止める。
+    見込みの順位は 前回の販売価格 (無ければカテゴリの価格比の中央値) から求めた利益率で決め、
+    同じ見込みの商品は価格.comの一覧での順位が上のものを先にする。
+    前回の販売価格でも利益率に届かない商品は問い合わせない。
+    予算が足りず問い合わせられなかった商品は、問い合わせなかった販売先を未確認として判定する。
     """
     log = logging.getLogger(__name__)
-    log.info(f"検索リクエスト受信: カテゴリ='{category_name}', メーカー='{makers}', 1メーカーあたりの上限='{limit}'")
-    
+    comparison = _Comparison(category_name, profit_margin, cache_stats, progress, recorder, incremental)
+    results, counts = [], {maker: 0 for maker in makers}
+
+    def confirm(item, search_keyword, answers, unanswered, maker):
+        if comparison.evaluate(item, search_keyword, answers, unanswered, maker):
+            results.append(item)
+            counts[maker] += 1
+
+    # 1. 全メーカーの価格.comの一覧を並行に取得する
+    candidates = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(makers)), thread_name_prefix='maker') as executor:
+        future_to_maker = {}
+        for maker in makers:
+            if progress:
+                progress('maker_started', {'maker': maker})
+            future = executor.submit(metrics.bind(_fetch_kakaku), category_name, filter_keyword, limit, maker, sort)
+            future_to_maker[future] = maker
+        for future in concurrent.futures.as_completed(future_to_maker):
+            maker = future_to_maker[future]
+            try:
+                items = future.result()
+            except Exception as exc:
+                log.error(f"メーカー '{maker}' の処理中にエラーが発生しました: {exc}", exc_info=True)
+                counts[maker] = exc
+                continue
+            candidates.extend((maker, rank / len(items), item) for rank, item in enumerate(items))
+
+    # 2. 問い合わせずに判定できる商品を判定し、残りを見込みの利益率の順に並べる
+    comparison.prepare([item for _, _, item in candidates], load_history=True)
+    priors = _sell_ratio_priors(category_name, comparison.sellers)
+    queue, pruned = [], 0
+    for sequence, (maker, rank, item) in enumerate(candidates):
+        search_keyword, answers, missing = comparison.known_answers(item)
+        if not missing:
+            confirm(item, search_keyword, answers, [], maker)
+            continue
+        expected, bound = _estimate_sell_price(comparison, item, answers, missing, priors)
+        required = item['price'] * (1 + profit_margin / 100)
+        if bound is not None and bound < required:
+            pruned += 1
+            continue
+        expected_margin = (expected - item['price']) / item['price'] * 100
+        heapq.heappush(queue, (-round(expected_margin, 1), rank, sequence, (maker, item, search_keyword, answers, missing)))
+    log.info(f"予算付きの検索: 候補 {len(queue)}件 (利益率に届かない {pruned}件を除外、問い合わせ不要で確定 {len(results)}件)")
+
+    # 3. 見込みの高い商品から、同時に TOPK_LOOKUP_WINDOW 件ずつ問い合わせる
+    lookups = fanout.FanOut(cancel_event=cancel_event)
+    pending = {}
+    spent = skipped = 0
+
+    def report():
+        if progress:
+            progress('budget', {'spent': spent, 'budget': lookup_budget, 'confirmed': len(results), 'top_k': top_k,
+                                'skipped': skipped})
+
+    def skip(maker, item, search_keyword, answers, missing):
+        # 予算が足りず問い合わせなかった販売先は、期限切れと同じく未確認として判定する
+        nonlocal skipped
+        skipped += 1
+        confirm(item, search_keyword, answers, [seller.label for seller in missing], maker)
+
+    def fill():
+        nonlocal spent
+        while queue and len(pending) < config.TOPK_LOOKUP_WINDOW and len(results) < top_k:
+            if (cancel_event is not None and cancel_event.is_set()) or spent >= lookup_budget:
+                break
+            _, _, sequence, (maker, item, search_keyword, answers, missing) = heapq.heappop(queue)
+            if spent + len(missing) > lookup_budget:
+                # 残りの予算では全販売先に問い合わせられない
+                skip(maker, item, search_keyword, answers, missing)
+                continue
+            for seller in missing:
+                comparison.record_lookup(seller, amazon_cache.MISS)
+                lookups.submit(sequence, seller, search_keyword, category_name)
+            spent += len(missing)
+            pending[sequence] = (maker, item, search_keyword, answers, [])
+        report()
+
+    try:
+        fill()
+        for sequence, seller, result, outcome in lookups.results():
+            maker, item, search_keyword, answers, unanswered = pending[sequence]
+            if outcome == fanout.OK:
+                answers[seller.name] = result
+                comparison.record_answer(item, seller, result)
+            else:
+                unanswered.append(seller.label)
+            if not lookups.pending(sequence):
+                del pending[sequence]
+                confirm(item, search_keyword, answers, unanswered, maker)
+            if len(results) >= top_k:
+                # K 件に達したら、まだ始まっていない問い合わせは取り消す
+                break
+            fill()
+    finally:
+        # 取り消せなかった (実行中の) 問い合わせが検索の後まで動き続けないようにする
+        lookups.close()
+
+    # 予算を使い切って問い合わせられなかった候補も、分かっている販売価格だけで判定する
+    if len(results) < top_k and not (cancel_event is not None and cancel_event.is_set()):
+        while queue:
+            _, _, _, entry = heapq.heappop(queue)
+            skip(*entry)
+    report()
+    log.info(f"予算付きの検索: 問い合わせ {spent}/{lookup_budget}回, 利益商品 {len(results)}件 (目標 {top_k}件), "
+             f"予算不足で未確認 {skipped}件, 確認前に打ち切った候補 {len(queue) + len(pending)}件")
+
+    if progress:
+        for maker, count in counts.items():
+            if isinstance(count, Exception):
+                progress('maker_done', {'maker': maker, 'count': 0, 'error': str(count)})
+            else:
+                progress('maker_done', {'maker': maker, 'count': count,
+                                        'unanswered': comparison.unanswered.get(maker, 0)})
+    return results
+
+def _compare_all_makers(category_name, filter_keyword, limit, profit_margin, makers, sort, progress, cancel_event,
+                        incremental, cache_stats, recorder):
+    """通常の検索。メーカーごとに価格.comの一覧を取得し、すべての商品を販売先と比較する。"""
+    log = logging.getLogger(__name__)
     all_results = []
-    # 同時に実行する最大スレッド数を5に制限
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+    # 実際の取得はスケジューラのサイト別キューで行われ、同時実行数と速度はそちらで制限される。
+    # ここでは各メーカーの結果待ちと集計を行うスレッドをメーカー数分だけ動かす。
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(makers)), thread_name_prefix='maker') as executor:
         # 各メーカーに対する検索タスクを作成
         future_to_maker = {
-            executor.submit(_search_and_compare_for_maker, category_name, filter_keyword, limit, profit_margin, maker, sort): maker 
+            executor.submit(
+                metrics.bind(_search_and_compare_for_maker), category_name, filter_keyword, limit, profit_margin, maker, sort,
+                cache_stats, progress, cancel_event, recorder, incremental
+            ): maker
             for maker in makers
         }
         # 完了したタスクから結果を取得
         for future in concurrent.futures.as_completed(future_to_maker):
             maker = future_to_maker[future]
+            if cancel_event is not None and cancel_event.is_set():
+                # まだ始まっていないメーカーの処理は取り消す
+                for pending in future_to_maker:
+                    pending.cancel()
+            if future.cancelled():
+                continue
             try:
-                maker_results = future.result()
+                maker_results, unanswered = future.result()
                 all_results.extend(maker_results)
+                if progress:
+                    progress('maker_done', {'maker': maker, 'count': len(maker_results), 'unanswered': unanswered})
             except Exception as exc:
                 log.error(f"メーカー '{maker}' の処理中にエラーが発生しました: {exc}", exc_info=True)
+                if progress:
+                    progress('maker_done', {'maker': maker, 'count': 0, 'error': str(exc)})
+    return all_results
+
+def run_search(category_name, filter_keyword, limit, profit_margin, makers, sort, progress=None, cancel_event=None,
+               incremental=False, timings=None, top_k=None, lookup_budget=None):
+    """
+    指定された条件で並列検索を実行し、結果を返す。
+    progress(イベント種別, データ) を指定すると、メーカーごとの開始・完了と
+    見つかった利益商品を逐次通知する。cancel_event がセットされると途中で打ち切る。
+    観測した価格はすべて価格履歴に記録する。incremental が真なら差分モードで実行する。
+    timings (metrics.SearchTimings) を渡すと、段階ごとの処理時間の内訳をそこに記録する。
+    top_k と lookup_budget を指定すると予算付きの検索になり、見込みの高い商品から販売先に問い合わせて
+    利益商品が top_k 件に達するか、問い合わせが lookup_budget 回に達したら止める
+    (途中経過は progress('budget', {...}) で通知する)。
+    """
+    if timings is None:
+        timings = metrics.SearchTimings(category_name)
+    with metrics.activate(timings):
+        results = _run_search(category_name, filter_keyword, limit, profit_margin, makers, sort, progress,
+                              cancel_event, incremental, top_k, lookup_budget)
+    elapsed = timings.finish()
+    metrics.SEARCHES.inc(category=category_name)
+    metrics.SEARCH_SECONDS.observe(elapsed, category=category_name)
+    logging.getLogger(__name__).info(f"検索完了: {elapsed:.1f}秒")
+    return results
+
+def _run_search(category_name, filter_keyword, limit, profit_margin, makers, sort, progress, cancel_event, incremental,
+                top_k=None, lookup_budget=None):
+    log = logging.getLogger(__name__)
+    log.info(f"検索リクエスト受信: カテゴリ='{category_name}', メーカー='{makers}', 1メーカーあたりの上限='{limit}'")
     
+    cache_stats = {seller.name: amazon_cache.LookupStats(seller.label) for seller in marketplaces.enabled()}
+    recorder = price_history.new_recorder()
+    if top_k and lookup_budget:
+        all_results = _run_budgeted_search(
+            category_name, filter_keyword, limit, profit_margin, makers, sort, progress, cancel_event, incremental,
+            top_k, lookup_budget, cache_stats, recorder
+        )
+    else:
+        all_results = _compare_all_makers(
+            category_name, filter_keyword, limit, profit_margin, makers, sort, progress, cancel_event, incremental,
+            cache_stats, recorder
+        )
+    
+    recorder.flush()
+    for stats in cache_stats.values():
+        log.info(stats.summary())
+    log.info(f"価格履歴に {recorder.recorded} 件の観測値を記録しました。")
+    scheduler.get_scheduler().log_stats()
+    driver_pool.log_stats()
+
     # 利益率の高い順にソート
     sorted_results = sorted(all_results, key=lambda x: x.get('profit_margin', 0), reverse=True)
     return sorted_results
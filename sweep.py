@@ -0,0 +1,259 @@
+# 全カテゴリ・全メーカーの一括検索 (Webサーバーを使わない夜間バッチ)
+#
+# ジョブの指定 (カテゴリ・メーカー・件数・利益率) に従い、(カテゴリ, メーカー) を1単位として
+# search.run_search で検索する。見つかった利益商品は単位ごとにJSONL/CSVへ追記し、
+# 追記が終わった単位はチェックポイントファイルに記録する。中断したジョブを同じ指定で
+# 再実行すると、記録済みの単位を飛ばして続きから検索する。
+#
+# 途中で中断された単位・失敗した単位 (価格.comの取得の失敗、販売価格を確かめられなかった商品がある場合) の
+# 結果は書き出さず、チェックポイントにも記録しない (再開時にやり直し、同じ商品が重複して出力されないようにするため)。
+import csv
+import json
+import logging
+import os
+import threading
+import time
+
+import config
+import maker_catalog
+import scheduler
+import search
+
+# 出力する項目 (CSVの列順)
+OUTPUT_FIELDS = [
+    'category', 'maker', 'name', 'price', 'url', 'sell_marketplace', 'sell_price', 'sell_url',
+    'amazon_price', 'amazon_url', 'price_difference', 'profit_margin',
+]
+
+# ジョブ指定の既定値 (検索フォームの既定値に合わせる)
+DEFAULT_SPEC = {
+    'categories': None,   # None: config.CATEGORY_URL_MAP のすべて
+    'makers': None,       # None: カテゴリのすべてのメーカー / リスト / {カテゴリ: リスト}
+    'limit': 10,
+    'profit_margin': 15,
+    'filter_keyword': None,
+    'sort': 'price_asc',
+    'incremental': False,
+}
+
+
+class SweepError(Exception):
+    """ジョブの指定が不正、またはチェックポイントと指定が食い違う場合の例外"""
+
+
+def load_spec(path: str = None, **overrides) -> dict:
+    """ジョブ指定 (JSONファイル) を読み、None でない overrides で上書きする"""
+    spec = dict(DEFAULT_SPEC)
+    if path:
+        with open(path, encoding='utf-8') as f:
+            loaded = json.load(f)
+        unknown = set(loaded) - set(DEFAULT_SPEC)
+        if unknown:
+            raise SweepError(f"ジョブ指定に不明な項目があります: {', '.join(sorted(unknown))}")
+        spec.update(loaded)
+    spec.update({key: value for key, value in overrides.items() if value is not None})
+
+    categories = spec['categories'] or list(config.CATEGORY_URL_MAP)
+    unknown = [category for category in categories if category not in config.CATEGORY_URL_MAP]
+    if unknown:
+        raise SweepError(f"不明なカテゴリです: {', '.join(unknown)}")
+    spec['categories'] = categories
+    return spec
+
+
+def _makers_for(spec: dict, category: str) -> list:
+    """カテゴリで検索するメーカー。指定が無ければメーカーカタログのすべてのメーカー。"""
+    makers = spec['makers']
+    if isinstance(makers, dict):
+        makers = makers.get(category)
+    if makers:
+        return list(makers)
+    entry = maker_catalog.get_catalog().get(category, timeout=config.MAKER_CATALOG_FETCH_TIMEOUT)
+    if entry is None:
+        logging.getLogger(__name__).warning(f"カテゴリ '{category}' のメーカー一覧を取得できなかったため飛ばします。")
+        return []
+    return list(entry['makers'])
+
+
+class Checkpoint:
+    """
+    完了した (カテゴリ, メーカー) の記録 (JSONL)。
+    1行目にジョブ指定を書き、以降は完了した単位を1行ずつ追記する。
+    """
+
+    def __init__(self, path: str, spec: dict, fresh: bool = False):
+        self.path = path
+        self.done = set()
+        # 再開時に結果の出力先と食い違わないよう、検索条件が同じ場合のみ再開する
+        self._spec_key = {key: spec[key] for key in ('limit', 'profit_margin', 'filter_keyword', 'sort', 'incremental')}
+        if not fresh and os.path.exists(path):
+            self._load()
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'spec': self._spec_key}, ensure_ascii=False) + '\n')
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as f:
+            lines = [line for line in f if line.strip()]
+        if not lines or json.loads(lines[0]).get('spec') != self._spec_key:
+            raise SweepError(
+                f"チェックポイント {self.path} は別の検索条件のものです。最初からやり直す場合は --fresh を指定してください。"
+            )
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 書き込み途中で止まった最終行
+                continue
+            self.done.add((record['category'], record['maker']))
+
+    def is_done(self, category: str, maker: str) -> bool:
+        return (category, maker) in self.done
+
+    def mark_done(self, category: str, maker: str, count: int):
+        with self._lock:
+            self.done.add((category, maker))
+            record = {'category': category, 'maker': maker, 'count': count, 'finished_at': time.time()}
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class ResultWriter:
+    """利益商品を JSONL または CSV に追記する (形式は拡張子で決める)"""
+
+    def __init__(self, path: str, fresh: bool = False):
+        self.path = path
+        self.format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+        self.written = 0
+        write_header = fresh or not os.path.exists(path) or os.path.getsize(path) == 0
+        # Excelで開けるよう、CSVはBOM付きUTF-8にする
+        encoding = 'utf-8-sig' if self.format == 'csv' and write_header else 'utf-8'
+        self._file = open(path, 'w' if fresh else 'a', encoding=encoding, newline='')
+        self._lock = threading.Lock()
+        self._csv = None
+        if self.format == 'csv':
+            self._csv = csv.DictWriter(self._file, fieldnames=OUTPUT_FIELDS, extrasaction='ignore')
+            if write_header:
+                self._csv.writeheader()
+
+    def write_many(self, category: str, maker: str, items: list):
+        with self._lock:
+            for item in items:
+                row = {field: item.get(field) for field in OUTPUT_FIELDS}
+                row.update(category=category, maker=maker)
+                if self._csv is not None:
+                    self._csv.writerow(row)
+                else:
+                    self._file.write(json.dumps(row, ensure_ascii=False) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.written += len(items)
+
+    def close(self):
+        self._file.close()
+
+
+def _sweep_category(spec, category, makers, writer, checkpoint, cancel_event, stats):
+    """1カテゴリ分の未完了メーカーを search.run_search で並行に検索し、メーカーごとに書き出す"""
+    log = logging.getLogger(__name__)
+    found = {maker: [] for maker in makers}
+    lock = threading.Lock()
+
+    def progress(event_type, data):
+        if event_type == 'item':
+            with lock:
+                found[data['maker']].append(data)
+        elif event_type == 'maker_done':
+            maker = data['maker']
+            # 失敗・中断したメーカーは記録せず、次回の実行でやり直す
+            if data.get('error'):
+                log.warning(f"{category} / {maker}: 失敗したため次回やり直します ({data['error']})")
+                stats['failed'] += 1
+                return
+            if cancel_event.is_set():
+                stats['interrupted'] += 1
+                return
+            if data.get('unanswered'):
+                log.warning(f"{category} / {maker}: 販売価格を確かめられなかった商品が {data['unanswered']}件あるため次回やり直します")
+                stats['failed'] += 1
+                return
+            with lock:
+                items = found.pop(maker)
+            writer.write_many(category, maker, items)
+            checkpoint.mark_done(category, maker, len(items))
+            stats['units'] += 1
+            log.info(f"[{stats['units']}/{stats['total']}] {category} / {maker}: 利益商品 {len(items)}件")
+
+    search.run_search(
+        category, spec['filter_keyword'], spec['limit'], spec['profit_margin'], makers, spec['sort'],
+        progress=progress, cancel_event=cancel_event, incremental=spec['incremental'],
+    )
+
+
+def run_sweep(spec: dict, output: str, checkpoint_path: str = None, fresh: bool = False,
+              cancel_event: threading.Event = None) -> dict:
+    """
+    ジョブ指定 spec のすべての (カテゴリ, メーカー) を検索し、結果を output に追記する。
+    checkpoint_path (既定は output + '.checkpoint') に記録済みの単位は飛ばす。
+    戻り値は実行結果の集計 (完了単位数・利益商品数・所要時間など)。
+    """
+    log = logging.getLogger(__name__)
+    cancel_event = cancel_event or threading.Event()
+    checkpoint_path = checkpoint_path or f"{output}.checkpoint"
+    if not fresh and not os.path.exists(checkpoint_path) and os.path.exists(output) and os.path.getsize(output) > 0:
+        # 完了した単位が分からないまま追記すると、すべての単位の結果が重複する
+        raise SweepError(
+            f"出力先 {output} は既にありますが、チェックポイント {checkpoint_path} がありません。"
+            "最初からやり直す場合は --fresh を指定してください。"
+        )
+    checkpoint = Checkpoint(checkpoint_path, spec, fresh=fresh)
+    writer = ResultWriter(output, fresh=fresh)
+    stats = {'units': 0, 'skipped': 0, 'failed': 0, 'interrupted': 0, 'total': 0}
+    before = scheduler.get_scheduler().stats()
+    started = time.monotonic()
+
+    try:
+        plan = []
+        for category in spec['categories']:
+            makers = _makers_for(spec, category)
+            remaining = [maker for maker in makers if not checkpoint.is_done(category, maker)]
+            stats['skipped'] += len(makers) - len(remaining)
+            if remaining:
+                plan.append((category, remaining))
+        stats['total'] = sum(len(makers) for _, makers in plan)
+        log.info(f"一括検索: {len(plan)} カテゴリ、{stats['total']} 単位を検索します (完了済み {stats['skipped']} 単位は飛ばします)。")
+
+        for category, makers in plan:
+            if cancel_event.is_set():
+                break
+            _sweep_category(spec, category, makers, writer, checkpoint, cancel_event, stats)
+    finally:
+        writer.close()
+        checkpoint.close()
+
+    elapsed = time.monotonic() - started
+    after = scheduler.get_scheduler().stats()
+    requests_done = {site: after[site]['completed'] - before.get(site, {}).get('completed', 0) for site in after}
+    stats.update(elapsed=elapsed, results=writer.written, requests=requests_done, cancelled=cancel_event.is_set())
+    return stats
+
+
+def format_summary(stats: dict) -> str:
+    """実行結果の集計 (スループット) を表示用の文字列にする"""
+    minutes = max(stats['elapsed'], 1e-9) / 60
+    lines = [
+        f"所要時間: {stats['elapsed']:.1f}秒{' (中断)' if stats['cancelled'] else ''}",
+        f"完了: {stats['units']}/{stats['total']} 単位 (完了済みで飛ばした単位 {stats['skipped']}, "
+        f"失敗 {stats['failed']}, 中断 {stats['interrupted']})",
+        f"利益商品: {stats['results']}件",
+        f"スループット: {stats['units'] / minutes:.2f} 単位/分, {stats['results'] / minutes:.2f} 件/分",
+    ]
+    for site, count in stats['requests'].items():
+        lines.append(f"  {site}: {count} タスク ({count / minutes:.1f} タスク/分)")
+    return '\n'.join(lines)
@@ -0,0 +1,62 @@
+# amazon_cache: 「見つからなかった」と「取得に失敗した」の区別
+import time
+
+import pytest
+
+import amazon_cache
+from scrapers import ScrapeError, amazon
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = amazon_cache.AmazonCache(str(tmp_path / "amazon_cache.sqlite3"), max_entries=100)
+    yield cache
+    cache.close()
+
+
+def _failing_fetch(model_number, asin=None):
+    raise ScrapeError("timeout")
+
+
+def test_not_found_is_cached_as_miss(cache):
+    assert cache.fetch_and_store("ABC-123", "CPU", lambda model_number, asin=None: None) is None
+    entry, state = cache.get(amazon_cache.normalize_key("ABC-123"), "CPU")
+    assert entry['miss'] and state == 'fresh'
+
+
+def test_failure_is_not_cached(cache):
+    with pytest.raises(ScrapeError):
+        cache.fetch_and_store("ABC-123", "CPU", _failing_fetch)
+    assert cache.get(amazon_cache.normalize_key("ABC-123"), "CPU") == (None, None)
+
+
+def test_failed_revalidation_keeps_the_cached_price(cache, monkeypatch):
+    monkeypatch.setattr(amazon_cache.config, 'AMAZON_CACHE_STALE_WHILE_REVALIDATE', True)
+    key = amazon_cache.normalize_key("ABC-123")
+    cache.put(key, "CPU", {'price': 12000, 'url': 'https://example.com/dp/A'})
+    # 期限切れ (猶予期間内) にする
+    with cache._lock:
+        cache._conn.execute("UPDATE amazon_cache SET fetched_at = ?", (time.time() - 10 * 24 * 3600,))
+    monkeypatch.setattr(amazon_cache.config, 'AMAZON_CACHE_STALE_GRACE', 30 * 24 * 3600)
+
+    result, outcome = cache.lookup_cached("ABC-123", "CPU", _failing_fetch)
+    assert outcome == amazon_cache.STALE and result['price'] == 12000
+    cache._refresh_executor.shutdown(wait=True)
+
+    entry, _ = cache.get(key, "CPU")
+    assert not entry['miss'] and entry['price'] == 12000
+
+
+def test_scrape_product_raises_after_all_attempts_fail(monkeypatch):
+    def broken_page(*args):
+        raise TimeoutError("page did not load")
+
+    monkeypatch.setattr(amazon, '_load_page', broken_page)
+    with pytest.raises(ScrapeError):
+        amazon.scrape_product("ABC-123")
+
+
+def test_scrape_product_returns_none_for_an_empty_result_page(monkeypatch):
+    monkeypatch.setattr(amazon, '_load_page', lambda *args: "<html></html>")
+    monkeypatch.setattr(amazon, '_parse_search_results', lambda html, name: (False, None))
+    assert amazon.scrape_product("ABC-123") is None
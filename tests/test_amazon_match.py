@@ -0,0 +1,49 @@
+# amazon: 検索結果の商品名と型番の照合 (短い型番が上位・派生モデルに一致しないこと)
+import pytest
+
+from scrapers import amazon
+
+
+@pytest.mark.parametrize("product_name, title, expected", [
+    ("A7", "Sony α7 A7S III ボディ", None),
+    ("A7", "Sony A7S III ボディ", None),
+    ("RX 7600", "ASRock Radeon RX 7600 XT Challenger 16GB", amazon._VARIANT),
+    ("RX 7600", "ASRock Radeon RX 7600 Challenger 8GB", amazon._EXACT),
+    ("RX7600", "ASRock Radeon RX 7600 8GB", amazon._EXACT),
+    ("B760M-HDV/M.2 D4", "ASRock B760M-HDV/M.2 D4 【Micro ATX】", amazon._EXACT),
+    ("B650M", "ASRock B650M Pro RS WiFi", amazon._VARIANT),
+    # 型番の後ろの英字1文字 (色・サイズなど) は派生モデルではない
+    ("B760M-A D4", "ASUS PRIME B760M-A D4 W ホワイト", amazon._EXACT),
+    ("MX Master 3S", "Logicool MX Master 3S M グラファイト", amazon._EXACT),
+])
+def test_model_match(product_name, title, expected):
+    assert amazon._model_match(product_name, title) == expected
+
+
+def test_short_model_number_does_not_match_longer_one():
+    assert amazon._score_candidate("A7", "Sony A7S III ボディ", False) < amazon.config.AMAZON_MATCH_MIN_SCORE
+    assert amazon._score_candidate("RX 7600", "Radeon RX 7600 XT 16GB", False) < amazon.config.AMAZON_MATCH_MIN_SCORE
+
+
+def test_exact_model_is_preferred_over_variant_listed_first(monkeypatch):
+    cards = [
+        ("B0VARIANT", "ASRock Radeon RX 7600 XT Challenger 16GB", "￥52,800", "/dp/B0VARIANT", False),
+        ("B0EXACT00", "ASRock Radeon RX 7600 Challenger 8GB", "￥39,800", "/dp/B0EXACT00", False),
+    ]
+    monkeypatch.setattr(amazon, '_extract_result_cards', lambda html_content: cards)
+    found, result = amazon._parse_search_results("<html></html>", "RX 7600")
+    assert found
+    assert result['asin'] == "B0EXACT00" and result['price'] == 39800
+
+
+def test_only_variant_in_results_is_not_a_match(monkeypatch):
+    cards = [("B0VARIANT", "Radeon RX 7600 XT 16GB", "￥52,800", "/dp/B0VARIANT", False)]
+    monkeypatch.setattr(amazon, '_extract_result_cards', lambda html_content: cards)
+    assert amazon._parse_search_results("<html></html>", "RX 7600") == (True, None)
+
+
+def test_single_letter_after_model_number_is_a_match(monkeypatch):
+    cards = [("B0WHITE00", "ASUS PRIME B760M-A D4 W ホワイト", "￥18,980", "/dp/B0WHITE00", False)]
+    monkeypatch.setattr(amazon, '_extract_result_cards', lambda html_content: cards)
+    found, result = amazon._parse_search_results("<html></html>", "B760M-A D4")
+    assert found and result['asin'] == "B0WHITE00"
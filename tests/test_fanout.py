@@ -0,0 +1,52 @@
+# marketplaces.fanout: 販売先への問い合わせの試行がすべて失敗・取り消しになった場合
+import concurrent.futures
+
+from marketplaces import fanout
+
+
+class _FakeMarketplace:
+    name = 'fake'
+    label = 'テスト販売先'
+    site = 'fake'
+    deadline = 10.0
+    hedge_after = None
+
+    def lookup(self, keyword, category):
+        raise AssertionError("スケジューラを通さずに呼ばれました")
+
+
+class _FakeScheduler:
+    """投入された取得を実行せず、outcome に従って終わらせた Future を返す"""
+
+    def __init__(self, outcome):
+        self.outcome = outcome
+
+    def submit_with_priority(self, site, priority, fn):
+        future = concurrent.futures.Future()
+        if self.outcome == 'cancelled':
+            future.cancel()
+        else:
+            future.set_exception(RuntimeError("amazon worker error"))
+        return future
+
+    def stats(self):
+        return {}
+
+
+def _run(outcome):
+    fan_out = fanout.FanOut(crawl_scheduler=_FakeScheduler(outcome))
+    fan_out.submit('item-1', _FakeMarketplace(), 'ABC-123', 'CPU')
+    return list(fan_out.results()), fan_out
+
+
+def test_all_attempts_cancelled_is_reported_as_error(caplog):
+    results, fan_out = _run('cancelled')
+    assert [(key, result, outcome) for key, _, result, outcome in results] == [('item-1', None, fanout.ERROR)]
+    assert not fan_out.pending('item-1')
+    assert 'cancelled' in caplog.text
+
+
+def test_all_attempts_failed_is_reported_as_error(caplog):
+    results, _ = _run('failed')
+    assert [outcome for _, _, _, outcome in results] == [fanout.ERROR]
+    assert 'amazon worker error' in caplog.text
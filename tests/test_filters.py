@@ -0,0 +1,55 @@
+# filters: コンパイルした絞り込みの規則が、従来の除外キーワードの判定と同じ商品を除くこと
+import os
+import re
+
+import pytest
+
+import filters
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KEYWORDS = ["OEM", "限定", "ドスパラ限定", "BOX"]
+NAMES = [
+    "Core i7 14700K BOX", "Core i7 14700K box", "Ryzen 5 5600 OEM", "Ryzen 5 5600 oem版", "Ryzen 5 5600 Oem",
+    "B760M-HDV/M.2 D4 ドスパラ限定モデル", "PRO B650M-A WIFI", "RTX4060 Boxed",
+]
+
+
+def _legacy_excluded(name):
+    """規則のコンパイル前の kakaku._rows_to_products の判定"""
+    return any(keyword in name for keyword in KEYWORDS)
+
+
+def _fixture_names():
+    with open(os.path.join(REPO_ROOT, "last_page.html"), encoding="utf-8", errors="replace") as f:
+        html = f.read()
+    return re.findall(r'<td class="textL">.*?<a href="/item/[^"]+/">([^<]+)</a>', html, re.S)
+
+
+def _matcher(**rules):
+    return filters.RuleSet([], {filters.ALL_CATEGORIES: dict(filters._empty_rules(), **rules)}).matcher()
+
+
+@pytest.mark.parametrize("name", NAMES + _fixture_names())
+def test_exclude_keywords_match_like_before(name):
+    matcher = _matcher(exclude=list(KEYWORDS))
+    assert matcher.accepts(name, 10000) == (not _legacy_excluded(name))
+
+
+def test_regex_rules_are_case_sensitive_unless_they_opt_in():
+    assert _matcher(exclude_re=[r"\bOEM\b"]).accepts("Ryzen 5 5600 oem", 10000)
+    matcher = _matcher(exclude_re=[r"(?i)\bOEM\b"], exclude=["限定"])
+    assert not matcher.accepts("Ryzen 5 5600 oem", 10000)
+    assert not matcher.accepts("B760M 限定", 10000)
+    assert matcher.accepts("Ryzen 5 5600 BOX", 10000)
+
+
+def test_rules_file_accepts_opt_in_flag():
+    rules = filters.parse_rules(["exclude_re: (?i)bulk|バルク"], "rules.txt")
+    matcher = filters.RuleSet([], rules).matcher()
+    assert not matcher.accepts("Core i5 12400F Bulk", 10000)
+    assert matcher.accepts("Core i5 12400F BOX", 10000)
+
+
+def test_filter_keyword_is_still_case_insensitive():
+    row_filter = filters.RowFilter(_matcher(), "ryzen")
+    assert row_filter.accepts("Ryzen 7 5700X BOX", 10000)
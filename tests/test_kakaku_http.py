@@ -0,0 +1,55 @@
+# kakaku: URLを組み立てて取得した結果ページに、指定した検索条件が反映されているかの確認
+import logging
+import os
+
+import pytest
+
+from benchmarks import fake_sites
+from scrapers import extract, kakaku
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _fixture(name):
+    with open(os.path.join(REPO_ROOT, name), 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("name", ["last_page.html", "error_page_final.html"])
+def test_conditions_of_saved_result_pages(name):
+    # 保存済みのページは条件を指定しない検索の1ページ目 (select は先頭の option が送信される)
+    assert extract.kakaku_search_conditions(_fixture(name)) == {'LstMaker': '', 'Sort': 'price_asc', 'Page': 1}
+
+
+def test_selected_options_are_read():
+    html = _fixture("last_page.html").decode('utf-8', errors='replace')
+    html = fake_sites._select_option(html, 'LstMaker', '586')
+    html = fake_sites._select_option(html, 'Sort', 'price_desc')
+    assert extract.kakaku_search_conditions(html) == {'LstMaker': '586', 'Sort': 'price_desc', 'Page': 1}
+
+
+@pytest.mark.parametrize("maker_id, sort, page", [('586', None, 1), (None, 'price_desc', 1), (None, None, 2)])
+def test_unfiltered_page_does_not_satisfy_request(maker_id, sort, page):
+    """パラメータが無視されて絞り込まれていないページが返った場合は、読まずにブラウザに切り替える"""
+    with pytest.raises(kakaku._ConditionMismatch):
+        kakaku._check_conditions(_fixture("last_page.html"), maker_id, sort, page)
+
+
+def test_page_without_search_form_is_not_trusted():
+    with pytest.raises(kakaku._ConditionMismatch):
+        kakaku._check_conditions(b"<html><body><div id='spec_result'></div></body></html>", None, None, 1)
+
+
+def test_matching_page_is_accepted():
+    kakaku._check_conditions(_fixture("last_page.html"), None, 'price_asc', 1)
+
+
+def test_http_fetch_reads_pages_that_reflect_the_request(monkeypatch):
+    monkeypatch.setattr(kakaku.config, 'KAKAKU_REQUEST_INTERVAL', 0.0)
+    monkeypatch.setitem(kakaku._maker_id_cache, 'テスト', {'ASRock': '586'})
+    with fake_sites.FakeSites(pages=3) as sites:
+        url = sites.spec_search_url()
+        results = kakaku._scrape_via_http(logging.getLogger(__name__), 'テスト', url, None, 80, 'ASRock', 'price_desc')
+    assert 60 <= len(results) <= 80
+    assert all('-586' in item['name'] for item in results)
+    assert any(' P3-586' in item['name'] for item in results)
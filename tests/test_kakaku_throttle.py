@@ -0,0 +1,41 @@
+# kakaku: 同時接続数の枠を待っているコルーチンが中止されても、枠が失われないこと
+import asyncio
+
+from scrapers import kakaku
+
+
+def test_cancelled_async_waiter_does_not_leak_the_slot():
+    throttle = kakaku._HostThrottle(max_concurrency=1, interval=0.0)
+
+    async def scenario():
+        async def wait_for_slot():
+            async with throttle:
+                raise AssertionError("中止されたコルーチンが枠を取りました")
+
+        throttle.__enter__()  # 別の検索が枠を使っている
+        waiter = asyncio.create_task(wait_for_slot())
+        await asyncio.sleep(0.1)
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        # 中止の後で枠が空き、待機していたスレッドが枠を取る
+        throttle.__exit__(None, None, None)
+
+    asyncio.run(scenario())
+    # 待機していたスレッドが取った枠を返していれば、もう一度取れる
+    assert throttle._semaphore.acquire(timeout=2.0)
+    throttle._semaphore.release()
+
+
+def test_async_slot_is_released_after_use():
+    throttle = kakaku._HostThrottle(max_concurrency=1, interval=0.0)
+
+    async def scenario():
+        for _ in range(3):
+            async with throttle:
+                pass
+
+    asyncio.run(asyncio.wait_for(scenario(), timeout=2.0))
+    assert throttle._semaphore.acquire(blocking=False)
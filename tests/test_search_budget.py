@@ -0,0 +1,118 @@
+# search: 予算付きの検索で、予算が足りず問い合わせなかった商品も未確認として判定し、問い合わせを残さないこと
+import concurrent.futures
+
+import pytest
+
+import price_history
+import search
+from marketplaces import fanout
+
+
+class _FakeSeller:
+    deadline = 10.0
+    hedge_after = None
+
+    def __init__(self, name, cached=None):
+        self.name = name
+        self.label = name.upper()
+        self.site = name
+        self.history_source = name
+        self.cached = cached or {}
+        self.looked_up = []
+
+    def lookup_cached(self, keyword, category):
+        if keyword in self.cached:
+            return self.cached[keyword], 'hit'
+        return None
+
+    def lookup(self, keyword, category):
+        self.looked_up.append(keyword)
+        return {'price': 20000, 'url': f"https://example.com/{self.name}/{keyword}"}
+
+    def search_url(self, keyword):
+        return f"https://example.com/{self.name}/search?k={keyword}"
+
+
+class _ImmediateScheduler:
+    """投入された取得をその場で実行する"""
+
+    def submit_with_priority(self, site, priority, fn):
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+        future.set_result(fn())
+        return future
+
+    def stats(self):
+        return {}
+
+
+@pytest.fixture
+def sellers(monkeypatch, tmp_path):
+    # ITEM-2 は A の価格がキャッシュにあるため、問い合わせは B の1回で済む
+    sellers = [_FakeSeller('a', cached={'ITEM-2': {'price': 10000, 'url': 'https://example.com/a/ITEM-2'}}),
+               _FakeSeller('b')]
+    items = [{'name': f"ITEM-{index}", 'price': 10000, 'url': f"https://kakaku.example/{index}"} for index in range(3)]
+    monkeypatch.setattr(search.marketplaces, 'enabled', lambda: sellers)
+    monkeypatch.setattr(search, '_fetch_kakaku', lambda category, keyword, limit, maker, sort: [dict(i) for i in items])
+    monkeypatch.setattr(search.normalize, 'search_keyword', lambda name, category: name)
+    monkeypatch.setattr(fanout.scheduler, 'get_scheduler', lambda: _ImmediateScheduler())
+    history = price_history.PriceHistory(str(tmp_path / "history.sqlite3"))
+    monkeypatch.setattr(price_history, 'get_history', lambda: history)
+    return sellers
+
+
+def test_items_skipped_for_budget_are_reported_as_unanswered(sellers):
+    events = []
+    found = []
+
+    def progress(event_type, data):
+        events.append((event_type, data))
+        if event_type == 'item':
+            found.append(data['name'])
+
+    # ITEM-0 に2回使うと、ITEM-1 (2回必要) は予算に収まらず、ITEM-2 (1回) は収まる
+    results = search._run_budgeted_search('CPU', None, 10, 15, ['maker'], None, progress, None, False,
+                                          top_k=10, lookup_budget=3, cache_stats=None, recorder=None)
+
+    assert sorted(item['name'] for item in results) == ['ITEM-0', 'ITEM-2']
+    assert sellers[0].looked_up == ['ITEM-0'] and sellers[1].looked_up == ['ITEM-0', 'ITEM-2']
+    skipped = [data for event_type, data in events if event_type == 'budget'][-1]
+    assert skipped['spent'] == 3 and skipped['skipped'] == 1
+    assert 'ITEM-1' not in found
+
+
+def test_candidates_left_when_budget_runs_out_are_judged(sellers, monkeypatch):
+    judged = []
+    original = search._Comparison.evaluate
+
+    def evaluate(self, item, search_keyword, answers, unanswered, maker):
+        judged.append((item['name'], sorted(unanswered)))
+        return original(self, item, search_keyword, answers, unanswered, maker)
+
+    monkeypatch.setattr(search._Comparison, 'evaluate', evaluate)
+    # ITEM-0 で予算を使い切り、残りの候補は問い合わせなかった販売先を未確認として判定される
+    search._run_budgeted_search('CPU', None, 10, 15, ['maker'], None, None, None, False,
+                                top_k=10, lookup_budget=2, cache_stats=None, recorder=None)
+    assert sorted(judged) == [('ITEM-0', []), ('ITEM-1', ['A', 'B']), ('ITEM-2', ['B'])]
+
+
+def test_close_abandons_lookups_that_do_not_finish():
+    class _StuckScheduler:
+        def __init__(self):
+            self.futures = []
+
+        def submit_with_priority(self, site, priority, fn):
+            future = concurrent.futures.Future()
+            self.futures.append(future)
+            return future
+
+    stuck = _StuckScheduler()
+    lookups = fanout.FanOut(crawl_scheduler=stuck)
+    seller = _FakeSeller('a')
+    lookups.submit(0, seller, 'ITEM-0', 'CPU')
+    lookups.submit(1, seller, 'ITEM-1', 'CPU')
+    stuck.futures[0].set_running_or_notify_cancel()  # 実行中 (取り消せない)
+
+    assert lookups.close(timeout=0.1) == 1
+    assert stuck.futures[1].cancelled()
+    assert not lookups.pending(0) and not lookups.pending(1)
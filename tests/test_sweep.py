@@ -0,0 +1,127 @@
+# sweep: 中断した一括検索を再開しても、同じ商品が重複して出力されないこと
+import json
+import threading
+
+import pytest
+
+import config
+import price_history
+import search
+import sweep
+from scrapers import ScrapeError, kakaku
+
+CATEGORY = next(iter(config.CATEGORY_URL_MAP))
+
+
+@pytest.fixture
+def searched(monkeypatch):
+    """search.run_search の代わりに、メーカーごとに2件ずつ見つかったことにする"""
+    calls = []
+
+    def fake_run_search(category, filter_keyword, limit, profit_margin, makers, sort,
+                        progress=None, cancel_event=None, incremental=False):
+        calls.append(list(makers))
+        for maker in makers:
+            for index in range(2):
+                progress('item', {'maker': maker, 'name': f"{maker}-{index}", 'price': 1000})
+            progress('maker_done', {'maker': maker})
+            if maker == stop_after.get('maker'):
+                # このメーカーの完了直後に中断された (以降のメーカーは途中までしか検索できていない)
+                cancel_event.set()
+
+    stop_after = {}
+    monkeypatch.setattr(search, 'run_search', fake_run_search)
+    return calls, stop_after
+
+
+def _read(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_resume_skips_finished_units_without_duplicates(tmp_path, searched):
+    calls, stop_after = searched
+    spec = sweep.load_spec(categories=[CATEGORY], makers=['A', 'B', 'C'])
+    output = str(tmp_path / "results.jsonl")
+
+    stop_after['maker'] = 'A'
+    first = sweep.run_sweep(spec, output, cancel_event=threading.Event())
+    assert first['cancelled'] and first['units'] == 1 and first['interrupted'] == 2
+    assert [row['name'] for row in _read(output)] == ['A-0', 'A-1']
+
+    stop_after.clear()
+    second = sweep.run_sweep(spec, output)
+    assert calls[-1] == ['B', 'C']
+    assert second['skipped'] == 1 and second['units'] == 2
+
+    names = [row['name'] for row in _read(output)]
+    assert sorted(names) == ['A-0', 'A-1', 'B-0', 'B-1', 'C-0', 'C-1']
+
+
+def test_resume_with_different_conditions_is_rejected(tmp_path, searched):
+    output = str(tmp_path / "results.jsonl")
+    sweep.run_sweep(sweep.load_spec(categories=[CATEGORY], makers=['A']), output)
+    with pytest.raises(sweep.SweepError):
+        sweep.run_sweep(sweep.load_spec(categories=[CATEGORY], makers=['A'], profit_margin=30), output)
+
+
+def test_failed_scrape_is_retried_on_resume(tmp_path, monkeypatch):
+    """価格.comの取得に失敗したメーカーは「利益商品 0件」として記録せず、次回やり直す"""
+    history = price_history.PriceHistory(str(tmp_path / "history.sqlite3"))
+    monkeypatch.setattr(price_history, 'get_history', lambda: history)
+    fetched = []
+    broken = {'B'}
+
+    def fake_fetch(category, filter_keyword, limit, maker, sort):
+        fetched.append(maker)
+        if maker in broken:
+            raise ScrapeError("ブラウザが落ちました")
+        return []
+
+    monkeypatch.setattr(search, '_fetch_kakaku', fake_fetch)
+    spec = sweep.load_spec(categories=[CATEGORY], makers=['A', 'B'])
+    output = str(tmp_path / "results.jsonl")
+
+    first = sweep.run_sweep(spec, output)
+    assert first['units'] == 1 and first['failed'] == 1
+
+    broken.clear()
+    fetched.clear()
+    second = sweep.run_sweep(spec, output)
+    assert fetched == ['B']
+    assert second['skipped'] == 1 and second['units'] == 1 and second['failed'] == 0
+
+
+def test_browser_failure_raises_instead_of_returning_no_products(monkeypatch):
+    class _BrokenPool:
+        def lease(self):
+            raise RuntimeError("chrome not reachable")
+
+    monkeypatch.setattr(kakaku.config, 'KAKAKU_FETCH_MODE', 'selenium')
+    monkeypatch.setattr(kakaku.config, 'SCRAPER_ENGINE', 'selenium')
+    monkeypatch.setattr(kakaku.driver_pool, 'get_pool', lambda: _BrokenPool())
+    with pytest.raises(ScrapeError):
+        kakaku.scrape_products(CATEGORY, maker='A')
+
+
+def test_unit_with_unanswered_lookups_is_not_checkpointed(tmp_path, monkeypatch):
+    def fake_run_search(category, filter_keyword, limit, profit_margin, makers, sort,
+                        progress=None, cancel_event=None, incremental=False):
+        for maker in makers:
+            progress('item', {'maker': maker, 'name': f"{maker}-0", 'price': 1000})
+            progress('maker_done', {'maker': maker, 'count': 1, 'unanswered': 1 if maker == 'B' else 0})
+
+    monkeypatch.setattr(search, 'run_search', fake_run_search)
+    output = str(tmp_path / "results.jsonl")
+    stats = sweep.run_sweep(sweep.load_spec(categories=[CATEGORY], makers=['A', 'B']), output)
+    assert stats['units'] == 1 and stats['failed'] == 1
+    assert [row['name'] for row in _read(output)] == ['A-0']
+
+
+def test_existing_output_without_checkpoint_is_not_appended(tmp_path, searched):
+    output = tmp_path / "results.jsonl"
+    sweep.run_sweep(sweep.load_spec(categories=[CATEGORY], makers=['A']), str(output))
+    (tmp_path / "results.jsonl.checkpoint").unlink()
+    with pytest.raises(sweep.SweepError):
+        sweep.run_sweep(sweep.load_spec(categories=[CATEGORY], makers=['A']), str(output))
+    assert len(_read(str(output))) == 2
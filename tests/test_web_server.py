@@ -0,0 +1,73 @@
+# web_server: 検索ジョブのAPIの入力チェック
+import pytest
+
+import web_server
+
+
+class _FakeJob:
+    id = 'job1'
+
+    def to_dict(self):
+        return {'job_id': self.id, 'status': 'queued'}
+
+
+class _FakeManager:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, params):
+        self.submitted.append(params)
+        return _FakeJob()
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    manager = _FakeManager()
+    monkeypatch.setattr(web_server.jobs, 'get_manager', lambda: manager)
+    return manager
+
+
+@pytest.fixture
+def client():
+    return web_server.app.test_client()
+
+
+FORM = {'category_keyword': 'CPU', 'makers': ['AMD'], 'limit': '10', 'profit_margin': '15'}
+
+
+@pytest.mark.parametrize('field, value', [
+    ('limit', ''), ('limit', 'abc'), ('limit', '0'), ('limit', '51'), ('profit_margin', ''),
+    ('profit_margin', '1.5'), ('top_k', 'x'), ('lookup_budget', '0'),
+])
+def test_invalid_numbers_are_rejected_with_400(client, manager, field, value):
+    response = client.post('/api/jobs', data=dict(FORM, **{field: value}))
+    assert response.status_code == 400
+    assert response.get_json()['error']
+    assert manager.submitted == []
+
+
+def test_optional_fields_may_be_blank(client, manager):
+    response = client.post('/api/jobs', data=dict(FORM, top_k='', lookup_budget=''))
+    assert response.status_code == 202
+    params = manager.submitted[0]
+    assert (params['limit'], params['profit_margin'], params['top_k'], params['lookup_budget']) == (10, 15, None, None)
+
+
+def test_missing_numbers_use_the_form_defaults(client, manager):
+    response = client.post('/api/jobs', data={'category_keyword': 'CPU', 'makers': ['AMD']})
+    assert response.status_code == 202
+    assert (manager.submitted[0]['limit'], manager.submitted[0]['profit_margin']) == (10, 15)
+
+
+def test_invalid_form_post_does_not_start_a_job(client, manager):
+    response = client.post('/', data=dict(FORM, limit=''))
+    assert response.status_code == 302
+    assert manager.submitted == []
+
+
+def test_invalid_form_post_shows_the_reason(client, manager):
+    response = client.post('/', data=dict(FORM, limit='51'), follow_redirects=True)
+    assert response.status_code == 200
+    assert '比較件数は 1〜50 の範囲で入力してください。' in response.get_data(as_text=True)
+    # 表示は1回だけ (再読み込みでは消える)
+    assert 'alert-danger' not in client.get('/').get_data(as_text=True)
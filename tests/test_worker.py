@@ -0,0 +1,68 @@
+# worker / wsgi: メーカー一覧の取り直しは Webの層の読み込み時ではなく、ワーカーの起動時に1回だけ登録する
+import importlib
+import sys
+import time
+
+import pytest
+
+import maker_catalog
+
+
+class _FakeCatalog:
+    def __init__(self):
+        self.refreshed = []
+
+    def refresh_stale(self, categories):
+        self.refreshed.append(list(categories))
+        return []
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    # worker は読み込み時に JOB_BACKEND を書き換えるため、テストの後で元に戻す
+    monkeypatch.setenv('JOB_BACKEND', 'thread')
+    catalog = _FakeCatalog()
+    monkeypatch.setattr(maker_catalog, 'get_catalog', lambda: catalog)
+    return catalog
+
+
+def test_importing_wsgi_enqueues_nothing(catalog, monkeypatch):
+    monkeypatch.delitem(sys.modules, 'wsgi', raising=False)
+    importlib.import_module('wsgi')
+    assert catalog.refreshed == []
+
+
+@pytest.mark.parametrize("preload, expected", [(True, 1), (False, 0)])
+def test_supervisor_preloads_catalog_once(catalog, monkeypatch, tmp_path, preload, expected):
+    import job_queue
+    import worker
+
+    monkeypatch.setattr(job_queue, 'get_queue', lambda: job_queue.JobQueue(str(tmp_path / "jobs.sqlite3")))
+    supervisor = worker.Supervisor(2, 0, preload=preload)
+    monkeypatch.setattr(supervisor, '_start', lambda index: None)
+    supervisor.stop()
+    assert supervisor.run() == 0
+    assert len(catalog.refreshed) == expected
+
+
+def test_long_catalog_refresh_keeps_its_heartbeat(catalog, monkeypatch, tmp_path):
+    """生存の期限より長くかかるメーカー一覧の取り直しも、監視プロセスに失敗とされない"""
+    import job_queue
+    import worker
+
+    queue = job_queue.JobQueue(str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(worker.config, 'WORKER_HEARTBEAT_INTERVAL', 0.05)
+    swept = []
+
+    def refresh_now(category):
+        time.sleep(0.4)
+        # 監視プロセスの見回り (生存の期限を 0.2 秒とする)
+        swept.extend(queue.fail_running("応答なし", heartbeat_before=time.time() - 0.2))
+        return {'makers': ['A']}
+
+    catalog.refresh_now = refresh_now
+    job_id = queue.enqueue(job_queue.MAKER_CATALOG, {'category': 'CPU'})
+    row = queue.claim('test-worker')
+    worker._run_catalog_job(queue, row)
+    assert swept == []
+    assert queue.get(job_id)['status'] == job_queue.DONE
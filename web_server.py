@@ -1,10 +1,13 @@
-from flask import Flask, render_template, request, session, redirect, url_for
+from flask import Flask, Response, render_template, request, session, redirect, url_for, jsonify, abort, flash
 import logging
 import threading
 import json
+from datetime import datetime, timezone
 import config
-import search
-from scrapers import kakaku
+import jobs
+import maker_catalog
+import metrics
+import result_store
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(threadName)s: %(message)s')
 
@@ -12,81 +15,229 @@ app = Flask(__name__)
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 app.secret_key = config.SECRET_KEY
 
-# --- メーカーリストのキャッシュ ---
-MAKER_LIST_CACHE = {}
+class FormError(ValueError):
+    """検索フォームの入力の誤り (メッセージはそのまま利用者に表示する)"""
+
+
+def _int_field(form, name: str, label: str, default=None, minimum: int = 0, maximum: int = None):
+    """
+    フォームの整数の項目を読む。項目が無い場合は default、空欄の場合は default が None なら None
+    (任意の項目)、そうでなければ誤りとする。
+    """
+    raw = form.get(name)
+    if raw is None:
+        return default
+    raw = raw.strip()
+    if not raw and default is None:
+        return None
+    try:
+        value = int(raw)
+    except ValueError:
+        raise FormError(f"{label}には整数を入力してください。") from None
+    if maximum is not None and not minimum <= value <= maximum:
+        raise FormError(f"{label}は {minimum}〜{maximum} の範囲で入力してください。")
+    if value < minimum:
+        raise FormError(f"{label}は {minimum} 以上で入力してください。")
+    return value
+
+
+def _search_params_from_form(form) -> dict:
+    """検索フォームの入力を search.run_search の引数に変換する (入力に誤りがあれば FormError)"""
+    return {
+        'category_name': form.get('category_keyword', ''),
+        'filter_keyword': form.get('filter_keyword', ''),
+        'limit': _int_field(form, 'limit', '比較件数', default=10, minimum=1, maximum=50),
+        'profit_margin': _int_field(form, 'profit_margin', '利益率', default=15),
+        'makers': form.getlist('makers'),
+        'sort': form.get('sort', 'price_asc'),
+        'incremental': form.get('incremental') == '1',
+        # 両方を指定すると予算付きの検索になる (空欄なら通常の検索)
+        'top_k': _int_field(form, 'top_k', '目標件数', minimum=1),
+        'lookup_budget': _int_field(form, 'lookup_budget', '照合の予算', minimum=1),
+    }
+
+
+def _result_query_from_args(args) -> dict:
+    """結果一覧のページ・並び順・絞り込みの指定をクエリ文字列から読み取る"""
+    min_margin = args.get('min_margin', type=float)
+    return {
+        'page': args.get('page', 1, type=int),
+        'sort': args.get('sort', 'profit_margin'),
+        'order': args.get('order', 'desc'),
+        'keyword': args.get('q', '').strip() or None,
+        'min_margin': min_margin,
+    }
 
-def preload_maker_lists():
-    """主要カテゴリのメーカーリストをバックグラウンドで事前に読み込む"""
-    logging.info("メーカーリストの事前読み込みを開始...")
-    for category in config.PRELOAD_CATEGORIES:
-        if category not in MAKER_LIST_CACHE:
-            # 正しい関数を呼び出すように修正
-            makers = kakaku.get_makers(category)
-            if makers:
-                MAKER_LIST_CACHE[category] = makers
-    logging.info("メーカーリストの事前読み込みが完了。")
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
-        # フォームデータをセッションに保存
-        session['form_data'] = request.form
-        
-        # searchモジュールに関数を移譲
-        category_name = request.form.get('category_keyword', '')
-        filter_keyword = request.form.get('filter_keyword', '')
-        limit = int(request.form.get('limit', 10))
-        profit_margin = int(request.form.get('profit_margin', 15))
-        selected_makers = request.form.getlist('makers')
-        selected_sort = request.form.get('sort', 'price_asc')
-        
-        results = []
-        if category_name and selected_makers:
-            results = search.run_search(
-                category_name, 
-                filter_keyword, 
-                limit, 
-                profit_margin, 
-                selected_makers, 
-                selected_sort
-            )
-        
-        # 検索結果をセッションに保存
-        session['results'] = results
+        # 検索はバックグラウンドのジョブとして実行し、ジョブIDだけをセッションに残す
+        try:
+            params = _search_params_from_form(request.form)
+        except FormError as e:
+            # 入力欄のチェックを通らない値が送られた場合も、理由を表示して検索しない
+            flash(str(e), 'danger')
+            return redirect(url_for('index'))
+        session.pop('job_id', None)
+        session.pop('result_id', None)
+        if params['category_name'] and params['makers']:
+            session['job_id'] = jobs.get_manager().submit(params).id
         
         # PRGパターン: POST後にリダイレクト
         return redirect(url_for('index'))
 
     # GETリクエストの処理
-    form_data = session.pop('form_data', {})
-    results = session.pop('results', [])
-    
-    # テンプレートに渡す変数を設定
-    category_name = form_data.get('category_keyword', '')
-    filter_keyword = form_data.get('filter_keyword', '')
-    limit = int(form_data.get('limit', 10))
-    profit_margin = int(form_data.get('profit_margin', 15))
-    selected_makers = form_data.getlist('makers') if hasattr(form_data, 'getlist') else form_data.get('makers', [])
-    selected_sort = form_data.get('sort', 'price_asc')
-
-    makers_by_category_json = json.dumps(MAKER_LIST_CACHE)
+    job = None
+    job_id = session.get('job_id')
+    if job_id:
+        job = jobs.get_manager().get(job_id)
+        if job is None or job.finished:
+            # 終了したジョブの結果は結果IDで参照する
+            session.pop('job_id', None)
+            if job and job.result_id:
+                session['result_id'] = job.result_id
+            job = None
+
+    # 結果IDはセッション (リロード時) かクエリ文字列 (ページ送り・共有URL) から受け取る
+    if request.args.get('result'):
+        session['result_id'] = request.args['result']
+    result_id = session.get('result_id')
+    result_page = None
+    if result_id:
+        result_page = result_store.get_store().query(result_id, **_result_query_from_args(request.args))
+        if result_page is None:
+            session.pop('result_id', None)
+
+    # フォームには実行中のジョブ、または表示中の結果の検索条件を復元する
+    params = job.params if job else (result_page['meta'] if result_page else {})
 
     return render_template(
         'index.html', 
-        results=results, 
-        category_name=category_name, 
-        filter_keyword=filter_keyword,
-        limit=limit,
-        profit_margin=profit_margin,
-        selected_makers=selected_makers,
-        selected_sort=selected_sort,
+        results=result_page['items'] if result_page else [],
+        result_page=result_page,
+        result_query=request.args.to_dict(),
+        active_job_id=job.id if job else None,
+        searched=result_page is not None,
+        category_name=params.get('category_name', ''),
+        filter_keyword=params.get('filter_keyword', ''),
+        limit=params.get('limit', 10),
+        profit_margin=params.get('profit_margin', 15),
+        selected_makers=params.get('makers', []),
+        selected_sort=params.get('sort', 'price_asc'),
+        incremental=params.get('incremental', False),
+        top_k=params.get('top_k'),
+        lookup_budget=params.get('lookup_budget'),
+        timings=result_page['meta'].get('timings') if result_page and config.SHOW_SEARCH_TIMINGS else None,
+        stage_labels=metrics.STAGE_LABELS,
         pc_parts_categories=config.PC_PARTS_CATEGORIES,
         peripherals_categories=config.PERIPHERALS_CATEGORIES,
-        makers_by_category_json=makers_by_category_json
     )
 
+
+@app.route('/api/makers/<category>')
+def get_makers(category):
+    """カテゴリのメーカー一覧 (ブラウザは ETag / Last-Modified で再検証する)"""
+    if category not in config.CATEGORY_URL_MAP:
+        abort(404)
+    entry = maker_catalog.get_catalog().get(category, timeout=config.MAKER_CATALOG_FETCH_TIMEOUT)
+    if entry is None:
+        return jsonify({'error': 'メーカー一覧を取得できませんでした。'}), 503
+
+    response = jsonify({'category': category, 'makers': entry['makers'], 'fetched_at': entry['fetched_at']})
+    response.set_etag(entry['version'])
+    response.last_modified = datetime.fromtimestamp(entry['changed_at'], tz=timezone.utc)
+    response.cache_control.public = True
+    response.cache_control.max_age = config.MAKER_CATALOG_BROWSER_MAX_AGE
+    return response.make_conditional(request)
+
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus 形式のメトリクス (段階ごとの所要時間・再試行/失敗回数・ドライバーとキューの状態)"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/api/results/<result_id>')
+def get_results(result_id):
+    """保存済みの検索結果をページ単位で返す (並べ替え・絞り込みはサーバー側で行う)"""
+    result_page = result_store.get_store().query(result_id, **_result_query_from_args(request.args))
+    if result_page is None:
+        abort(404)
+    return jsonify(result_page)
+
+
+def _get_job_or_404(job_id):
+    job = jobs.get_manager().get(job_id)
+    if job is None:
+        abort(404)
+    return job
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """検索ジョブを開始し、ジョブIDをすぐに返す"""
+    try:
+        params = _search_params_from_form(request.form)
+    except FormError as e:
+        return jsonify({'error': str(e)}), 400
+    if not params['category_name'] or not params['makers']:
+        return jsonify({'error': 'カテゴリとメーカーを選択してください。'}), 400
+    job = jobs.get_manager().submit(params)
+    return jsonify(job.to_dict()), 202
+
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """ポーリング用: ジョブの状態と、これまでに見つかった利益商品を返す"""
+    job = _get_job_or_404(job_id)
+    return jsonify(dict(job.to_dict(), results=list(job.results)))
+
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = _get_job_or_404(job_id)
+    jobs.get_manager().cancel(job_id)
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-Sent Events でジョブの進捗を配信する"""
+    job = _get_job_or_404(job_id)
+    # 再接続時はブラウザが送ってくる Last-Event-ID の次から配信する
+    last_event_id = request.headers.get('Last-Event-ID')
+    start = int(last_event_id) + 1 if last_event_id and last_event_id.isdigit() else 0
+
+    def stream():
+        index = start
+        while True:
+            events = job.events_since(index, timeout=config.JOB_EVENT_KEEPALIVE)
+            if not events:
+                if job.finished:
+                    return
+                # 接続維持のためのコメント行
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+            index = events[-1]['id'] + 1
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 if __name__ == '__main__':
-    # アプリケーション起動時に一度だけメーカーリストを読み込む
-    preload_thread = threading.Thread(target=preload_maker_lists, daemon=True)
-    preload_thread.start()
+    # 保存済みのメーカーカタログを読み込み、期限切れのカテゴリだけを裏で取り直す
+    maker_catalog.get_catalog().refresh_stale(config.PRELOAD_CATEGORIES)
+    if config.JOB_BACKEND == 'thread':
+        # ブラウザの起動を待たずに最初の検索を始められるよう、ドライバープール (または Chromium) を温めておく
+        # (本番構成ではブラウザはワーカーのプロセスだけで動かす)
+        if config.SCRAPER_ENGINE == 'playwright':
+            from scrapers import playwright_engine
+            warmup_thread = threading.Thread(target=playwright_engine.get_engine().warm_up, daemon=True)
+        else:
+            from scrapers import driver_pool
+            warmup_thread = threading.Thread(
+                target=driver_pool.get_pool().warm_up, args=(config.DRIVER_POOL_WARMUP,), daemon=True
+            )
+        warmup_thread.start()
     app.run(host='0.0.0.0', port=5001, debug=False)
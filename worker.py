@@ -0,0 +1,329 @@
+# スクレイピングのワーカー (本番構成のエントリポイント)
+#
+# ジョブキュー (job_queue) から検索ジョブ・メーカー一覧の取り直しを1件ずつ取り出して実行し、
+# 進捗と結果を書き戻すプロセスを -n 個起動して監視する。ブラウザ (Chrome / Chromium) はワーカーの
+# プロセスの中だけで動くため、ブラウザが落ちてもWebの層 (gunicorn wsgi:app) には影響しない。
+#
+# 使い方:
+#   python worker.py                       config.WORKER_PROCESSES 個のワーカーを起動する
+#   python worker.py -n 4 --metrics-port 9101
+#                                          4個起動し、各ワーカーの /metrics を 9101〜9104 番で公開する
+#
+# 起動時に、期限切れ・未取得のカテゴリのメーカー一覧の取り直しを1回だけジョブキューに登録する
+# (同じジョブキューを使う監視プロセスを複数のマシンで動かす場合は、1つを除いて --no-preload を付ける)。
+# 落ちたワーカーは起動し直し、実行中だったジョブは失敗として終わらせる。WORKER_MAX_JOBS 件のジョブを
+# 実行したワーカーも入れ替える。停止 (Ctrl+C / SIGTERM) すると、処理中のジョブを中止して
+# (見つかった分の結果は保存して) 終了する。
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+# ワーカーはジョブキューを使う構成でしか意味が無いため、config を読み込む前に固定する
+os.environ['JOB_BACKEND'] = 'queue'
+
+import config
+import job_queue
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(processName)s %(threadName)s: %(message)s'
+
+
+def worker_name(pid: int = None) -> str:
+    """ジョブキューに記録するワーカーの識別子"""
+    return f"{socket.gethostname()}:{pid or os.getpid()}"
+
+
+def _share_limits(processes: int):
+    """
+    速度制限・同時実行数・ドライバープールの大きさはプロセスごとに持つため、ワーカー全体で設定値に
+    収まるよう processes 等分する (スケジューラ・ドライバープールの生成前に呼ぶこと)
+    """
+    if processes <= 1:
+        return
+
+    def share(value: int) -> int:
+        return max(1, -(-value // processes))
+
+    config.SCHEDULER_SITES = {
+        name: {
+            **settings,
+            'rate': settings['rate'] / processes,
+            'burst': share(settings['burst']),
+            'concurrency': share(settings['concurrency']),
+        }
+        for name, settings in config.SCHEDULER_SITES.items()
+    }
+    config.KAKAKU_MAX_CONCURRENCY_PER_HOST = share(config.KAKAKU_MAX_CONCURRENCY_PER_HOST)
+    config.KAKAKU_REQUEST_INTERVAL = config.KAKAKU_REQUEST_INTERVAL * processes
+    config.DRIVER_POOL_SIZE = share(config.DRIVER_POOL_SIZE)
+    config.PLAYWRIGHT_MAX_PAGES = share(config.PLAYWRIGHT_MAX_PAGES)
+
+
+def _serve_metrics(port: int):
+    """このワーカーのメトリクスを http://0.0.0.0:port/metrics で公開する"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    import metrics
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', metrics.CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.getLogger(__name__).info(f"メトリクスを :{port}/metrics で公開します。")
+
+
+def _shutdown_browsers():
+    # multiprocessing の子プロセスは atexit を実行せずに終わるため、ブラウザはここで終了させる
+    from scrapers import driver_pool
+    driver_pool.shutdown_pool()
+    if config.SCRAPER_ENGINE == 'playwright':
+        from scrapers import playwright_engine
+        playwright_engine.shutdown_engine()
+
+
+class _Heartbeat:
+    """実行中のジョブの生存を定期的に記録し、Webの層からの中止の要求を cancel_event に伝える"""
+
+    def __init__(self, queue: job_queue.JobQueue, job_id: str, cancel_event: threading.Event):
+        self._queue = queue
+        self._job_id = job_id
+        self._cancel_event = cancel_event
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='heartbeat', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(config.WORKER_HEARTBEAT_INTERVAL):
+            try:
+                if self._queue.heartbeat(self._job_id):
+                    self._cancel_event.set()
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"ジョブ {self._job_id} の生存を記録できませんでした: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _run_search_job(queue: job_queue.JobQueue, row: dict, current: dict):
+    import jobs
+
+    class QueuedSearch(jobs.Job):
+        """進捗イベントをメモリではなくジョブキューに書き込むジョブ"""
+
+        def emit(self, event_type: str, data: dict):
+            if event_type == 'status':
+                # 開始・終了の 'status' イベントはジョブキューが状態の更新と一緒に書く
+                return
+            queue.append_event(self.id, event_type, data, makers_done=self.makers_done, result_count=len(self.results))
+
+    job = QueuedSearch(row['params'])
+    job.id = row['id']
+    job.status = job_queue.RUNNING
+    current['job'] = job
+    try:
+        with _Heartbeat(queue, job.id, job.cancel_event):
+            if queue.heartbeat(job.id) or current.get('stopping'):
+                job.cancel_event.set()
+            status = jobs.run_job(job)
+    finally:
+        current['job'] = None
+    queue.finish(job.id, status, result_id=job.result_id, error=job.error,
+                 makers_done=job.makers_done, result_count=len(job.results))
+
+
+def _run_catalog_job(queue: job_queue.JobQueue, row: dict):
+    import maker_catalog
+
+    category = row['params']['category']
+    # 取り直しは取得の期限とブラウザでの再取得で WORKER_HEARTBEAT_TIMEOUT を超えることがあるため、
+    # 検索ジョブと同じく生存を記録する (取り直しは途中で中止できないため、中止の要求は使わない)
+    with _Heartbeat(queue, row['id'], threading.Event()):
+        entry = maker_catalog.get_catalog().refresh_now(category)
+    if entry is None:
+        queue.finish(row['id'], job_queue.FAILED, error=f"カテゴリ '{category}' のメーカー一覧を取得できませんでした。")
+    else:
+        queue.finish(row['id'], job_queue.DONE)
+
+
+def run_worker(processes: int, max_jobs: int, metrics_port: int = None):
+    """ワーカーのプロセスの本体。ジョブキューからジョブを取り出して実行し続ける。"""
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    log = logging.getLogger(__name__)
+    _share_limits(processes)
+    if metrics_port:
+        _serve_metrics(metrics_port)
+
+    import maker_catalog
+
+    queue = job_queue.get_queue()
+    name = worker_name()
+    stop_event = threading.Event()
+    current = {'job': None}
+
+    def request_stop(signum, frame):
+        # 処理中のジョブは中止し、見つかった分の結果を保存してから終了する
+        current['stopping'] = True
+        stop_event.set()
+        job = current['job']
+        if job is not None:
+            job.cancel_event.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    # 保存済みのメーカーID (検索URLの組み立てに使う) を読み込んでおく
+    maker_catalog.get_catalog()
+    log.info(f"ワーカー {name} を起動しました。")
+    done = 0
+    try:
+        while not stop_event.is_set() and not (max_jobs and done >= max_jobs):
+            row = queue.claim(name)
+            if row is None:
+                stop_event.wait(config.JOB_QUEUE_POLL_INTERVAL)
+                continue
+            log.info(f"ジョブ {row['id']} ({row['kind']}) を開始します。")
+            try:
+                if row['kind'] == job_queue.SEARCH:
+                    _run_search_job(queue, row, current)
+                elif row['kind'] == job_queue.MAKER_CATALOG:
+                    _run_catalog_job(queue, row)
+                else:
+                    queue.finish(row['id'], job_queue.FAILED, error=f"不明なジョブの種類です: {row['kind']}")
+            except Exception as e:
+                log.error(f"ジョブ {row['id']} でエラーが発生しました: {e}", exc_info=True)
+                queue.finish(row['id'], job_queue.FAILED, error=str(e))
+            done += 1
+    finally:
+        _shutdown_browsers()
+    log.info(f"ワーカー {name} を終了します (実行したジョブ {done} 件)。")
+
+
+class Supervisor:
+    """ワーカーのプロセスを起動し、落ちたもの・入れ替え時期のものを起動し直す"""
+
+    def __init__(self, processes: int, max_jobs: int, metrics_port: int = None, preload: bool = True):
+        self.processes = processes
+        self.max_jobs = max_jobs
+        self.metrics_port = metrics_port
+        self.preload = preload
+        self._context = multiprocessing.get_context('spawn')
+        self._queue = job_queue.get_queue()
+        self._children = [None] * processes
+        self._restart_at = [0.0] * processes
+        self._stop = threading.Event()
+
+    def _start(self, index: int):
+        port = self.metrics_port + index if self.metrics_port else None
+        process = self._context.Process(
+            target=run_worker, args=(self.processes, self.max_jobs, port), name=f"worker-{index}"
+        )
+        process.start()
+        self._children[index] = process
+
+    def _reap(self, index: int, process) -> bool:
+        """終了したワーカーの後始末をする。異常終了なら True。"""
+        log = logging.getLogger(__name__)
+        crashed = process.exitcode != 0
+        if crashed:
+            log.warning(f"ワーカー {process.name} (pid {process.pid}) が異常終了しました (終了コード {process.exitcode})。")
+        self._queue.fail_running(
+            f"ワーカーのプロセスが終了しました (終了コード {process.exitcode})。", worker=worker_name(process.pid)
+        )
+        self._children[index] = None
+        return crashed
+
+    def stop(self):
+        self._stop.set()
+
+    def _preload_catalog(self):
+        """期限切れ・未取得のカテゴリの取り直しを登録する (登録済みの取り直しとは重複しない)"""
+        import maker_catalog
+
+        try:
+            maker_catalog.get_catalog().refresh_stale(config.PRELOAD_CATEGORIES)
+        except Exception as e:
+            # 取り直しは検索時にも登録されるため、ワーカーの起動は止めない
+            logging.getLogger(__name__).warning(f"メーカー一覧の取り直しを登録できませんでした: {e}")
+
+    def run(self) -> int:
+        log = logging.getLogger(__name__)
+        log.info(f"ワーカーを {self.processes} 個起動します (ジョブキュー: {config.JOB_QUEUE_FILE})。")
+        if self.preload:
+            self._preload_catalog()
+        for index in range(self.processes):
+            self._start(index)
+        while not self._stop.wait(1.0):
+            now = time.monotonic()
+            for index, process in enumerate(self._children):
+                if process is not None and not process.is_alive():
+                    if self._reap(index, process):
+                        self._restart_at[index] = now + config.WORKER_RESTART_DELAY
+                if self._children[index] is None and now >= self._restart_at[index]:
+                    self._start(index)
+            # 監視の外で止まったワーカー (別のマシン・強制終了された親プロセスの子など) のジョブも片付ける
+            self._queue.fail_running(
+                "ワーカーからの応答が途絶えました。", heartbeat_before=time.time() - config.WORKER_HEARTBEAT_TIMEOUT
+            )
+
+        log.info("ワーカーを停止します。処理中のジョブを中止しています…")
+        for process in self._children:
+            if process is not None and process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + config.WORKER_STOP_TIMEOUT
+        for index, process in enumerate(self._children):
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                log.warning(f"ワーカー {process.name} が終了しないため強制終了します。")
+                process.kill()
+                process.join()
+            self._reap(index, process)
+        return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="ジョブキューの検索ジョブを実行するワーカー (本番構成)")
+    parser.add_argument("-n", "--processes", type=int, default=config.WORKER_PROCESSES, help="ワーカーのプロセス数")
+    parser.add_argument("--max-jobs", type=int, default=config.WORKER_MAX_JOBS,
+                        help="1プロセスで実行するジョブ数の上限 (超えたら入れ替える、0 で入れ替えない)")
+    parser.add_argument("--metrics-port", type=int, help="ワーカーごとの /metrics をこの番号から順に公開する")
+    parser.add_argument("--no-preload", action="store_true",
+                        help="起動時にメーカー一覧の取り直しを登録しない (登録は別のマシンの監視プロセスに任せる)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    supervisor = Supervisor(max(1, args.processes), args.max_jobs, args.metrics_port, preload=not args.no_preload)
+
+    def request_stop(signum, frame):
+        supervisor.stop()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    return supervisor.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
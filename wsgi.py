@@ -0,0 +1,17 @@
+# 本番構成のWebの層 (WSGIのエントリポイント)
+#
+#   gunicorn -w 4 -k gthread --threads 16 -b 0.0.0.0:5001 wsgi:app    Webの層
+#   python worker.py -n 4                                               スクレイピングの層
+#
+# Webのプロセスは HTTP の処理だけを行い、検索ジョブとメーカー一覧の取り直しはジョブキュー
+# (config.JOB_QUEUE_FILE) に入れて worker.py のワーカーに任せる。ブラウザは起動しない。
+# 進捗の配信 (Server-Sent Events) は接続ごとにスレッドを1つ使うため、gthread などスレッドを持つ
+# ワーカークラスで起動する。2つの層は同じ作業ディレクトリ (ジョブキュー・検索結果の退避先・
+# メーカーカタログ・絞り込みの規則ファイル) を共有していれば、それぞれ別にプロセス数を変えられる。
+# このモジュールは gunicorn のワーカーごとに読み込まれるため、起動時の処理は置かない
+# (期限切れのメーカー一覧の取り直しは worker.py の起動時に1回だけ登録する)。
+import os
+
+os.environ.setdefault('JOB_BACKEND', 'queue')
+
+from web_server import app